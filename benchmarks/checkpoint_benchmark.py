@@ -0,0 +1,142 @@
+"""
+Benchmark of the cost of checkpointing a long book, step by step.
+
+It replays the steps of a book (the brainstorming, then the Writer, the Writing Reviewer and the Translator for each chapter) on
+a checkpointer, as LangGraph does: the writes of each node, then a checkpoint with the channels whose version changed, merged
+with the reducers of `State`. The chapters are synthetic, with the size of real ones, so no provider is called.
+It reports the time and the bytes written per step at the start and at the end of the book, to check that persisting the
+checkpoints doesn't slow down the long books: in memory, in SQLite saving every channel whole ('sqlite_full', before the
+delta encoding) and in SQLite with the deltas of the append-only channels and compression ('sqlite_delta').
+The bytes of SQLite are the ones stored in its tables, after the compression.
+
+    python benchmarks/checkpoint_benchmark.py --chapters 30 --paragraphs 10
+"""
+
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from src.utils import State, DocumentationReady
+from src.checkpointer import SQLiteCheckpointer, STATE_CLASSES, DEFAULT_SNAPSHOT_EVERY, append_only_channels
+
+WORDS = "the detective walked through the rain soaked streets of london while the city slept and every shadow seemed to hide a secret".split()
+
+def _text(rng: random.Random, n_paragraphs: int, n_sentences: int = 8) -> str:
+    return "\n\n".join(" ".join(" ".join(rng.choices(WORDS, k = 14)).capitalize() + "." for _ in range(n_sentences)) for _ in range(n_paragraphs))
+
+def simulate_book(n_chapters: int, n_paragraphs: int, seed: int = 7):
+    """
+    Yields the node and the update it returns for every step of a book, with the same fields the nodes of `src/nodes.py` return.
+    """
+    rng = random.Random(seed)
+    plan = {f"plannified_{field}": _text(rng, 1) for field in ['context_setting', 'inciting_incident', 'themes_conflicts_intro', 'transition_to_development', 'rising_action', 'subplots', 'midpoint', 'climax_build_up', 'climax', 'falling_action', 'resolution', 'epilogue']}
+    yield 'instructor', {'user_instructor_messages': [AIMessage(content = "Done, executed")], 'instructor_documents': DocumentationReady(reasoning_step = '', reflection_step = '', topic = 'A detective story', target_audience = 'adults', genre = 'noir', writing_style = 'dark', additional_requirements = ''), 'instructor_model': 'gpt-4o-mini'}
+    yield 'brainstorming_idea_writer', {**plan, 'plannified_messages': [SystemMessage(content = _text(rng, 3)), AIMessage(content = _text(rng, 4))], 'book_title': 'The Unseen Figure', 'book_prologue': _text(rng, 1), 'characters': _text(rng, 1), 'writing_style': 'dark', 'story_overview': _text(rng, 1)}
+    yield 'brainstorming_narrative_writer', {'plannified_chapters_messages': [SystemMessage(content = _text(rng, 3)), AIMessage(content = _text(rng, n_chapters // 2 + 1))], 'plannified_chapters_summaries': [_text(rng, 1, 3) for _ in range(n_chapters)]}
+    for n_chapter in range(1, n_chapters + 1):
+        chapter = _text(rng, n_paragraphs)
+        yield 'writer', {'content': [chapter], 'chapter_names': [f"Chapter {n_chapter}"], 'current_chapter': n_chapter, 'writer_memory': [HumanMessage(content = _text(rng, 1)), AIMessage(content = chapter)], 'writer_model': 'gpt-4o-mini'}
+        yield 'writing_reviewer', {'is_chapter_approved': True, 'content_of_approved_chapters': [chapter], 'chapter_names_of_approved_chapters': [f"Chapter {n_chapter}"], 'writing_reviewer_memory': [HumanMessage(content = chapter), AIMessage(content = 'Perfect')], 'reviewer_model': 'gpt-4o-mini'}
+    for n_chapter in range(1, n_chapters + 1):
+        translation = _text(rng, n_paragraphs)
+        yield 'translator', {'translated_content': [translation], 'translated_chapter_names': [f"Capitulo {n_chapter}"], 'translated_current_chapter': n_chapter, 'translator_memory': [HumanMessage(content = _text(rng, 1)), AIMessage(content = translation)], 'translator_model': 'gpt-4o-mini'}
+
+class CountingSerializer(JsonPlusSerializer):
+    """
+    Serializer of LangGraph that counts the bytes it produces.
+    """
+    def __init__(self):
+        super().__init__(allowed_msgpack_modules = STATE_CLASSES)
+        self.bytes_written = 0
+
+    def dumps_typed(self, obj):
+        type_, data = super().dumps_typed(obj)
+        self.bytes_written += len(data or b'')
+        return type_, data
+
+def _stored_bytes(path: str) -> int:
+    with sqlite3.connect(path) as connection:
+        return sum(connection.execute(f"SELECT COALESCE(SUM(LENGTH({column})), 0) FROM {table}").fetchone()[0] for table, column in [('checkpoints', 'checkpoint'), ('checkpoints', 'metadata'), ('blobs', 'blob'), ('writes', 'blob')])
+
+def replay(checkpointer, serde: CountingSerializer, steps, thread_id: str = 'benchmark') -> list:
+    """
+    Replays the steps on the checkpointer, measuring the time and the bytes of each one (the node writes plus the checkpoint).
+    The bytes are the ones produced by the serializer, or the ones stored in the file for SQLite.
+    """
+    appended = append_only_channels(State)
+    stored_bytes = _stored_bytes(checkpointer.path) if isinstance(checkpointer, SQLiteCheckpointer) else None
+    values, versions = {}, {}
+    config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': ''}}
+    measures = []
+    for n_step, (node, update) in enumerate(steps):
+        start_bytes = serde.bytes_written
+        start = time.perf_counter()
+        if 'checkpoint_id' in config['configurable']:
+            checkpointer.put_writes(config, list(update.items()), task_id = f"{node}-{n_step}")
+        for channel, value in update.items():
+            values[channel] = values.get(channel, []) + value if channel in appended else value
+            versions[channel] = checkpointer.get_next_version(versions.get(channel), None)
+        checkpoint = empty_checkpoint()
+        checkpoint['channel_values'] = dict(values)
+        checkpoint['channel_versions'] = dict(versions)
+        checkpoint['updated_channels'] = list(update)
+        config = checkpointer.put(config, checkpoint, {'source': 'loop', 'step': n_step}, {channel: versions[channel] for channel in update})
+        measure = {'node': node, 'ms': (time.perf_counter() - start) * 1000, 'bytes': serde.bytes_written - start_bytes}
+        if stored_bytes is not None:
+            measure['bytes'], stored_bytes = _stored_bytes(checkpointer.path) - stored_bytes, _stored_bytes(checkpointer.path)
+        measures.append(measure)
+    return measures
+
+def summarize(measures: list) -> dict:
+    tenth = max(1, len(measures) // 10)
+    first, last = measures[:tenth], measures[-tenth:]
+    writer_steps = [measure for measure in measures if measure['node'] == 'writer']
+    return {
+        'steps': len(measures),
+        'total_mb': round(sum(measure['bytes'] for measure in measures) / 1024 ** 2, 2),
+        'ms_per_step_first_10pct': round(sum(measure['ms'] for measure in first) / len(first), 3),
+        'ms_per_step_last_10pct': round(sum(measure['ms'] for measure in last) / len(last), 3),
+        'kb_per_step_first_10pct': round(sum(measure['bytes'] for measure in first) / len(first) / 1024, 1),
+        'kb_per_step_last_10pct': round(sum(measure['bytes'] for measure in last) / len(last) / 1024, 1),
+        'kb_first_writer_step': round(writer_steps[0]['bytes'] / 1024, 1) if writer_steps else None,
+        'kb_last_writer_step': round(writer_steps[-1]['bytes'] / 1024, 1) if writer_steps else None,
+    }
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = "Time and bytes written per step when checkpointing a long book.")
+    arg_parser.add_argument('--chapters', type = int, default = 30)
+    arg_parser.add_argument('--paragraphs', type = int, default = 10, help = "Paragraphs of 8 sentences in each chapter.")
+    arg_parser.add_argument('--seed', type = int, default = 7)
+    arg_parser.add_argument('--snapshot-every', type = int, default = DEFAULT_SNAPSHOT_EVERY, help = "Deltas of an append-only channel between two full snapshots.")
+    args = arg_parser.parse_args()
+
+    report = {}
+    serde = CountingSerializer()
+    report['memory'] = summarize(replay(MemorySaver(serde = serde), serde, simulate_book(args.chapters, args.paragraphs, args.seed)))
+    for name, options in [('sqlite_full', {'compression': None}), ('sqlite_delta', {'append_only': append_only_channels(State), 'snapshot_every': args.snapshot_every})]:
+        with tempfile.TemporaryDirectory() as directory:
+            serde = CountingSerializer()
+            checkpointer = SQLiteCheckpointer(os.path.join(directory, 'checkpoints.sqlite'), serde = serde, **options)
+            report[name] = summarize(replay(checkpointer, serde, simulate_book(args.chapters, args.paragraphs, args.seed)))
+            start = time.perf_counter()
+            chapters = checkpointer.load_channel({'configurable': {'thread_id': 'benchmark'}}, 'content_of_approved_chapters')
+            report[name]['ms_load_last_chapters'] = round((time.perf_counter() - start) * 1000, 3)
+            assert len(chapters) == args.chapters
+            checkpointer.close()
+            report[name]['file_mb'] = round(sum(os.path.getsize(os.path.join(directory, file_name)) for file_name in os.listdir(directory)) / 1024 ** 2, 2)
+    print(json.dumps(report, indent = 4))
@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of the book pipeline, with every agent on the offline fake provider (`src/fake_provider.py`).
+
+It runs the compiled graph of `src/agent.py` over a matrix of `n_chapters`, `min_paragraph_per_chapter`, `critiques_in_loop` and
+`language`. Each case runs in its own process, so its peak RSS is its own, and records:
+- the wall time of each node (the time of the steps of the graph where it ran, checkpointing included)
+- the LLM requests of each node, retries included
+- the characters of the prompt of each call, by chapter, to expose how the memory of the agents grows along the book
+- the peak RSS of the process and the size of the SQLite file of the checkpoints
+
+The results are written as JSON and compared with the stored baseline: the run fails if a metric of a case is worse than in the
+baseline beyond its tolerance. The times and the memory depend on the machine, so regenerate the baseline with
+`--update-baseline` on the machine that runs the check.
+
+    python benchmarks/e2e_benchmark.py --chapters 3,6 --paragraphs 5,10 --critiques false,true --languages english,spanish
+
+Other options of the configuration can be added to every case with `--config` (eg: '{"streaming": true, "patch_revisions": true}').
+The baseline also has a case for each of these modes, checked with:
+
+    python benchmarks/e2e_benchmark.py --chapters 6 --paragraphs 10 --critiques true --languages spanish --config '{"parallel_drafting": true}'
+    python benchmarks/e2e_benchmark.py --chapters 6 --paragraphs 10 --critiques true --languages spanish --config '{"pipelined_translation": true}'
+    python benchmarks/e2e_benchmark.py --chapters 6 --paragraphs 10 --critiques true --languages spanish --config '{"brainstorming_candidates": 3}'
+"""
+
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import json
+import time
+import resource
+import argparse
+import tempfile
+import itertools
+import subprocess
+from langchain_core.messages import HumanMessage
+
+BASELINE_PATH = "benchmarks/baselines/e2e_baseline.json"
+IDEA = "A noir detective story set in London in 1950, for adults, about a widow who hires a retired inspector to find who killed her husband. Dark and fast paced, with short chapters that end in cliffhangers."
+MODEL_KEYS = ['instructor_model', 'brainstormer_idea_model', 'brainstormer_critique_model', 'writer_model', 'writing_reviewer_model', 'translator_model']
+
+# Increase over the baseline tolerated for each metric of a case. The requests and the prompts are deterministic with the fake provider.
+TOLERANCES = {
+    'llm_requests': 0.0,
+    'prompt_chars': 0.02,
+    'checkpoint_mb': 0.25,
+    'peak_rss_mb': 0.25,
+    'wall_seconds': 0.5,
+}
+# Smallest increase taken as a regression, below it the difference is noise (eg: a few milliseconds in a fast case)
+MIN_DIFFERENCES = {'llm_requests': 1, 'prompt_chars': 1, 'checkpoint_mb': 0.01, 'peak_rss_mb': 5.0, 'wall_seconds': 0.1}
+MATRIX_KEYS = ['n_chapters', 'min_paragraph_per_chapter', 'critiques_in_loop', 'language']
+
+def case_id(case: dict) -> str:
+    options = "".join(f",{key}={value}" for key, value in case.items() if key not in MATRIX_KEYS)
+    return f"chapters={case['n_chapters']},paragraphs={case['min_paragraph_per_chapter']},critiques_in_loop={case['critiques_in_loop']},language={case['language']}{options}"
+
+def run_case(case: dict, latency: str, approval_rate: float) -> dict:
+    """
+    Writes a whole book with the fake provider and measures it. Meant to run in its own process.
+    """
+    from src.fake_provider import configure_fake_provider
+    from src.runner import compile_app
+    from src.checkpointer import get_checkpointer
+    from src.structured_output import get_invocation_records
+
+    configure_fake_provider(latency = latency, approval_rate = approval_rate)
+    thread_id = 'e2e-benchmark'
+    config = {
+        'configurable': {'thread_id': thread_id, **{key: 'fake' for key in MODEL_KEYS}, 'min_sentences_in_each_paragraph_per_chapter': 5, **case},
+        'recursion_limit': 1000
+    }
+    node_seconds = {}
+    with tempfile.TemporaryDirectory() as directory:
+        checkpointer = get_checkpointer(os.path.join(directory, 'checkpoints.sqlite'))
+        app = compile_app(checkpointer)
+        start = last = time.perf_counter()
+        for update in app.stream({'user_instructor_messages': [HumanMessage(content = IDEA)]}, config, stream_mode = 'updates'):
+            now = time.perf_counter()
+            # The nodes of this graph run one per step, so the time of the step is the time of its node
+            for node in update:
+                node_seconds[node] = node_seconds.get(node, 0.0) + now - last
+            last = now
+        wall_seconds = time.perf_counter() - start
+        values = app.get_state(config).values
+        checkpointer.close()
+        checkpoint_bytes = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    if len(values.get('content_of_approved_chapters', [])) != case['n_chapters']:
+        raise RuntimeError(f"The book of the case {case_id(case)} wasn't finished: {len(values.get('content_of_approved_chapters', []))} approved chapters")
+    unnamed = [n_chapter for n_chapter, chapter_name in enumerate(values['chapter_names_of_approved_chapters'], start = 1) if not chapter_name.strip()]
+    if unnamed:
+        raise RuntimeError(f"The book of the case {case_id(case)} has chapters without a name: {unnamed}")
+
+    records = get_invocation_records(thread_id)
+    per_node = {node: {'wall_seconds': round(seconds, 4), 'calls': 0, 'llm_requests': 0, 'prompt_chars': 0} for node, seconds in node_seconds.items()}
+    prompt_chars_by_chapter = {}
+    for record in records:
+        # The records are labelled by agent, which isn't always the graph node that made the call (eg: the Writer in the parallel_writer node)
+        node = per_node.setdefault(record['node'], {'wall_seconds': 0.0, 'calls': 0, 'llm_requests': 0, 'prompt_chars': 0})
+        node['calls'] += 1
+        node['llm_requests'] += record['attempts']
+        node['prompt_chars'] += record['prompt_chars']
+        if record['chapter'] is not None and record['attempts'] > 0:
+            prompt_chars_by_chapter.setdefault(record['node'], {}).setdefault(str(record['chapter']), []).append(record['prompt_chars'] // record['attempts'])
+    return {
+        'case': case,
+        'wall_seconds': round(wall_seconds, 3),
+        'llm_requests': sum(record['attempts'] for record in records),
+        'prompt_chars': sum(record['prompt_chars'] for record in records),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'checkpoint_mb': round(checkpoint_bytes / 1024 ** 2, 3),
+        'per_node': per_node,
+        # Mean characters of the prompt of each call, per node and chapter
+        'prompt_chars_by_chapter': {node: {chapter: sum(sizes) // len(sizes) for chapter, sizes in chapters.items()} for node, chapters in prompt_chars_by_chapter.items()},
+    }
+
+def run_case_in_process(case: dict, latency: str, approval_rate: float) -> dict:
+    with tempfile.NamedTemporaryFile(suffix = '.json') as output:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case), '--case-output', output.name, '--latency', latency, '--approval-rate', str(approval_rate)], check = True, stdout = subprocess.DEVNULL)
+        with open(output.name) as f:
+            return json.load(f)
+
+def compare(results: dict, baseline: dict, time_tolerance: float) -> list:
+    """
+    :return: The metrics of the cases that are worse than in the baseline beyond their tolerance
+    """
+    tolerances = {**TOLERANCES, 'wall_seconds': time_tolerance}
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric, tolerance in tolerances.items():
+            expected, measured = baseline[name][metric], result[metric]
+            if measured > expected * (1 + tolerance) and measured - expected >= MIN_DIFFERENCES[metric]:
+                regressions.append({'case': name, 'metric': metric, 'baseline': expected, 'measured': measured, 'tolerance': tolerance})
+    return regressions
+
+def _parse_list(value: str, cast) -> list:
+    return [cast(item.strip()) for item in value.split(',') if item.strip() != '']
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() not in ['true', 'false']:
+        raise argparse.ArgumentTypeError(f"Expected true or false, got '{value}'")
+    return value.lower() == 'true'
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = "End-to-end benchmark of the book pipeline with the fake provider, compared with a stored baseline.")
+    arg_parser.add_argument('--chapters', default = '3,6', help = "Values of n_chapters, comma separated.")
+    arg_parser.add_argument('--paragraphs', default = '5,10', help = "Values of min_paragraph_per_chapter, comma separated.")
+    arg_parser.add_argument('--critiques', default = 'false,true', help = "Values of critiques_in_loop, comma separated.")
+    arg_parser.add_argument('--languages', default = 'english,spanish', help = "Values of language, comma separated.")
+    arg_parser.add_argument('--latency', default = 'fixed:0', help = "Latency of the fake provider, see src/fake_provider.py. By default none, to measure the overhead of the orchestration.")
+    arg_parser.add_argument('--approval-rate', type = float, default = 0.7, help = "Probability that the critiques and the reviewers of the fake provider approve, so the critique loops run.")
+    arg_parser.add_argument('--config', type = json.loads, default = {}, help = "Other options of the configuration for every case, as a JSON object.")
+    arg_parser.add_argument('--output', default = 'benchmarks/e2e_results.json')
+    arg_parser.add_argument('--baseline', default = BASELINE_PATH)
+    arg_parser.add_argument('--update-baseline', action = 'store_true', help = "Save the results as the new baseline instead of comparing them.")
+    arg_parser.add_argument('--time-tolerance', type = float, default = TOLERANCES['wall_seconds'], help = "Increase of the wall time over the baseline tolerated in each case.")
+    arg_parser.add_argument('--case', default = None, help = argparse.SUPPRESS)
+    arg_parser.add_argument('--case-output', default = None, help = argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.case is not None:
+        result = run_case(json.loads(args.case), args.latency, args.approval_rate)
+        with open(args.case_output, "w") as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    cases = [
+        {'n_chapters': n_chapters, 'min_paragraph_per_chapter': n_paragraphs, 'critiques_in_loop': critiques_in_loop, 'language': language, **args.config}
+        for n_chapters, n_paragraphs, critiques_in_loop, language in itertools.product(_parse_list(args.chapters, int), _parse_list(args.paragraphs, int), _parse_list(args.critiques, _parse_bool), _parse_list(args.languages, str))
+    ]
+    results = {}
+    for n_case, case in enumerate(cases, start = 1):
+        results[case_id(case)] = run_case_in_process(case, args.latency, args.approval_rate)
+        result = results[case_id(case)]
+        print(f"[{n_case}/{len(cases)}] {case_id(case)}: {result['wall_seconds']} seconds, {result['llm_requests']} LLM requests, {result['prompt_chars']} prompt characters, {result['peak_rss_mb']} MB of peak RSS, {result['checkpoint_mb']} MB of checkpoints")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok = True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 4)
+    print(f"The results were saved in {args.output}")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok = True)
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent = 4)
+        print(f"The baseline was updated in {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        sys.exit(f"There is no baseline in {args.baseline}. Create it with --update-baseline.")
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    missing = [name for name in results if name not in baseline]
+    if missing:
+        print(f"These cases are not in the baseline, so they were not compared: {missing}")
+    regressions = compare(results, baseline, args.time_tolerance)
+    if regressions:
+        print("Regressions against the baseline:\n" + json.dumps(regressions, indent = 4))
+        sys.exit(1)
+    print("No regressions against the baseline.")
@@ -0,0 +1,177 @@
+"""
+Benchmark of the tolerant JSON parser used by `cleaning_llm_output`.
+
+The corpus is seeded from the sample reply of the Writer Agent in the `__main__` block of `src/utils.py`. Each case serializes a golden
+object with some of the mistakes the models make (unescaped quotes, raw line breaks, single quotes, trailing commas, unterminated fences...),
+so the expected result of every case is known. It reports the recovery rate and the parse time per KB, against the strict `json` decoder.
+
+    python benchmarks/json_parser_benchmark.py --fuzz-cases 200 --seed 7
+"""
+
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import ast
+import json
+import time
+import random
+import argparse
+from src.json_parser import NoJson, BadFormattedJson, parse_llm_json
+
+MISTAKES = ['single_quotes', 'unescaped_quotes', 'raw_newlines', 'trailing_commas', 'unquoted_keys', 'python_literals', 'missing_commas']
+WRAPPERS = ['fenced', 'unterminated_fence', 'inline_with_prose', 'fence_without_language']
+
+def load_seed_reply() -> str:
+    """
+    Reads the sample reply from the `__main__` block of `src/utils.py`, without running it.
+    """
+    with open('src/utils.py') as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree.body[-1]):
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'AIMessage':
+            return node.keywords[0].value.value
+    raise ValueError("The sample reply was not found in the __main__ block of src/utils.py")
+
+def golden_objects() -> list:
+    """
+    The sample reply was truncated by the model (the `content` string is never closed), so it is closed here to build the golden objects.
+    """
+    reply = load_seed_reply()
+    body = reply.split('```json', 1)[1].rsplit('```', 1)[0].rstrip()
+    writer_output = json.loads(body + '"\n}')
+    writer_output['chapter_name'] = 'The Unseen Figure'
+    paragraphs = writer_output['content'].split('\n\n')
+    narrative_output = {
+        'reasoning_step': writer_output['reasoning_step'],
+        'chapters_summaries': paragraphs,
+        'grade': 8,
+        'is_approved': True,
+        'feedback': None,
+        'scores': {'pacing': 7.5, 'dialogue': 9, 'characters': [{'name': 'Mark Thompson', 'role': 'detective'}, {'name': 'Sarah Jenkins', 'role': 'widow'}]},
+    }
+    return [writer_output, narrative_output]
+
+def _serialize_string(value: str, mistakes: set) -> str:
+    quote = "'" if 'single_quotes' in mistakes else '"'
+    text = value.replace('\\', '\\\\')
+    if 'unescaped_quotes' not in mistakes:
+        text = text.replace(quote, '\\' + quote)
+    if 'raw_newlines' not in mistakes:
+        text = text.replace('\n', '\\n')
+    return quote + text + quote
+
+def serialize(value, mistakes: set, indent: int = 0) -> str:
+    """
+    Writes the value as JSON, but making the given mistakes.
+    """
+    padding = '\n' + ' ' * (indent + 2)
+    separator = padding if 'missing_commas' in mistakes else ',' + padding
+    trailing = ',' if 'trailing_commas' in mistakes else ''
+    if isinstance(value, dict):
+        items = []
+        for key, item in value.items():
+            key = key if 'unquoted_keys' in mistakes else _serialize_string(key, mistakes - {'unescaped_quotes'})
+            items.append(f"{key}: {serialize(item, mistakes, indent + 2)}")
+        return '{' + padding + separator.join(items) + trailing + '\n' + ' ' * indent + '}'
+    if isinstance(value, list):
+        items = [serialize(item, mistakes, indent + 2) for item in value]
+        return '[' + padding + (',' + padding).join(items) + trailing + '\n' + ' ' * indent + ']'
+    if isinstance(value, str):
+        return _serialize_string(value, mistakes)
+    if 'python_literals' in mistakes and (value is None or isinstance(value, bool)):
+        return repr(value)
+    return json.dumps(value)
+
+def wrap(text: str, wrapper: str) -> str:
+    if wrapper == 'fenced':
+        return f"```json\n{text}\n```"
+    if wrapper == 'unterminated_fence':
+        return f"```json\n{text}\n"
+    if wrapper == 'fence_without_language':
+        return f"Here is the chapter:\n```\n{text}\n```"
+    return f"Sure! Here is the output you asked for: {text}\nLet me know if you need any adjustment."
+
+def build_corpus(n_fuzz_cases: int, seed: int) -> list:
+    """
+    Returns the cases as dicts with the input text, the expected object (None when the case must be rejected) and its name.
+    The golden cases make one mistake at a time, the fuzzed ones combine a random subset of them.
+    """
+    rng = random.Random(seed)
+    cases = []
+    for n_object, golden in enumerate(golden_objects()):
+        cases.append({'name': f'golden_{n_object}_valid', 'text': wrap(json.dumps(golden, indent = 4, ensure_ascii = False), 'fenced'), 'expected': golden})
+        for wrapper in WRAPPERS:
+            cases.append({'name': f'golden_{n_object}_{wrapper}', 'text': wrap(serialize(golden, set()), wrapper), 'expected': golden})
+        for mistake in MISTAKES:
+            cases.append({'name': f'golden_{n_object}_{mistake}', 'text': wrap(serialize(golden, {mistake}), 'fenced'), 'expected': golden})
+        text = serialize(golden, set())
+        cases.append({'name': f'golden_{n_object}_truncated', 'text': wrap(text[:len(text) // 2], 'unterminated_fence'), 'expected': None})
+    cases.append({'name': 'golden_plain_text', 'text': load_seed_reply().split('```json', 1)[0] + 'Could you tell me the genre of the book?', 'expected': None})
+
+    goldens = golden_objects()
+    for n_case in range(n_fuzz_cases):
+        golden = rng.choice(goldens)
+        mistakes = set(rng.sample(MISTAKES, rng.randint(1, 3)))
+        wrapper = rng.choice(WRAPPERS)
+        cases.append({'name': f"fuzz_{n_case}_{'+'.join(sorted(mistakes))}_{wrapper}", 'text': wrap(serialize(golden, mistakes), wrapper), 'expected': golden})
+    return cases
+
+def strict_parse(content: str):
+    """
+    Reference: the strict decoder over the fenced block, which is what succeeds without any recovery.
+    """
+    start = content.find('```json')
+    if start == -1:
+        raise NoJson()
+    return json.loads(content[start + len('```json'):].split('```')[0])
+
+def run(cases: list, parser, repeat: int) -> dict:
+    recovered, rejected, wrong, failures = 0, 0, 0, []
+    total_seconds, total_kb = 0.0, 0.0
+    for case in cases:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            try:
+                result = parser(case['text'])
+            except (NoJson, BadFormattedJson, ValueError) as e:
+                result = e
+        total_seconds += (time.perf_counter() - start) / repeat
+        total_kb += len(case['text'].encode('utf-8')) / 1024
+        if case['expected'] is None:
+            rejected += 1 if isinstance(result, Exception) else 0
+        elif result == case['expected']:
+            recovered += 1
+        else:
+            wrong += 0 if isinstance(result, Exception) else 1
+            failures.append(case['name'])
+    n_recoverable = sum(1 for case in cases if case['expected'] is not None)
+    return {
+        'recovery_rate': round(recovered / n_recoverable, 4),
+        'recovered': recovered,
+        'recoverable_cases': n_recoverable,
+        'wrongly_parsed': wrong,
+        'correctly_rejected': f"{rejected}/{len(cases) - n_recoverable}",
+        'ms_per_kb': round(total_seconds * 1000 / total_kb, 4),
+        'failures': failures[:20],
+    }
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = "Recovery rate and parse time of the tolerant JSON parser.")
+    arg_parser.add_argument('--fuzz-cases', type = int, default = 200)
+    arg_parser.add_argument('--seed', type = int, default = 7)
+    arg_parser.add_argument('--repeat', type = int, default = 5)
+    args = arg_parser.parse_args()
+
+    cases = build_corpus(n_fuzz_cases = args.fuzz_cases, seed = args.seed)
+    print(f"Corpus: {len(cases)} cases, {sum(len(case['text']) for case in cases) / 1024:.1f} KB")
+    report = {
+        'parse_llm_json': run(cases, parse_llm_json, args.repeat),
+        'strict_json': run(cases, strict_parse, args.repeat),
+    }
+    print(json.dumps(report, indent = 4))
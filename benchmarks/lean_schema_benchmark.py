@@ -0,0 +1,127 @@
+"""
+A/B benchmark of the lean schemas (`lean_schemas`) against the current ones, with the reasoning and reflection steps.
+
+It writes the same book twice, once with every agent asking for the reasoning and reflection steps ('full') and once with the
+Instructor, the Brainstorming Idea and Narrative agents and the Writer answering without them ('lean'), and compares, for those agents:
+- the output tokens of their calls (and the input tokens, as their memories are re-sent)
+- the latency of the Writer per chapter (the sum of its calls for the chapter, revisions and retries included)
+- the parse-failure rate: the share of their attempts whose reply wasn't a valid JSON object of the schema
+
+By default the models are the offline fake provider, whose replies are generated from the schema in the prompt: its output
+tokens and latency follow the schema, but its parse failures only follow the configured rates. Run it with a real provider
+(`--model openai`, etc.) to measure how the models behave with each schema.
+
+    python benchmarks/lean_schema_benchmark.py --chapters 5 --model fake --latency fixed:0.2 --tokens-per-second 80
+"""
+
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import json
+import time
+import argparse
+from langchain_core.messages import HumanMessage
+
+IDEA = "A noir detective story set in London in 1950, for adults, about a widow who hires a retired inspector to find who killed her husband. Dark and fast paced, with short chapters that end in cliffhangers."
+MODEL_KEYS = ['instructor_model', 'brainstormer_idea_model', 'brainstormer_critique_model', 'writer_model', 'writing_reviewer_model', 'translator_model']
+LEAN_KEYS = ['instructor_model', 'brainstormer_idea_model', 'writer_model']
+# The agents of LEAN_KEYS, as they are recorded by `structured_output`
+LEAN_AGENTS = ['instructor', 'brainstorming_idea_writer', 'brainstorming_narrative_writer', 'writer']
+
+def run_variant(variant: str, args) -> dict:
+    """
+    Writes the book with the full or the lean schemas, and measures the calls of the agents of LEAN_KEYS.
+    """
+    from src.runner import compile_app
+    from src.structured_output import get_invocation_records
+
+    thread_id = f"lean-schema-benchmark-{variant}-{int(time.time())}"
+    config = {
+        'configurable': {
+            'thread_id': thread_id,
+            **{key: args.model for key in MODEL_KEYS},
+            'n_chapters': args.chapters,
+            'min_paragraph_per_chapter': args.paragraphs,
+            'min_sentences_in_each_paragraph_per_chapter': args.sentences,
+            'critiques_in_loop': args.critiques,
+            'language': 'english',
+            'lean_schemas': LEAN_KEYS if variant == 'lean' else [],
+            # The cached replies would hide the cost of the calls
+            'cached_nodes': [],
+        },
+        'recursion_limit': 1000
+    }
+    app = compile_app()
+    start = time.perf_counter()
+    app.invoke({'user_instructor_messages': [HumanMessage(content = IDEA)]}, config)
+    wall_seconds = time.perf_counter() - start
+
+    records = [record for record in get_invocation_records(thread_id) if record['agent'] in LEAN_AGENTS]
+    per_node = {}
+    for record in records:
+        node = per_node.setdefault(record['agent'], {'calls': 0, 'attempts': 0, 'parse_failures': 0, 'input_tokens': 0, 'output_tokens': 0})
+        node['calls'] += 1
+        node['attempts'] += record['attempts']
+        # The provider errors (429, timeouts) are retried by the client, the failures recorded here are the invalid replies
+        node['parse_failures'] += len(record['failures'])
+        node['input_tokens'] += record['input_tokens']
+        node['output_tokens'] += record['output_tokens']
+    writer_seconds = {}
+    for record in records:
+        if record['agent'] == 'writer' and record['chapter'] is not None:
+            writer_seconds[record['chapter']] = writer_seconds.get(record['chapter'], 0.0) + record['latency_seconds']
+    attempts = sum(node['attempts'] for node in per_node.values())
+    return {
+        'wall_seconds': round(wall_seconds, 3),
+        'output_tokens': sum(node['output_tokens'] for node in per_node.values()),
+        'input_tokens': sum(node['input_tokens'] for node in per_node.values()),
+        'writer_seconds_per_chapter': round(sum(writer_seconds.values()) / max(1, len(writer_seconds)), 3),
+        'parse_failure_rate': round(sum(node['parse_failures'] for node in per_node.values()) / max(1, attempts), 4),
+        'per_node': per_node,
+    }
+
+def _parse_bool(value: str) -> bool:
+    if value.lower() not in ['true', 'false']:
+        raise argparse.ArgumentTypeError(f"Expected true or false, got '{value}'")
+    return value.lower() == 'true'
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = "A/B benchmark of the lean schemas (without reasoning and reflection steps) against the full ones.")
+    arg_parser.add_argument('--model', default = 'fake', help = "Provider of every agent: 'fake' (offline) or a real one ('openai', 'google', ...).")
+    arg_parser.add_argument('--chapters', type = int, default = 5)
+    arg_parser.add_argument('--paragraphs', type = int, default = 8, help = "Value of min_paragraph_per_chapter.")
+    arg_parser.add_argument('--sentences', type = int, default = 5, help = "Value of min_sentences_in_each_paragraph_per_chapter.")
+    arg_parser.add_argument('--critiques', type = _parse_bool, default = False, help = "Value of critiques_in_loop.")
+    arg_parser.add_argument('--latency', default = 'fixed:0.2', help = "Latency of the fake provider until the first token, see src/fake_provider.py.")
+    arg_parser.add_argument('--tokens-per-second', type = float, default = 80.0, help = "Generation speed of the fake provider, so its latency grows with the output.")
+    arg_parser.add_argument('--bad-json-rate', type = float, default = 0.0, help = "Rate of truncated JSON replies of the fake provider.")
+    arg_parser.add_argument('--output', default = 'benchmarks/lean_schema_results.json')
+    args = arg_parser.parse_args()
+
+    if args.model == 'fake':
+        from src.fake_provider import configure_fake_provider
+        configure_fake_provider(latency = args.latency, tokens_per_second = args.tokens_per_second, bad_json_rate = args.bad_json_rate)
+
+    results = {}
+    for variant in ['full', 'lean']:
+        results[variant] = run_variant(variant, args)
+        result = results[variant]
+        print(f"[{variant}] {result['output_tokens']} output tokens, {result['input_tokens']} input tokens, {result['writer_seconds_per_chapter']} seconds of the Writer per chapter, {result['parse_failure_rate']:.2%} of parse failures, {result['wall_seconds']} seconds")
+
+    full, lean = results['full'], results['lean']
+    results['lean_vs_full'] = {
+        metric: round(lean[metric] / full[metric] - 1, 4) if full[metric] else None
+        for metric in ['output_tokens', 'input_tokens', 'writer_seconds_per_chapter', 'wall_seconds']
+    }
+    print("Lean against full: " + ", ".join(f"{metric} {change:+.1%}" for metric, change in results['lean_vs_full'].items() if change is not None))
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok = True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 4)
+    print(f"The results were saved in {args.output}")
@@ -0,0 +1,141 @@
+import os
+import time
+import json
+from typing import Any, Dict, List, Optional
+from langchain_core.messages import AIMessage, AnyMessage
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Default action when a budget cap of the book is reached: 'stop' raises BudgetExceeded, 'degrade' skips the critiques and reviews
+DEFAULT_BUDGET_ACTION = 'stop'
+
+class BudgetExceeded(Exception):
+    pass
+
+_encoding = None
+
+def count_tokens(text: str) -> int:
+    """
+    Local estimate of the tokens of a text, for the providers that don't return the usage.
+    It uses tiktoken when it is installed (and its encoding can be loaded), otherwise 4 characters per token.
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding file can't be downloaded
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4
+    return len(_encoding.encode(text, disallowed_special = ()))
+
+def _message_text(message: AnyMessage) -> str:
+    return message.content if isinstance(message.content, str) else json.dumps(message.content)
+
+def usage_from_message(messages: List[AnyMessage], output: AIMessage) -> Dict[str, Any]:
+    """
+    Reads the prompt and completion tokens of a reply from its usage metadata, estimating them locally when the provider omits it.
+    Replies served by the response cache are flagged, since they didn't consume anything.
+    """
+    usage = output.usage_metadata or {}
+    from_cache = bool((output.response_metadata or {}).get('from_cache', False))
+    if usage.get('input_tokens') or usage.get('output_tokens'):
+        return {'input_tokens': usage.get('input_tokens', 0), 'output_tokens': usage.get('output_tokens', 0), 'estimated': False, 'from_cache': from_cache}
+    return {
+        'input_tokens': sum(count_tokens(_message_text(message)) for message in messages),
+        'output_tokens': count_tokens(_message_text(output)),
+        'estimated': True,
+        'from_cache': from_cache,
+    }
+
+def spent_tokens(records: List[Dict[str, Any]]) -> int:
+    return sum(record['input_tokens'] + record['output_tokens'] for record in records)
+
+def add_to_budget_totals(totals: Dict[str, Any], record: Dict[str, Any]):
+    totals['tokens'] += record['input_tokens'] + record['output_tokens']
+    totals['started_at'] = record['started_at'] if totals['started_at'] is None else min(totals['started_at'], record['started_at'])
+
+def budget_totals(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    What the budget caps of a book are checked against: the tokens it has spent and when its first LLM call started.
+    """
+    totals = {'tokens': 0, 'started_at': None}
+    for record in records:
+        add_to_budget_totals(totals, record)
+    return totals
+
+def budget_status(config, totals: Dict[str, Any]) -> Optional[str]:
+    """
+    Returns why the book is over one of its budget caps (`max_tokens_per_book`, `max_seconds_per_book`), or None if it is within them.
+    The time is counted from the first LLM call of the book.
+
+    :param totals: The running totals of the book, see `budget_totals`
+    """
+    max_tokens = config['configurable'].get('max_tokens_per_book', None)
+    max_seconds = config['configurable'].get('max_seconds_per_book', None)
+    if max_tokens is not None and totals['tokens'] >= max_tokens:
+        return f"the book has spent {totals['tokens']} tokens of its budget of {max_tokens}"
+    if max_seconds is not None and totals['started_at'] is not None:
+        elapsed = time.time() - totals['started_at']
+        if elapsed >= max_seconds:
+            return f"the book has run for {elapsed:.0f} seconds of its budget of {max_seconds}"
+    return None
+
+def _new_totals() -> Dict[str, Any]:
+    return {'calls': 0, 'llm_requests': 0, 'retries': 0, 'cached_requests': 0, 'estimated_requests': 0, 'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0, 'seconds': 0.0}
+
+def _add(totals: Dict[str, Any], record: Dict[str, Any]):
+    totals['calls'] += 1
+    totals['llm_requests'] += record['attempts']
+    totals['retries'] += len(record['failures'])
+    totals['cached_requests'] += record['cached_attempts']
+    totals['estimated_requests'] += record['estimated_attempts']
+    totals['input_tokens'] += record['input_tokens']
+    totals['output_tokens'] += record['output_tokens']
+    totals['total_tokens'] += record['input_tokens'] + record['output_tokens']
+    totals['seconds'] = round(totals['seconds'] + record['latency_seconds'], 3)
+
+def build_run_report(records: List[Dict[str, Any]], config = None, models: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Aggregates the LLM calls of a book: prompt and completion tokens, calls, retries and time, in total, per node and per chapter.
+    Tokens of the replies served by the cache are not counted.
+    """
+    totals = _new_totals()
+    per_node, per_chapter = {}, {}
+    for record in records:
+        _add(totals, record)
+        _add(per_node.setdefault(record['node'], _new_totals()), record)
+        if record.get('chapter') is not None:
+            _add(per_chapter.setdefault(str(record['chapter']), _new_totals()), record)
+    wall_seconds = max(record['started_at'] + record['latency_seconds'] for record in records) - min(record['started_at'] for record in records) if records else 0.0
+    return {
+        'thread_id': records[0]['thread_id'] if records else None,
+        'models': models or {},
+        'wall_seconds': round(wall_seconds, 3),
+        'totals': totals,
+        'per_node': per_node,
+        'per_chapter': dict(sorted(per_chapter.items(), key = lambda item: int(item[0]))),
+        'budget': {
+            'max_tokens_per_book': config['configurable'].get('max_tokens_per_book') if config else None,
+            'max_seconds_per_book': config['configurable'].get('max_seconds_per_book') if config else None,
+            'exceeded': budget_status(config, budget_totals(records)) if config else None,
+        },
+    }
+
+def format_run_report(report: Dict[str, Any]) -> str:
+    """
+    Short human readable version of the run report, for the assembled book.
+    """
+    totals = report['totals']
+    return (f"- Tokens: {totals['total_tokens']} (prompt: {totals['input_tokens']}, completion: {totals['output_tokens']})\n"
+            f"- LLM requests: {totals['llm_requests']} (retries: {totals['retries']}, served by the cache: {totals['cached_requests']})\n"
+            f"- Time: {report['wall_seconds']} seconds")
+
+def write_run_report(report: Dict[str, Any], path: str):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent = 4)
@@ -21,7 +21,11 @@ def defining_nodes(workflow: StateGraph):
     workflow.add_node("brainstorming_narrative_critique", brainstorming_narrative_critique)
     workflow.add_node("writer", generate_content)
     workflow.add_node("writing_reviewer", evaluate_chapter)
+    workflow.add_node("parallel_writer", generate_parallel_drafts)
+    workflow.add_node("continuity_editor", reconcile_chapters)
     workflow.add_node("translator", generate_translation)
+    workflow.add_node("title_translator", generate_title_translation)
+    workflow.add_node("chapter_translator", generate_pipelined_translation)
     workflow.add_node("assembler", assembling_book)
 
     return workflow
@@ -44,14 +48,24 @@ def defining_edges(workflow: StateGraph):
         "translator",
         has_translator_ended_book
     )
+    workflow.add_conditional_edges(
+        "chapter_translator",
+        has_pipelined_translator_ended_book
+    )
+    workflow.add_edge("title_translator", END)
     workflow.add_edge("brainstorming_idea_critique","brainstorming_idea_writer")
     workflow.add_edge("brainstorming_narrative_critique","brainstorming_narrative_writer")
     workflow.add_edge("writer","writing_reviewer")
+    workflow.add_edge("parallel_writer","continuity_editor")
     workflow.add_edge("assembler",END)
     workflow.add_conditional_edges(
         "writing_reviewer",
         has_writer_ended_book
     )
+    workflow.add_conditional_edges(
+        "continuity_editor",
+        has_writer_ended_book
+    )
 
     return workflow
 
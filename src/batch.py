@@ -0,0 +1,204 @@
+"""
+Non-interactive generation of a catalogue of books, from a manifest of jobs.
+
+Each job has an idea for the Instructor Agent and its overrides of the configuration (`GraphConfig`). In JSONL, one job per line:
+
+    {"id": "noir-01", "idea": "A detective story in London...", "config": {"language": "spanish", "n_chapters": 6}}
+
+In YAML, either a list of jobs or a mapping with the `defaults` configuration of every job and the `jobs`:
+
+    defaults: {writer_model: google, n_chapters: 8}
+    jobs:
+      - {id: noir-01, idea: "A detective story in London...", config: {language: spanish}}
+
+    python src/batch.py catalogue.yaml --workers 16
+
+Every job runs in its own thread (`<manifest name>-<job id>`) of the same app, a pool of `--workers` books at a time in one event loop.
+A failed book doesn't stop the others: the status of every job is appended to a JSONL file as soon as it finishes.
+The books are checkpointed in a SQLite file, so running the manifest again resumes the unfinished books where they stopped.
+"""
+
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import json
+import time
+import copy
+import asyncio
+import argparse
+import traceback
+from typing import Any, Dict, List, Optional
+import yaml
+from src.runner import compile_app, arun_book, save_book
+from src.checkpointer import get_checkpointer
+from src.structured_output import get_invocation_records, clear_invocation_records, describe_progress_event
+from src.accounting import BudgetExceeded, build_run_report
+from src.model_registry import configure_pool, get_pool_settings
+from src.rate_limiter import get_rate_limit_report
+
+MODEL_CONFIG_KEYS = ['instructor_model', 'brainstormer_idea_model', 'brainstormer_critique_model', 'writer_model', 'writing_reviewer_model', 'translator_model']
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Reads the jobs of a JSONL or YAML manifest, with the defaults merged into the configuration of each job.
+    The jobs without an `id` are numbered by their position.
+    """
+    with open(path) as f:
+        if path.endswith('.jsonl'):
+            defaults, raw_jobs = {}, [json.loads(line) for line in f if line.strip() != '']
+        else:
+            manifest = yaml.safe_load(f)
+            defaults, raw_jobs = (manifest.get('defaults', {}), manifest['jobs']) if isinstance(manifest, dict) else ({}, manifest)
+
+    jobs, ids = [], set()
+    for n_job, raw_job in enumerate(raw_jobs):
+        if not raw_job.get('idea'):
+            raise ValueError(f"The job {n_job} of the manifest doesn't have an idea.")
+        job_id = str(raw_job.get('id', n_job))
+        if job_id in ids:
+            raise ValueError(f"The id '{job_id}' is repeated in the manifest.")
+        ids.add(job_id)
+        jobs.append({'id': job_id, 'idea': raw_job['idea'], 'config': {**defaults, **raw_job.get('config', {})}})
+    return jobs
+
+def _job_config(job: Dict[str, Any], batch_name: str, recursion_limit: int) -> dict:
+    return {
+        "configurable": {**copy.deepcopy(job['config']), "thread_id": f"{batch_name}-{job['id']}"},
+        "recursion_limit": recursion_limit
+    }
+
+def _job_usage(thread_id: str, run_report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    The usage of the job, from its run report if it finished (`arun_book` drops its records), otherwise from the records of its calls.
+    """
+    totals = (run_report if run_report is not None else build_run_report(get_invocation_records(thread_id)))['totals']
+    return {'total_tokens': totals['total_tokens'], 'llm_requests': totals['llm_requests'], 'retries': totals['retries']}
+
+class BatchProgress:
+    """
+    Keeps the status of the jobs and the throughput of the batch, and appends each finished job to the status file.
+    """
+    def __init__(self, n_jobs: int, status_path: str):
+        self.n_jobs = n_jobs
+        self.status_path = status_path
+        self.started_at = time.time()
+        self.statuses: List[Dict[str, Any]] = []
+        os.makedirs(os.path.dirname(status_path) or '.', exist_ok = True)
+
+    def finish(self, status: Dict[str, Any]):
+        self.statuses.append(status)
+        with open(self.status_path, "a") as f:
+            f.write(json.dumps(status) + "\n")
+        summary = self.summary()
+        print(f"[{summary['finished']}/{self.n_jobs}] The book '{status['job_id']}' finished with the status '{status['status']}' in {status['seconds']} seconds. "
+              f"Throughput: {summary['books_per_hour']} books per hour, {summary['tokens_per_minute']} tokens per minute.")
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        by_status = {}
+        for status in self.statuses:
+            by_status[status['status']] = by_status.get(status['status'], 0) + 1
+        done = by_status.get('done', 0)
+        tokens = sum(status['usage']['total_tokens'] for status in self.statuses)
+        return {
+            'jobs': self.n_jobs,
+            'finished': len(self.statuses),
+            'by_status': by_status,
+            'elapsed_seconds': round(elapsed, 1),
+            'books_per_hour': round(done * 3600 / elapsed, 2) if elapsed > 0 else 0.0,
+            'tokens_per_minute': round(tokens * 60 / elapsed) if elapsed > 0 else 0,
+        }
+
+def _print_progress(thread_id: str, event: dict):
+    print(f"[{thread_id}] {describe_progress_event(event)}")
+
+async def _run_job(app, job: Dict[str, Any], config: dict, progress: BatchProgress, verbose: bool) -> Dict[str, Any]:
+    thread_id = config['configurable']['thread_id']
+    start = time.time()
+    status = {'job_id': job['id'], 'thread_id': thread_id}
+    run_report = None
+    try:
+        result = await arun_book(app, job['idea'], config, on_progress = _print_progress if verbose else None)
+        status['status'] = result['status']
+        if result['status'] == 'done':
+            run_report = result['values'].get('run_report')
+            status['files'] = save_book(result['values'], config['configurable'].get('language'))
+        else:
+            status['question'] = result['question']
+    except BudgetExceeded as e:
+        status['status'] = 'budget_exceeded'
+        status['error'] = str(e)
+    except Exception as e:
+        print(f"The book '{job['id']}' failed, the rest of the batch will continue: {e!r}")
+        status['status'] = 'failed'
+        status['error'] = repr(e)
+        status['traceback'] = traceback.format_exc(limit = 5)
+    status['seconds'] = round(time.time() - start, 1)
+    status['usage'] = _job_usage(thread_id, run_report)
+    if status['status'] != 'needs_feedback':
+        # The book won't be resumed: its budget totals aren't needed anymore
+        clear_invocation_records(thread_id)
+    progress.finish(status)
+    return status
+
+async def arun_batch(jobs: List[Dict[str, Any]], batch_name: str, workers: int, status_path: str, recursion_limit: int = 150, verbose: bool = False, app = None) -> Dict[str, Any]:
+    """
+    Runs the jobs with at most `workers` books in flight. Each book is isolated: its errors are recorded in its status.
+
+    The pool should be larger than what the quota of the providers allows at once, so it is always saturated: the shared rate
+    limiters hold the requests over the budget. The connection pool of every used provider is enlarged to the number of workers.
+
+    :return: The summary of the batch (status counts, throughput) and the status of every job
+    """
+    app = app if app is not None else compile_app()
+    for provider in {job['config'].get(key, 'openai') for job in jobs for key in MODEL_CONFIG_KEYS}:
+        if get_pool_settings(provider)['max_connections'] < workers:
+            configure_pool(provider, max_connections = workers)
+
+    progress = BatchProgress(n_jobs = len(jobs), status_path = status_path)
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(job: Dict[str, Any]):
+        async with semaphore:
+            return await _run_job(app, job, _job_config(job, batch_name, recursion_limit), progress, verbose)
+
+    statuses = await asyncio.gather(*[run(job) for job in jobs])
+    return {'summary': progress.summary(), 'jobs': list(statuses)}
+
+def _done_jobs(status_path: str) -> set:
+    if not os.path.exists(status_path):
+        return set()
+    with open(status_path) as f:
+        statuses = [json.loads(line) for line in f if line.strip() != '']
+    return {status['job_id'] for status in statuses if status['status'] == 'done'}
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description = "Generates every book of a JSONL/YAML manifest, without human interaction.")
+    arg_parser.add_argument('manifest')
+    arg_parser.add_argument('--workers', type = int, default = 8, help = "Books in flight at the same time.")
+    arg_parser.add_argument('--status', default = None, help = "JSONL file with the status of each finished job. By default, next to the manifest.")
+    arg_parser.add_argument('--skip-done', action = 'store_true', help = "Skip the jobs already done according to the status file.")
+    arg_parser.add_argument('--checkpoint-db', default = None, help = "SQLite file where the books are checkpointed. By default, next to the manifest.")
+    arg_parser.add_argument('--recursion-limit', type = int, default = 150)
+    arg_parser.add_argument('--verbose', action = 'store_true', help = "Print the progress events of every book.")
+    args = arg_parser.parse_args()
+
+    batch_name = os.path.splitext(os.path.basename(args.manifest))[0]
+    status_path = args.status or os.path.splitext(args.manifest)[0] + "_status.jsonl"
+    jobs = load_manifest(args.manifest)
+    if args.skip_done:
+        done_jobs = _done_jobs(status_path)
+        jobs = [job for job in jobs if job['id'] not in done_jobs]
+        print(f"Skipping {len(done_jobs)} books already done.")
+
+    print(f"Running {len(jobs)} books with {args.workers} workers. The status of each one is saved in {status_path}")
+    app = compile_app(checkpointer = get_checkpointer(args.checkpoint_db or os.path.splitext(args.manifest)[0] + "_checkpoints.sqlite"))
+    result = asyncio.run(arun_batch(jobs, batch_name = batch_name, workers = args.workers, status_path = status_path, recursion_limit = args.recursion_limit, verbose = args.verbose, app = app))
+    print("Batch finished:\n" + json.dumps(result['summary'], indent = 4))
+    print("Time spent waiting for the rate limits of each provider:\n" + json.dumps(get_rate_limit_report(), indent = 4))
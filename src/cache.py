@@ -0,0 +1,233 @@
+import os
+import time
+import json
+import hashlib
+import sqlite3
+import asyncio
+import threading
+import contextvars
+from typing import Any, Dict, List, Optional
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.load import dumps, loads
+
+# Nodes (identified by the key of their model in GraphConfig) whose responses are cached when `cached_nodes` is not set.
+# They run with temperature=0, so replaying their responses doesn't change the behaviour of the system.
+DEFAULT_CACHED_NODES = ['instructor_model', 'writing_reviewer_model', 'translator_model']
+
+class SQLiteResponseStore:
+    """
+    Persistent, content-addressed store of LLM responses, shared by every model of the process (and by other processes using the same file).
+
+    Entries older than `max_age_seconds` are evicted, and when the store grows over `max_entries` the least recently used ones are removed.
+    """
+    def __init__(self, path: str, max_entries: int = 10000, max_age_seconds: float = 30 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._n_updates = 0
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("""CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                provider TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_accessed_at REAL NOT NULL)""")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_llm_responses_last_accessed_at ON llm_responses (last_accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout = 30)
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT response, created_at FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.max_age_seconds:
+                connection.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE llm_responses SET last_accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key: str, provider: str, model_name: str, response: str):
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO llm_responses (key, provider, model_name, response, created_at, last_accessed_at) VALUES (?, ?, ?, ?, ?, ?)", (key, provider, model_name, response, now, now))
+        self._n_updates += 1
+        if self._n_updates % 50 == 1:
+            self.evict()
+
+    def evict(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM llm_responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            connection.execute("""DELETE FROM llm_responses WHERE key IN (
+                SELECT key FROM llm_responses ORDER BY last_accessed_at DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM llm_responses")
+
+class _InFlight:
+    """
+    Single-flight registry: the first request that misses a key computes the response and the concurrent identical requests wait for it.
+
+    The keys are owned by the LLM run that acquired them (its `run_id`, set in the context of the request when the run starts),
+    not by the OS thread: on the async path the lookup and the error callback of a run don't happen in the same thread.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events: Dict[str, threading.Event] = {}
+        self._owners: Dict[Any, List[str]] = {}
+        self._current_run: contextvars.ContextVar = contextvars.ContextVar('single_flight_run', default = None)
+
+    def start_run(self, run_id: Any):
+        self._current_run.set(run_id)
+
+    def acquire(self, key: str) -> Optional[threading.Event]:
+        """
+        Returns None if the current run becomes the owner of the key, otherwise the event to wait for.
+        """
+        with self._lock:
+            event = self._events.get(key)
+            if event is not None:
+                return event
+            self._events[key] = threading.Event()
+            self._owners.setdefault(self._current_run.get(), []).append(key)
+        return None
+
+    def release(self, key: str):
+        with self._lock:
+            event = self._events.pop(key, None)
+            for keys in self._owners.values():
+                if key in keys:
+                    keys.remove(key)
+        if event is not None:
+            event.set()
+
+    def release_run(self, run_id: Any):
+        with self._lock:
+            keys = self._owners.pop(run_id, [])
+        for key in keys:
+            self.release(key)
+
+class ResponseCache(BaseCache):
+    """
+    LangChain cache attached to a single chat model.
+
+    The key is the hash of the provider, the model name, the sampling parameters (the `llm_string` built by LangChain) and the serialized message list.
+    """
+    def __init__(self, store: SQLiteResponseStore, in_flight: _InFlight, provider: str, model_name: str, single_flight_timeout: float = 600):
+        self.store = store
+        self.in_flight = in_flight
+        self.provider = provider
+        self.model_name = model_name
+        self.single_flight_timeout = single_flight_timeout
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return hashlib.sha256(json.dumps([self.provider, self.model_name, llm_string, prompt_hash]).encode('utf-8')).hexdigest()
+
+    def _load(self, key: str) -> Optional[RETURN_VAL_TYPE]:
+        response = self.store.get(key)
+        if response is None:
+            return None
+        generations = [loads(generation) for generation in json.loads(response)]
+        for generation in generations:
+            generation.generation_info = {**(generation.generation_info or {}), 'from_cache': True}
+            if hasattr(generation, 'message'):
+                generation.message.response_metadata = {**generation.message.response_metadata, 'from_cache': True}
+        return generations
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        while True:
+            cached = self._load(key)
+            if cached is not None:
+                return cached
+            event = self.in_flight.acquire(key)
+            if event is None:
+                return None
+            # An identical request is already running: wait for its response instead of paying for it twice
+            if not event.wait(timeout = self.single_flight_timeout):
+                return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+        key = self._key(prompt, llm_string)
+        try:
+            self.store.put(key, self.provider, self.model_name, json.dumps([dumps(generation) for generation in return_val]))
+        finally:
+            self.in_flight.release(key)
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """
+        Async version of `lookup`, that waits for the identical requests without blocking the event loop (the default `alookup`
+        runs the whole `lookup` in an executor thread).
+        """
+        key = self._key(prompt, llm_string)
+        while True:
+            cached = await asyncio.to_thread(self._load, key)
+            if cached is not None:
+                return cached
+            event = self.in_flight.acquire(key)
+            if event is None:
+                return None
+            if not await asyncio.to_thread(event.wait, self.single_flight_timeout):
+                return None
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE):
+        key = self._key(prompt, llm_string)
+        try:
+            await asyncio.to_thread(self.store.put, key, self.provider, self.model_name, json.dumps([dumps(generation) for generation in return_val]))
+        finally:
+            self.in_flight.release(key)
+
+    def clear(self, **kwargs: Any):
+        self.store.clear()
+
+class SingleFlightReleaseCallback(BaseCallbackHandler):
+    """
+    Releases the requests that were waiting for this one when its LLM call fails, so they can try by themselves.
+    It runs inline, so the run started in `on_chat_model_start` is the one of the context where the cache is looked up.
+    """
+    run_inline = True
+
+    def __init__(self, in_flight: _InFlight):
+        self.in_flight = in_flight
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: Any, **kwargs: Any):
+        self.in_flight.start_run(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any):
+        # The keys of a successful run were released when its response was stored
+        self.in_flight.release_run(run_id)
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any):
+        self.in_flight.release_run(run_id)
+
+_store = None
+_in_flight = _InFlight()
+_store_lock = threading.Lock()
+
+def get_response_cache(provider: str, model_name: str) -> ResponseCache:
+    """
+    Returns a cache for a chat model, backed by the SQLite file in LLM_CACHE_PATH (by default `.llm_cache.sqlite`).
+    LLM_CACHE_MAX_ENTRIES and LLM_CACHE_MAX_AGE_DAYS control the eviction.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteResponseStore(
+                path = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite"),
+                max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000)),
+                max_age_seconds = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", 30)) * 24 * 3600
+            )
+    return ResponseCache(store = _store, in_flight = _in_flight, provider = provider, model_name = model_name)
+
+def get_single_flight_callback() -> SingleFlightReleaseCallback:
+    return SingleFlightReleaseCallback(_in_flight)
+
+def is_cached_node(config, key: str) -> bool:
+    return key in config['configurable'].get('cached_nodes', DEFAULT_CACHED_NODES)
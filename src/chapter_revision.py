@@ -0,0 +1,104 @@
+"""
+Revision of a chapter with targeted edits instead of a new version of the whole chapter: the Writer returns the edits of the
+paragraphs that need them, and they are validated and applied here to the stored chapter. The output of a revision grows with
+the size of the fix, not with the size of the chapter.
+
+Each edit is a string that points to a paragraph of the chapter, numbered from 1 as in `number_paragraphs`:
+- 'expand <n>: <text>' appends the sentences of the text at the end of the paragraph n
+- 'replace <n>: <text>' replaces the paragraph n with the text
+- 'insert_after <n>: <text>' inserts the text as a new paragraph after the paragraph n (0 inserts it at the beginning)
+
+The paragraph-level diff between two versions of a chapter lets the Writing Reviewer re-review only what the revision changed.
+"""
+
+import re
+import difflib
+from typing import List, NamedTuple, Optional, Tuple
+from src.chapter_validator import split_paragraphs
+
+EDIT_OPERATIONS = ['expand', 'replace', 'insert_after']
+
+_EDIT = re.compile(r"^\s*[-*]?\s*(expand|replace|insert_after)\s+(?:paragraph\s+)?\[?(\d+)\]?\s*:\s*(.*)$", re.IGNORECASE | re.DOTALL)
+# The number of the paragraph, when the model copies it from the numbered chapter into the text of the edit
+_PARAGRAPH_NUMBER = re.compile(r"^\[\d+\]\s*")
+
+class ChapterEdit(NamedTuple):
+    operation: str
+    paragraph: int
+    text: str
+
+def number_paragraphs(content: str) -> str:
+    """
+    The chapter with its paragraphs numbered from 1 ('[1] ...'), so the edits can point to them.
+    """
+    return "\n\n".join(f"[{n_paragraph}] {paragraph}" for n_paragraph, paragraph in enumerate(split_paragraphs(content), start = 1))
+
+def parse_edit(edit: str, n_paragraphs: int) -> Optional[ChapterEdit]:
+    """
+    Parses an edit of a chapter of `n_paragraphs` paragraphs. None if it is malformed, empty or points to a paragraph that doesn't exist.
+    """
+    match = _EDIT.match(edit)
+    if match is None:
+        return None
+    operation, paragraph, text = match.group(1).lower(), int(match.group(2)), _PARAGRAPH_NUMBER.sub('', match.group(3).strip())
+    first_paragraph = 0 if operation == 'insert_after' else 1
+    if text == '' or not first_paragraph <= paragraph <= n_paragraphs:
+        return None
+    return ChapterEdit(operation = operation, paragraph = paragraph, text = text)
+
+def apply_edits(content: str, edits: List[str]) -> Tuple[str, List[str]]:
+    """
+    Applies the edits to the chapter, and returns the revised chapter and the edits that were rejected.
+    The paragraphs are numbered as in the chapter before any edit, so the result doesn't depend on the order of the insertions.
+    """
+    paragraphs = split_paragraphs(content)
+    insertions = {n_paragraph: [] for n_paragraph in range(len(paragraphs) + 1)}
+    rejected = []
+    for edit in edits:
+        parsed = parse_edit(edit, len(paragraphs))
+        if parsed is None:
+            rejected.append(edit)
+        elif parsed.operation == 'expand':
+            paragraphs[parsed.paragraph - 1] = f"{paragraphs[parsed.paragraph - 1]} {parsed.text}"
+        elif parsed.operation == 'replace':
+            paragraphs[parsed.paragraph - 1] = parsed.text
+        else:
+            insertions[parsed.paragraph].append(parsed.text)
+    revised = insertions[0] + [text for n_paragraph, paragraph in enumerate(paragraphs, start = 1) for text in [paragraph] + insertions[n_paragraph]]
+    return "\n\n".join(revised), rejected
+
+class ParagraphChange(NamedTuple):
+    operation: str
+    # Number of the paragraph in the revised chapter, or in the previous one for the removed paragraphs
+    paragraph: int
+    text: str
+
+def diff_paragraphs(previous: str, revised: str) -> Tuple[List[ParagraphChange], float]:
+    """
+    Paragraph-level diff between two versions of a chapter: the paragraphs of the revision that are new ('inserted') or that
+    replace others ('changed'), and the paragraphs of the previous version that are gone ('removed').
+    Also returns the change ratio: the share of the paragraphs (of the longest version) that aren't kept as they were.
+    """
+    previous_paragraphs, revised_paragraphs = split_paragraphs(previous), split_paragraphs(revised)
+    matcher = difflib.SequenceMatcher(a = previous_paragraphs, b = revised_paragraphs, autojunk = False)
+    changes = []
+    for tag, previous_start, previous_end, revised_start, revised_end in matcher.get_opcodes():
+        if tag == 'delete':
+            changes += [ParagraphChange(operation = 'removed', paragraph = n_paragraph + 1, text = previous_paragraphs[n_paragraph]) for n_paragraph in range(previous_start, previous_end)]
+        elif tag in ['replace', 'insert']:
+            operation = 'changed' if tag == 'replace' else 'inserted'
+            changes += [ParagraphChange(operation = operation, paragraph = n_paragraph + 1, text = revised_paragraphs[n_paragraph]) for n_paragraph in range(revised_start, revised_end)]
+    kept = sum(block.size for block in matcher.get_matching_blocks())
+    change_ratio = 1 - kept / max(len(previous_paragraphs), len(revised_paragraphs), 1)
+    return changes, change_ratio
+
+def format_paragraph_changes(changes: List[ParagraphChange]) -> str:
+    if changes == []:
+        return "No paragraph changed."
+    lines = []
+    for change in changes:
+        if change.operation == 'removed':
+            lines.append(f"[removed: paragraph {change.paragraph} of the previous version] {change.text}")
+        else:
+            lines.append(f"[{change.paragraph}, {change.operation}] {change.text}")
+    return "\n\n".join(lines)
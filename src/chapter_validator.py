@@ -0,0 +1,128 @@
+"""
+Local validator of the size of the chapters: it splits a chapter into paragraphs and sentences, and reports which paragraphs are
+short, so the Writer is only asked to fix a chapter that really is below the requirements, and is told exactly what to fix.
+
+The sentences are split with rules that work for the languages of the books: the terminators of the latin scripts plus the ones of
+Chinese, Japanese and Arabic, the abbreviations (Mr., Dr., Sra., etc.), the initials, the ellipses, and the dialogues (a sentence
+doesn't end at a '!' or a '?' inside quotes or after a dash when the narration goes on in lowercase: "Run!" she said).
+"""
+
+import re
+from typing import List, NamedTuple, Optional, Tuple
+
+_TERMINATORS = '.!?…。！？؟'
+# Full-width terminators end the sentence even without a space after them
+_FULL_WIDTH_TERMINATORS = '。！？'
+_CLOSING = '"\'”’»)]」』'
+_OPENING = '"\'“‘«¿¡([—–-「『'
+_PARAGRAPH_SEPARATOR = re.compile(r'\n[ \t]*\n')
+_DOTTED_ACRONYM = re.compile(r'(?:\w\.)+\w')
+
+# Words that end with a dot without ending the sentence (lowercase, without their last dot)
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'sra', 'srta', 'jr', 'st', 'mt', 'lt', 'col', 'gen', 'capt', 'sgt', 'rev', 'hon',
+    'vs', 'etc', 'e.g', 'i.e', 'cf', 'ca', 'approx', 'no', 'nr', 'p', 'pp', 'vol', 'fig', 'ed', 'dept', 'inc', 'ltd', 'co',
+    'ud', 'uds', 'dña', 'av', 'pág', 'mme', 'mlle', 'hr', 'fr', 'frl', 'bzw', 'usw', 'z.b', 'sig', 'sta', 'sto', 'dott',
+}
+
+class ChapterReport(NamedTuple):
+    """
+    Result of `validate_chapter`: the sentences of each paragraph of the chapter, and the requirements it was checked against.
+    """
+    sentences_per_paragraph: List[int]
+    min_paragraphs: int
+    min_sentences: Optional[int]
+
+    @property
+    def n_paragraphs(self) -> int:
+        return len(self.sentences_per_paragraph)
+
+    @property
+    def missing_paragraphs(self) -> int:
+        return max(0, self.min_paragraphs - self.n_paragraphs)
+
+    @property
+    def short_paragraphs(self) -> List[Tuple[int, int]]:
+        """
+        The paragraphs (numbered from 1) with fewer sentences than required, with their number of sentences.
+        """
+        if self.min_sentences is None:
+            return []
+        return [(n_paragraph, n_sentences) for n_paragraph, n_sentences in enumerate(self.sentences_per_paragraph, start = 1) if n_sentences < self.min_sentences]
+
+    @property
+    def is_valid(self) -> bool:
+        return self.missing_paragraphs == 0 and len(self.short_paragraphs) == 0
+
+    def describe_deficits(self) -> str:
+        """
+        What the chapter lacks, to tell the Writer exactly what to fix.
+        """
+        deficits = []
+        if self.missing_paragraphs > 0:
+            deficits.append(f"The chapter has {self.n_paragraphs} paragraphs and it must have at least {self.min_paragraphs}: add {self.missing_paragraphs} new {'paragraph' if self.missing_paragraphs == 1 else 'paragraphs'}.")
+        if self.short_paragraphs:
+            paragraphs = ", ".join(f"paragraph {n_paragraph} ({n_sentences} {'sentence' if n_sentences == 1 else 'sentences'})" for n_paragraph, n_sentences in self.short_paragraphs)
+            deficits.append(f"These paragraphs have fewer than {self.min_sentences} sentences: {paragraphs}. Expand each of them to at least {self.min_sentences} sentences, and keep the other paragraphs as they are.")
+        return "\n".join(deficits)
+
+def split_paragraphs(text: str) -> List[str]:
+    return [paragraph.strip() for paragraph in _PARAGRAPH_SEPARATOR.split(text.strip()) if paragraph.strip() != '']
+
+def _previous_word(text: str, end: int) -> str:
+    start = end
+    while start > 0 and not text[start - 1].isspace() and text[start - 1] not in _OPENING:
+        start -= 1
+    return text[start:end]
+
+def _is_boundary(text: str, start: int, end: int, after: int) -> bool:
+    """
+    Whether the terminators in text[start:end], followed by closing quotes until `after`, end the sentence.
+    """
+    if after >= len(text):
+        return True
+    if not text[after].isspace():
+        # eg: 3.14, e.g., "¡Vamos!", except for the full-width terminators, that are not followed by a space
+        return text[end - 1] in _FULL_WIDTH_TERMINATORS
+    if end - start == 1 and text[start] == '.' and after == end:
+        word = _previous_word(text, start)
+        # Abbreviations, initials (J. R. R. Tolkien) and acronyms with dots (U.S. Army)
+        if word.lower() in ABBREVIATIONS or (len(word) == 1 and word.isupper()) or _DOTTED_ACRONYM.fullmatch(word):
+            return False
+    # The first letter of what follows, after the spaces and the opening quotes or dashes of a dialogue
+    following = after
+    while following < len(text) and (text[following].isspace() or text[following] in _OPENING):
+        following += 1
+    # The narration goes on: "Run!" she said / ... and then / —¿Quién? —preguntó
+    return following >= len(text) or not text[following].islower()
+
+def split_sentences(paragraph: str) -> List[str]:
+    sentences = []
+    start = index = 0
+    while index < len(paragraph):
+        if paragraph[index] not in _TERMINATORS:
+            index += 1
+            continue
+        end = index
+        while end < len(paragraph) and paragraph[end] in _TERMINATORS:
+            end += 1
+        after = end
+        while after < len(paragraph) and paragraph[after] in _CLOSING:
+            after += 1
+        if _is_boundary(paragraph, index, end, after):
+            sentences.append(paragraph[start:after].strip())
+            start = after
+        index = after
+    sentences.append(paragraph[start:].strip())
+    # A sentence needs at least a letter or a digit (not a stray quote or dash)
+    return [sentence for sentence in sentences if any(character.isalnum() for character in sentence)]
+
+def validate_chapter(content: str, min_paragraphs: int, min_sentences: Optional[int] = None) -> ChapterReport:
+    """
+    Checks the content of a chapter against the minimum number of paragraphs and, if given, of sentences in each paragraph.
+    """
+    return ChapterReport(
+        sentences_per_paragraph = [len(split_sentences(paragraph)) for paragraph in split_paragraphs(content)],
+        min_paragraphs = min_paragraphs,
+        min_sentences = min_sentences
+    )
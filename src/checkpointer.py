@@ -0,0 +1,340 @@
+import os
+import zlib
+import time
+import asyncio
+import sqlite3
+import operator
+import threading
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, get_type_hints
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Path of the checkpoints when CHECKPOINT_DB_PATH is not set
+DEFAULT_CHECKPOINT_DB_PATH = "checkpoints.sqlite"
+
+# Versions of an append-only channel saved as deltas before a new full snapshot is saved
+DEFAULT_SNAPSHOT_EVERY = 10
+
+# zstd when the zstandard package is installed (it comes with langsmith), zlib of the standard library otherwise
+DEFAULT_COMPRESSION = 'zstd' if zstandard is not None else 'zlib'
+
+_CODECS = {'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress)}
+if zstandard is not None:
+    _CODECS['zstd'] = (lambda data: zstandard.ZstdCompressor(level = 3).compress(data), lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+# Classes of the repo that are saved inside the state, allowed when the checkpoints are loaded
+STATE_CLASSES = [('src.utils', 'DocumentationReady'), ('src.utils', 'StoryBible')]
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS checkpoints (
+        thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, parent_checkpoint_id TEXT,
+        checkpoint_type TEXT NOT NULL, checkpoint BLOB NOT NULL, metadata_type TEXT NOT NULL, metadata BLOB NOT NULL, created_at REAL NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id))""",
+    """CREATE TABLE IF NOT EXISTS blobs (
+        thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, channel TEXT NOT NULL, version TEXT NOT NULL, type TEXT NOT NULL, blob BLOB,
+        PRIMARY KEY (thread_id, checkpoint_ns, channel, version))""",
+    """CREATE TABLE IF NOT EXISTS writes (
+        thread_id TEXT NOT NULL, checkpoint_ns TEXT NOT NULL, checkpoint_id TEXT NOT NULL, task_id TEXT NOT NULL, idx INTEGER NOT NULL,
+        channel TEXT NOT NULL, type TEXT NOT NULL, blob BLOB, task_path TEXT NOT NULL,
+        PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx))""",
+]
+
+# Columns of the delta encoding, added to the files created before it
+_BLOB_DELTA_COLUMNS = [('base_version', 'TEXT'), ('length', 'INTEGER')]
+
+def append_only_channels(state_schema) -> set:
+    """
+    The channels of a state with the `operator.add` reducer: their lists only grow, so each version can be saved as the items
+    appended to the previous one.
+    """
+    hints = get_type_hints(state_schema, include_extras = True)
+    return {name for name, hint in hints.items() if operator.add in getattr(hint, '__metadata__', ())}
+
+class SQLiteCheckpointer(BaseCheckpointSaver):
+    """
+    Durable checkpointer of the graph in a SQLite file, so a book interrupted by a crash (or a network error) can be resumed
+    from its last completed node, without calling again the agents whose results are already saved.
+
+    As the in-memory checkpointer of LangGraph, each channel of the state is only written when its version changes, and the
+    writes of the nodes of an unfinished step are kept, so the completed nodes of that step are not run again.
+    Each `put` is one transaction in WAL mode: a crash never leaves a half written checkpoint.
+
+    The lists of the append-only channels (`append_only_channels`) grow with every chapter, so saving them whole at each step
+    makes the file grow quadratically with the length of the book. Instead, each new version of those channels only saves the
+    items appended to its previous version, and a full snapshot every `snapshot_every` versions bounds the chain of deltas to
+    read. The blobs and writes are compressed (`compression`: 'zstd', 'zlib' or None). A channel is only rebuilt when it is
+    loaded, from its last snapshot and the following deltas (`load_channel` rebuilds a single channel of any checkpoint).
+    """
+    def __init__(self, path: str = DEFAULT_CHECKPOINT_DB_PATH, serde = None, append_only: Iterable[str] = (), snapshot_every: int = DEFAULT_SNAPSHOT_EVERY, compression: Optional[str] = DEFAULT_COMPRESSION):
+        super().__init__(serde = serde or JsonPlusSerializer(allowed_msgpack_modules = STATE_CLASSES))
+        if compression is not None and compression not in _CODECS:
+            raise ValueError(f"The compression '{compression}' is not available. Use one of: {list(_CODECS)} or None")
+        self.path = path
+        self.append_only = set(append_only)
+        self.snapshot_every = snapshot_every
+        self.compression = compression
+        # Last saved version of each append-only channel: (thread_id, checkpoint_ns, channel) -> (version, length, deltas since the snapshot)
+        self._last_versions: Dict[Tuple[str, str, str], Tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+        self._connection = sqlite3.connect(path, timeout = 30, check_same_thread = False, isolation_level = None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._connection.execute(statement)
+        blob_columns = {row[1] for row in self._connection.execute("PRAGMA table_info(blobs)").fetchall()}
+        for column, column_type in _BLOB_DELTA_COLUMNS:
+            if column not in blob_columns:
+                self._connection.execute(f"ALTER TABLE blobs ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _transaction(self, operation) -> Any:
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(self._connection)
+                self._connection.execute("COMMIT")
+                return result
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+
+    def _query(self, sql: str, parameters: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def _dumps(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        if self.compression is None or data is None:
+            return type_, data
+        return f"{self.compression}:{type_}", _CODECS[self.compression][0](data)
+
+    def _loads(self, type_: str, data: Optional[bytes]) -> Any:
+        # The type of the compressed blobs is '<codec>:<type of the serializer>', the rest were saved without compression
+        if ':' in type_:
+            codec, type_ = type_.split(':', 1)
+            data = _CODECS[codec][1](data)
+        return self.serde.loads_typed((type_, data))
+
+    def _blob_row(self, thread_id: str, checkpoint_ns: str, channel: str, version: Any, values: Dict[str, Any]) -> Tuple[tuple, Optional[Tuple[int, int, int]]]:
+        """
+        The row of the new version of a channel: a delta of the previous version if the channel is append-only and its previous
+        version was saved by this checkpointer, a full snapshot otherwise. Also returns what to remember of an append-only channel.
+        """
+        if channel not in values:
+            return (thread_id, checkpoint_ns, channel, str(version), 'empty', None, None, None), None
+        value = values[channel]
+        if channel not in self.append_only or not isinstance(value, list):
+            return (thread_id, checkpoint_ns, channel, str(version), *self._dumps(value), None, None), None
+        last = self._last_versions.get((thread_id, checkpoint_ns, channel))
+        if last is not None and last[0] < int(version) and last[1] <= len(value) and last[2] < self.snapshot_every:
+            delta = value[last[1]:]
+            return (thread_id, checkpoint_ns, channel, str(version), *self._dumps(delta), str(last[0]), len(value)), (int(version), len(value), last[2] + 1)
+        return (thread_id, checkpoint_ns, channel, str(version), *self._dumps(value), None, len(value)), (int(version), len(value), 0)
+
+    def _load_blob(self, thread_id: str, checkpoint_ns: str, channel: str, version: Any) -> Tuple[bool, Any]:
+        """
+        Rebuilds a version of a channel from its last snapshot and the deltas saved after it.
+
+        :return: Whether the channel has a value in that version, and the value
+        """
+        deltas = []
+        while True:
+            rows = self._query("SELECT type, blob, base_version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", (thread_id, checkpoint_ns, channel, str(version)))
+            if not rows or rows[0][0] == 'empty':
+                return False, None
+            type_, blob, base_version = rows[0]
+            deltas.append(self._loads(type_, blob))
+            if base_version is None:
+                break
+            version = base_version
+        value = deltas.pop()
+        for delta in reversed(deltas):
+            value = value + delta
+        return True, value
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> Dict[str, Any]:
+        values = {}
+        for channel, version in versions.items():
+            found, value = self._load_blob(thread_id, checkpoint_ns, channel, version)
+            if found:
+                values[channel] = value
+        return values
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        rows = self._query("SELECT task_id, idx, channel, type, blob, task_path FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id))
+        rows = sorted(rows, key = lambda row: writes_sort_key(row[5], row[0], row[1]))
+        return [(task_id, channel, self._loads(type_, blob)) for task_id, _, channel, type_, blob, _ in rows]
+
+    def load_channel(self, config: RunnableConfig, channel: str) -> Any:
+        """
+        Rebuilds only one channel of a checkpoint (the last one of the thread, or the `checkpoint_id` of the config), without
+        loading the rest of the state. Eg: the approved chapters of a book at any step.
+
+        :return: The value of the channel, or None if it is empty in that checkpoint
+        """
+        thread_id = str(config['configurable']['thread_id'])
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = self._query("SELECT checkpoint_type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id))
+        else:
+            rows = self._query("SELECT checkpoint_type, checkpoint FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns))
+        if not rows:
+            return None
+        version = self.serde.loads_typed(rows[0])['channel_versions'].get(channel)
+        return self._load_blob(thread_id, checkpoint_ns, channel, version)[1] if version is not None else None
+
+    def _tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata = row
+        checkpoint_ = self.serde.loads_typed((checkpoint_type, checkpoint))
+        return CheckpointTuple(
+            config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': checkpoint_id}},
+            checkpoint = {**checkpoint_, 'channel_values': self._load_blobs(thread_id, checkpoint_ns, checkpoint_['channel_versions'])},
+            metadata = self.serde.loads_typed((metadata_type, metadata)),
+            parent_config = {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': parent_checkpoint_id}} if parent_checkpoint_id else None,
+            pending_writes = self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config['configurable']['thread_id'])
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        columns = "checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata"
+        if checkpoint_id := get_checkpoint_id(config):
+            rows = self._query(f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?", (thread_id, checkpoint_ns, checkpoint_id))
+        else:
+            rows = self._query(f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? ORDER BY checkpoint_id DESC LIMIT 1", (thread_id, checkpoint_ns))
+        return self._tuple(thread_id, checkpoint_ns, rows[0]) if rows else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None, before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        conditions, parameters = [], []
+        if config is not None:
+            conditions.append("thread_id = ?")
+            parameters.append(str(config['configurable']['thread_id']))
+            if config['configurable'].get('checkpoint_ns') is not None:
+                conditions.append("checkpoint_ns = ?")
+                parameters.append(config['configurable']['checkpoint_ns'])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                parameters.append(checkpoint_id)
+        if before is not None and (before_checkpoint_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            parameters.append(before_checkpoint_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._query(f"SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata FROM checkpoints {where} ORDER BY checkpoint_id DESC", tuple(parameters))
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            metadata = self.serde.loads_typed((row[4], row[5]))
+            if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield self._tuple(thread_id, checkpoint_ns, tuple(row))
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = str(config['configurable']['thread_id'])
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        checkpoint_ = checkpoint.copy()
+        values = checkpoint_.pop('channel_values')
+        blobs, last_versions = [], {}
+        for channel, version in new_versions.items():
+            blob, last_version = self._blob_row(thread_id, checkpoint_ns, channel, version, values)
+            blobs.append(blob)
+            if last_version is not None:
+                last_versions[(thread_id, checkpoint_ns, channel)] = last_version
+        row = (thread_id, checkpoint_ns, checkpoint['id'], config['configurable'].get('checkpoint_id'), *self.serde.dumps_typed(checkpoint_), *self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)), time.time())
+
+        def operation(connection: sqlite3.Connection):
+            connection.executemany("INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob, base_version, length) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", blobs)
+            connection.execute("INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        self._transaction(operation)
+        # Only once they are committed, so the next deltas never point to a version that isn't in the file
+        self._last_versions.update(last_versions)
+        return {'configurable': {'thread_id': thread_id, 'checkpoint_ns': checkpoint_ns, 'checkpoint_id': checkpoint['id']}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = '') -> None:
+        thread_id = str(config['configurable']['thread_id'])
+        checkpoint_ns = config['configurable'].get('checkpoint_ns', '')
+        checkpoint_id = config['configurable']['checkpoint_id']
+        rows = [(thread_id, checkpoint_ns, checkpoint_id, task_id, WRITES_IDX_MAP.get(channel, idx), channel, *self._dumps(value), task_path) for idx, (channel, value) in enumerate(writes)]
+
+        def operation(connection: sqlite3.Connection):
+            # The special writes (errors, interrupts...) replace the previous ones, the regular ones are only written once
+            for row in rows:
+                verb = "INSERT OR REPLACE" if row[4] < 0 else "INSERT OR IGNORE"
+                connection.execute(f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, blob, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+        self._transaction(operation)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._last_versions = {key: last for key, last in self._last_versions.items() if key[0] != str(thread_id)}
+
+        def operation(connection: sqlite3.Connection):
+            for table in ['checkpoints', 'blobs', 'writes']:
+                connection.execute(f"DELETE FROM {table} WHERE thread_id = ?", (str(thread_id),))
+        self._transaction(operation)
+
+    def get_next_version(self, current: Optional[int], channel: None = None) -> int:
+        return 1 if current is None else int(current) + 1
+
+    def list_threads(self) -> List[Dict[str, Any]]:
+        """
+        The threads saved in the file, with their number of checkpoints and the time of the last one.
+        """
+        rows = self._query("SELECT thread_id, COUNT(*), MAX(created_at) FROM checkpoints WHERE checkpoint_ns = '' GROUP BY thread_id ORDER BY MAX(created_at) DESC")
+        return [{'thread_id': thread_id, 'checkpoints': n_checkpoints, 'updated_at': updated_at} for thread_id, n_checkpoints, updated_at in rows]
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None, before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in await asyncio.to_thread(lambda: list(self.list(config, filter = filter, before = before, limit = limit))):
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata, new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = '') -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+def get_checkpointer(path: Optional[str] = None) -> SQLiteCheckpointer:
+    """
+    Returns the durable checkpointer, in `path` or in the file of the CHECKPOINT_DB_PATH environment variable, with the
+    append-only channels of `State` saved as deltas.
+    """
+    from src.utils import State
+    return SQLiteCheckpointer(path or os.getenv("CHECKPOINT_DB_PATH", DEFAULT_CHECKPOINT_DB_PATH), append_only = append_only_channels(State))
+
+def resume_config(checkpointer: BaseCheckpointSaver, thread_id: str) -> Optional[dict]:
+    """
+    Rebuilds the configuration of a saved book from the metadata of its last checkpoint (LangGraph saves there the scalar
+    values of `configurable`: language, models, number of chapters...), so it is resumed with the same settings.
+
+    :return: The configuration, or None if there is no checkpoint of that thread
+    """
+    checkpoint_tuple = checkpointer.get_tuple({'configurable': {'thread_id': thread_id}})
+    if checkpoint_tuple is None:
+        return None
+    configurable = {key: value for key, value in checkpoint_tuple.metadata.items() if key not in ['source', 'step', 'parents', 'writes', 'run_id', 'thread_id', 'checkpoint_ns', 'checkpoint_id']}
+    return {'configurable': {**configurable, 'thread_id': thread_id}}
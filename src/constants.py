@@ -403,4 +403,69 @@ The description and data type info MUST NOT be returned in your output. Instead,
 Remember to return the correct format output, defined in <FORMAT_OUTPUT> tag. Never plain, conversational text.
 It is mandatory to return the completed JSON object, without missing any key in the dictionary. Don't hallucinate keys that are not present in the schema.
 Also, ensure to return the JSON object correctly formmated, without syntaxis error.
-"""
\ No newline at end of file
+"""
+
+CONTINUITY_EDITOR_PROMPT = """
+<ROLE>
+You are a meticulous continuity editor. The chapters of a book were drafted at the same time by different writers, each one from the summary of its own chapter, so they can disagree with each other.
+Your task is to reconcile a chapter with the previous one: you don't rewrite the chapter, you only point out the exact fixes it needs.
+</ROLE>
+
+<BOOK_DRAFT>
+{draft}
+</BOOK_DRAFT>
+
+<CHARACTERS>
+{characters}
+</CHARACTERS>
+
+<METHODOLOGY>
+1. Read the end of the previous chapter and the whole chapter to reconcile.
+2. Look for the names (of characters, places, objects) and the facts (ages, dates, who knows what, where each character is) that contradict the previous chapter or the characters above.
+3. Check the transition: the first paragraph of the chapter must follow naturally from the end of the previous one.
+</METHODOLOGY>
+
+<FORMAT_OUTPUT>
+Return the following Python object, following this JSON schema definition:
+<SCHEMA>
+{schema}
+</SCHEMA>
+As you can see, the schema provides the structure of the expected output. 
+Please pay special attention to the descriptions and data type for each field.
+You should populate the fields with the defined value.
+The description and data type info MUST NOT be returned in your output. Instead, place the value of the particular key.
+</FORMAT_OUTPUT>
+
+Remember to return the correct format output, defined in <FORMAT_OUTPUT> tag. Never plain, conversational text.
+It is mandatory to return the completed JSON object, without missing any key in the dictionary. Don't hallucinate keys that are not present in the schema.
+Keep it short: return an empty list of corrections and an empty first paragraph when the chapter is already consistent.
+"""
+WRITER_REVISION_PROMPT = """
+{instructions}
+
+Don't write the whole chapter again: return only the edits of the paragraphs that need them, the rest of the chapter stays exactly as it is.
+This is the current chapter, with its paragraphs numbered:
+<CHAPTER>
+{chapter}
+</CHAPTER>
+
+Each edit is one of these operations, on a paragraph numbered as above (the numbers always refer to the chapter above, before any edit):
+- 'expand <n>: <text>' appends the new sentences of the text at the end of the paragraph n.
+- 'replace <n>: <text>' replaces the whole paragraph n with the text.
+- 'insert_after <n>: <text>' inserts the text as a new paragraph after the paragraph n ('insert_after 0' inserts it at the beginning of the chapter).
+Don't write the numbers of the paragraphs inside the texts. Every addition must meaningfully progress the story or deepen the characters, without redundant or repetitive content.
+
+<FORMAT_OUTPUT>
+Return the following Python object, following this JSON schema definition:
+<SCHEMA>
+{schema}
+</SCHEMA>
+As you can see, the schema provides the structure of the expected output. 
+Please pay special attention to the descriptions and data type for each field.
+You should populate the fields with the defined value.
+The description and data type info MUST NOT be returned in your output. Instead, place the value of the particular key.
+</FORMAT_OUTPUT>
+
+Remember to return the correct format output, defined in <FORMAT_OUTPUT> tag. Never plain, conversational text.
+It is mandatory to return the completed JSON object, without missing any key in the dictionary. Don't hallucinate keys that are not present in the schema.
+"""
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import math
+import time
+import zlib
+import random
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, AnyMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_MODEL_ID = 'fake-llm'
+
+# Behaviour of the fake provider. They can be overridden with the FAKE_LLM_<SETTING> environment variables (eg: FAKE_LLM_LATENCY),
+# or with `configure_fake_provider`.
+# - latency: Distribution of the seconds until the first token, as '<distribution>:<parameters>': 'fixed:s', 'uniform:min,max',
+#   'normal:mean,std', 'lognormal:median,sigma' or 'exponential:mean'.
+# - tokens_per_second: Generation speed once the first token arrives. 0 means instantaneous.
+# - rate_limit_error_rate / timeout_rate: Probability of a 429 or a timeout error in each request. The timeouts wait `timeout_seconds` first.
+# - max_retries / retry_backoff: Retries of the failed requests inside the model, with exponential backoff, as the SDKs of the providers do.
+# - no_json_rate / bad_json_rate: Probability of a reply without JSON, or with a truncated JSON object that can't be recovered.
+# - approval_rate: Probability that the critiques and the reviewers approve the idea or the chapter.
+# - chunk_tokens: Tokens of each streamed chunk.
+# - seed: The same seed and the same messages always give the same reply (and the same injected errors).
+# As the real providers, the models created with a `max_tokens` cut their replies there, with the 'length' finish reason, and
+# continue them when they are asked to (see `invoke_structured`).
+DEFAULT_FAKE_SETTINGS = {
+    'latency': 'fixed:0',
+    'tokens_per_second': 0.0,
+    'rate_limit_error_rate': 0.0,
+    'timeout_rate': 0.0,
+    'timeout_seconds': 0.0,
+    'max_retries': 2,
+    'retry_backoff': 0.5,
+    'no_json_rate': 0.0,
+    'bad_json_rate': 0.0,
+    'approval_rate': 1.0,
+    'chunk_tokens': 8,
+    'seed': 0,
+}
+
+_DISTRIBUTIONS = {
+    'fixed': lambda rng, seconds: seconds,
+    'uniform': lambda rng, low, high: rng.uniform(low, high),
+    'normal': lambda rng, mean, std: max(0.0, rng.gauss(mean, std)),
+    'lognormal': lambda rng, median, sigma: rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0,
+    'exponential': lambda rng, mean: rng.expovariate(1 / mean) if mean > 0 else 0.0,
+}
+
+# The schemas are found in the prompts, as `get_json_schema` writes them
+_SCHEMA_MARKER = "This is the schema definition:\n"
+_N_CHAPTERS = re.compile(r"Develop a story with (\d+) chapters|the story MUST have is (\d+)")
+_CHAPTER_SIZE = re.compile(r"must consist of (\d+) paragraphs, with each paragraph containing at least (\d+) sentences")
+# The numbered paragraphs and the deficits of a chapter to revise, as the Writer gets them in a revision with targeted edits
+_NUMBERED_PARAGRAPH = re.compile(r"^\[(\d+)\] ", re.MULTILINE)
+_SHORT_PARAGRAPH = re.compile(r"paragraph (\d+) \((\d+) sentences?\)")
+_MISSING_PARAGRAPHS = re.compile(r"add (\d+) new paragraphs?")
+# The request to continue a reply that was cut, after the reply itself
+_CONTINUATION = "Continue exactly from where your reply was cut"
+_WORDS = "the old lighthouse keeper watched the storm roll over the harbour while a stranger climbed the cliff with a lantern and a secret letter from the capital".split()
+
+_settings: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+class FakeProviderError(Exception):
+    status_code = 500
+
+class FakeRateLimitError(FakeProviderError):
+    status_code = 429
+
+class FakeTimeoutError(FakeProviderError, TimeoutError):
+    status_code = 408
+
+def get_fake_settings() -> Dict[str, Any]:
+    settings = dict(DEFAULT_FAKE_SETTINGS)
+    for key, default in DEFAULT_FAKE_SETTINGS.items():
+        value = os.getenv(f"FAKE_LLM_{key.upper()}")
+        if value is not None:
+            settings[key] = value if isinstance(default, str) else type(default)(value)
+    with _lock:
+        settings.update(_settings)
+    return settings
+
+def configure_fake_provider(**settings):
+    """
+    Changes the behaviour of the fake provider (see DEFAULT_FAKE_SETTINGS). As `configure_pool`, it only applies to the models
+    created afterwards: call it before running the books, or clear the model registry.
+    """
+    unknown = set(settings) - set(DEFAULT_FAKE_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown settings of the fake provider: {sorted(unknown)}. Expected some of: {list(DEFAULT_FAKE_SETTINGS)}")
+    with _lock:
+        _settings.update(settings)
+
+def _parse_distribution(spec: str) -> Tuple[str, List[float]]:
+    name, _, parameters = spec.partition(':')
+    if name not in _DISTRIBUTIONS:
+        raise ValueError(f"Unsupported latency distribution: '{spec}'. Expected one of: {list(_DISTRIBUTIONS)}, as '<distribution>:<parameters>'")
+    return name, [float(parameter) for parameter in parameters.split(',') if parameter.strip() != '']
+
+def _find_schemas(messages: List[AnyMessage]) -> List[Dict[str, Dict[str, str]]]:
+    """
+    The schemas requested by the last message that defines any (the retries only add a correction after it).
+    """
+    decoder = json.JSONDecoder()
+    for message in reversed(messages):
+        content = message.content if isinstance(message.content, str) else ''
+        schemas, start = [], content.find(_SCHEMA_MARKER)
+        while start != -1:
+            schema, end = decoder.raw_decode(content, start + len(_SCHEMA_MARKER))
+            schemas.append(schema)
+            start = content.find(_SCHEMA_MARKER, end)
+        if schemas:
+            return schemas
+    return _schema_of_last_reply(messages)
+
+def _schema_of_last_reply(messages: List[AnyMessage]) -> List[Dict[str, Dict[str, str]]]:
+    """
+    Without a schema in the prompt (eg: a new critique that only sends the previous ones), the models follow the keys of their
+    last JSON reply in the conversation.
+    """
+    decoder = json.JSONDecoder()
+    types = [(bool, 'boolean'), (int, 'integer'), (float, 'number'), (list, 'array')]
+    for message in reversed(messages):
+        content = message.content if isinstance(message.content, str) else ''
+        start = content.find('{')
+        if message.type != 'ai' or start == -1:
+            continue
+        try:
+            reply, _ = decoder.raw_decode(content, start)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(reply, dict):
+            return [{key: {'type': next((name for type_, name in types if isinstance(value, type_)), 'string')} for key, value in reply.items()}]
+    return []
+
+def _search(pattern: re.Pattern, messages: List[AnyMessage]) -> Optional[Tuple[int, ...]]:
+    for message in messages:
+        match = pattern.search(message.content) if isinstance(message.content, str) else None
+        if match:
+            return tuple(int(group) for group in match.groups() if group is not None)
+    return None
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choices(_WORDS, k = rng.randint(8, 16))).capitalize() + "."
+
+def _paragraphs(rng: random.Random, n_paragraphs: int, n_sentences: int) -> str:
+    return "\n\n".join(" ".join(_sentence(rng) for _ in range(n_sentences)) for _ in range(n_paragraphs))
+
+def _edits(rng: random.Random, messages: List[AnyMessage]) -> List[str]:
+    """
+    The edits of a chapter revision: the short paragraphs are expanded and the missing ones inserted at the end.
+    Without deficits (eg: a critique), one paragraph is rewritten.
+    """
+    prompt = messages[-1].content if isinstance(messages[-1].content, str) else ''
+    n_sentences = (_search(_CHAPTER_SIZE, messages) or (10, 10))[1]
+    n_paragraphs = len(_NUMBERED_PARAGRAPH.findall(prompt))
+    edits = [f"expand {n_paragraph}: " + " ".join(_sentence(rng) for _ in range(n_sentences - int(count))) for n_paragraph, count in _SHORT_PARAGRAPH.findall(prompt)]
+    missing = _MISSING_PARAGRAPHS.search(prompt)
+    if missing:
+        edits += [f"insert_after {n_paragraphs}: " + " ".join(_sentence(rng) for _ in range(n_sentences)) for _ in range(int(missing.group(1)))]
+    if edits == [] and n_paragraphs > 0:
+        edits.append(f"replace {rng.randint(1, n_paragraphs)}: " + " ".join(_sentence(rng) for _ in range(n_sentences)))
+    return edits
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model that answers the prompts of the agents with valid JSON objects of the schemas they request, to load-test
+    and profile the graph without network access nor quota. Its latency, speed, provider errors and malformed replies are
+    configurable (see DEFAULT_FAKE_SETTINGS), and deterministic: every reply is drawn from the seed and the messages.
+    """
+    model_name: str = FAKE_MODEL_ID
+    temperature: float = 0.0
+    latency: str = DEFAULT_FAKE_SETTINGS['latency']
+    tokens_per_second: float = DEFAULT_FAKE_SETTINGS['tokens_per_second']
+    rate_limit_error_rate: float = DEFAULT_FAKE_SETTINGS['rate_limit_error_rate']
+    timeout_rate: float = DEFAULT_FAKE_SETTINGS['timeout_rate']
+    timeout_seconds: float = DEFAULT_FAKE_SETTINGS['timeout_seconds']
+    max_retries: int = DEFAULT_FAKE_SETTINGS['max_retries']
+    retry_backoff: float = DEFAULT_FAKE_SETTINGS['retry_backoff']
+    no_json_rate: float = DEFAULT_FAKE_SETTINGS['no_json_rate']
+    bad_json_rate: float = DEFAULT_FAKE_SETTINGS['bad_json_rate']
+    approval_rate: float = DEFAULT_FAKE_SETTINGS['approval_rate']
+    chunk_tokens: int = DEFAULT_FAKE_SETTINGS['chunk_tokens']
+    seed: int = DEFAULT_FAKE_SETTINGS['seed']
+    max_tokens: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return 'fake'
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {'model_name': self.model_name, 'temperature': self.temperature, 'seed': self.seed}
+
+    def _rng(self, messages: List[AnyMessage], purpose: str) -> random.Random:
+        digest = zlib.crc32("\x1e".join(f"{message.type}:{message.content}" for message in messages).encode())
+        return random.Random(f"{self.seed}:{purpose}:{digest}")
+
+    def _value(self, rng: random.Random, key: str, field: Dict[str, str], messages: List[AnyMessage], approved: bool) -> Any:
+        if field.get('type') == 'boolean':
+            return approved
+        if field.get('type') in ['integer', 'number']:
+            return 10 if approved else rng.randint(3, 6)
+        if key == 'edits':
+            return _edits(rng, messages)
+        if field.get('type') == 'array':
+            n_chapters = (_search(_N_CHAPTERS, messages) or (10,))[0]
+            return [" ".join(_sentence(rng) for _ in range(5)) for _ in range(n_chapters)]
+        if key == 'content':
+            n_paragraphs, n_sentences = _search(_CHAPTER_SIZE, messages) or (10, 10)
+            return _paragraphs(rng, n_paragraphs + 1, n_sentences)
+        if key == 'translated_content':
+            # As long as the text to translate, with the same paragraphs
+            source = next((message.content for message in reversed(messages) if message.type == 'human' and isinstance(message.content, str)), '')
+            return "\n\n".join(" ".join(rng.choice(_WORDS) for _ in paragraph.split()) for paragraph in source.split('\n\n'))
+        if key in ['book_name', 'chapter_name', 'translated_book_name', 'translated_chapter_name']:
+            return " ".join(rng.choices(_WORDS, k = 3)).title()
+        return " ".join(_sentence(rng) for _ in range(3))
+
+    def _full_reply(self, messages: List[AnyMessage], truncate: bool = True) -> str:
+        rng = self._rng(messages, 'reply')
+        schemas = _find_schemas(messages)
+        draw = rng.random()
+        if not schemas or draw < self.no_json_rate:
+            return " ".join(_sentence(rng) for _ in range(3))
+        # When the agent can answer with several schemas (eg: approve or critique the chapter), the first one is the approval
+        approved = rng.random() < self.approval_rate
+        schema = schemas[0] if approved or len(schemas) == 1 else rng.choice(schemas[1:])
+        reply = json.dumps({key: self._value(rng, key, field, messages, approved) for key, field in schema.items()}, ensure_ascii = False, indent = 2)
+        if truncate and draw < self.no_json_rate + self.bad_json_rate:
+            # Truncated in the middle of a key, as when the provider cuts the generation
+            cut = reply.rfind('\n  "', 0, len(reply) // 2 + 1)
+            return "```json\n" + reply[:cut + 5 if cut != -1 else len(reply) // 2]
+        return "```json\n" + reply + "\n```"
+
+    def _reply(self, messages: List[AnyMessage]) -> Tuple[str, str]:
+        """
+        The reply to the messages and its finish reason. A continuation is the rest of the reply to the messages before the cut.
+        """
+        last = messages[-1].content if isinstance(messages[-1].content, str) else ''
+        if len(messages) > 2 and messages[-2].type == 'ai' and _CONTINUATION in last:
+            partial = messages[-2].content if isinstance(messages[-2].content, str) else ''
+            full = self._full_reply(messages[:-2], truncate = False)
+            # If the reply was cut after a correction, the model starts again
+            reply = full[len(partial):] if full.startswith(partial) else full
+        else:
+            reply = self._full_reply(messages)
+        if self.max_tokens is not None and _estimate_tokens(reply) > self.max_tokens:
+            return reply[:self.max_tokens * 4], 'length'
+        return reply, 'stop'
+
+    def _failure(self, messages: List[AnyMessage], attempt: int) -> Optional[FakeProviderError]:
+        draw = self._rng(messages, f"failure-{attempt}").random()
+        if draw < self.rate_limit_error_rate:
+            return FakeRateLimitError("Error code: 429 - Rate limit reached for the fake provider.")
+        if draw < self.rate_limit_error_rate + self.timeout_rate:
+            return FakeTimeoutError("Request timed out.")
+        return None
+
+    def _attempts(self, messages: List[AnyMessage]) -> Iterator[Tuple[float, Optional[FakeProviderError]]]:
+        """
+        For every attempt of the request (until one succeeds, or the retries run out): the seconds it takes and its error, if any.
+        """
+        name, parameters = _parse_distribution(self.latency)
+        for attempt in range(self.max_retries + 1):
+            error = self._failure(messages, attempt)
+            if error is None:
+                yield _DISTRIBUTIONS[name](self._rng(messages, f"latency-{attempt}"), *parameters), None
+                return
+            yield (self.timeout_seconds if isinstance(error, FakeTimeoutError) else 0.0), error
+
+    def _chunks(self, reply: str) -> List[str]:
+        size = max(1, self.chunk_tokens) * 4
+        return [reply[start:start + size] for start in range(0, len(reply), size)]
+
+    def _seconds_per_chunk(self, chunk: str) -> float:
+        return _estimate_tokens(chunk) / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _message(self, messages: List[AnyMessage], reply: str, finish_reason: str, chunk: bool = False):
+        input_tokens = sum(_estimate_tokens(str(message.content)) for message in messages)
+        output_tokens = _estimate_tokens(reply)
+        usage = {'input_tokens': input_tokens, 'output_tokens': output_tokens, 'total_tokens': input_tokens + output_tokens}
+        message_class = AIMessageChunk if chunk else AIMessage
+        return message_class(content = reply if not chunk else '', response_metadata = {'finish_reason': finish_reason, 'model_name': self.model_name}, usage_metadata = usage)
+
+    def _result(self, messages: List[AnyMessage], reply: str, finish_reason: str) -> ChatResult:
+        message = self._message(messages, reply, finish_reason)
+        return ChatResult(generations = [ChatGeneration(message = message)], llm_output = {'token_usage': dict(message.usage_metadata), 'model_name': self.model_name})
+
+    def _wait(self, messages: List[AnyMessage]):
+        for attempt, (seconds, error) in enumerate(self._attempts(messages)):
+            time.sleep(seconds)
+            if error is None:
+                return
+            if attempt == self.max_retries:
+                raise error
+            time.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def _await(self, messages: List[AnyMessage]):
+        for attempt, (seconds, error) in enumerate(self._attempts(messages)):
+            await asyncio.sleep(seconds)
+            if error is None:
+                return
+            if attempt == self.max_retries:
+                raise error
+            await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    def _generate(self, messages: List[AnyMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> ChatResult:
+        self._wait(messages)
+        reply, finish_reason = self._reply(messages)
+        time.sleep(sum(self._seconds_per_chunk(chunk) for chunk in self._chunks(reply)))
+        return self._result(messages, reply, finish_reason)
+
+    async def _agenerate(self, messages: List[AnyMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> ChatResult:
+        await self._await(messages)
+        reply, finish_reason = self._reply(messages)
+        await asyncio.sleep(sum(self._seconds_per_chunk(chunk) for chunk in self._chunks(reply)))
+        return self._result(messages, reply, finish_reason)
+
+    def _stream(self, messages: List[AnyMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._wait(messages)
+        reply, finish_reason = self._reply(messages)
+        for chunk in self._chunks(reply):
+            time.sleep(self._seconds_per_chunk(chunk))
+            if run_manager is not None:
+                run_manager.on_llm_new_token(chunk)
+            yield ChatGenerationChunk(message = AIMessageChunk(content = chunk))
+        yield ChatGenerationChunk(message = self._message(messages, reply, finish_reason, chunk = True))
+
+    async def _astream(self, messages: List[AnyMessage], stop: Optional[List[str]] = None, run_manager = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await self._await(messages)
+        reply, finish_reason = self._reply(messages)
+        for chunk in self._chunks(reply):
+            await asyncio.sleep(self._seconds_per_chunk(chunk))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(chunk)
+            yield ChatGenerationChunk(message = AIMessageChunk(content = chunk))
+        yield ChatGenerationChunk(message = self._message(messages, reply, finish_reason, chunk = True))
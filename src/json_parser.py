@@ -0,0 +1,369 @@
+import re
+import json
+from typing import Any, Optional
+
+class NoJson(Exception):
+    pass
+
+class BadFormattedJson(Exception):
+    pass
+
+_FENCE = '```'
+_WHITESPACE = ' \t\n\r'
+_QUOTES = '"\''
+_STRING_STOPS = {'"': re.compile(r'["\\]'), "'": re.compile(r"['\\]")}
+_NUMBER = re.compile(r'-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_IDENTIFIER = re.compile(r'[A-Za-z_$][\w$-]*')
+_LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+# Longest key we look ahead for when deciding if a quote closes a string or is an unescaped quote inside it
+_MAX_KEY_LENGTH = 100
+
+_decoder = json.JSONDecoder()
+
+class _ParseError(Exception):
+    def __init__(self, message: str, pos: int):
+        super().__init__(message)
+        self.message = message
+        self.pos = pos
+
+class _TolerantParser:
+    """
+    Recursive descent parser for the JSON objects the LLMs generate. It reads the text once, building the Python objects on the way,
+    and accepts the usual mistakes of the models: unescaped quotes and raw line breaks inside the strings, single quotes,
+    unquoted keys, trailing or missing commas, Python literals (True, False, None) and text or an unterminated fence after the object.
+
+    An unescaped quote is taken as the end of a string only if what comes after it makes sense (eg: a `:` after a key, or a `,` followed by the next key).
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self.length = len(text)
+        self.pos = 0
+
+    def parse(self, start: int, context: str = 'root') -> Any:
+        self.pos = start
+        return self._value(context)
+
+    def _skip_whitespace(self, pos: int) -> int:
+        while pos < self.length and self.text[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def _at_end(self, pos: int) -> bool:
+        return pos >= self.length or self.text.startswith(_FENCE, pos)
+
+    def _value(self, context: str) -> Any:
+        self.pos = self._skip_whitespace(self.pos)
+        if self._at_end(self.pos):
+            raise _ParseError("Expecting value, the JSON object is incomplete", self.pos)
+        char = self.text[self.pos]
+        if char == '{':
+            return self._object()
+        if char == '[':
+            return self._array()
+        if char in _QUOTES:
+            return self._string(context)
+        match = _NUMBER.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group()
+            return float(number) if any(char in number for char in '.eE') else int(number)
+        match = _IDENTIFIER.match(self.text, self.pos)
+        if match and match.group() in _LITERALS:
+            self.pos = match.end()
+            return _LITERALS[match.group()]
+        raise _ParseError("Expecting value", self.pos)
+
+    def _object(self) -> dict:
+        start = self.pos
+        self.pos += 1
+        result = {}
+        while True:
+            self.pos = self._skip_separators(self.pos)
+            if self._at_end(self.pos):
+                raise _ParseError("Unterminated object, the JSON object is incomplete", start)
+            char = self.text[self.pos]
+            if char == '}':
+                self.pos += 1
+                return result
+            if char in _QUOTES:
+                key = self._string('key')
+            else:
+                match = _IDENTIFIER.match(self.text, self.pos)
+                if match is None:
+                    raise _ParseError("Expecting property name enclosed in double quotes", self.pos)
+                key = match.group()
+                self.pos = match.end()
+            self.pos = self._skip_whitespace(self.pos)
+            if self.pos >= self.length or self.text[self.pos] != ':':
+                raise _ParseError("Expecting ':' delimiter", self.pos)
+            self.pos += 1
+            result[key] = self._value('object')
+
+    def _array(self) -> list:
+        start = self.pos
+        self.pos += 1
+        result = []
+        while True:
+            self.pos = self._skip_separators(self.pos)
+            if self._at_end(self.pos):
+                raise _ParseError("Unterminated array, the JSON object is incomplete", start)
+            if self.text[self.pos] == ']':
+                self.pos += 1
+                return result
+            result.append(self._value('array'))
+
+    def _skip_separators(self, pos: int) -> int:
+        while pos < self.length and (self.text[pos] in _WHITESPACE or self.text[pos] == ','):
+            pos += 1
+        return pos
+
+    def _string(self, context: str) -> str:
+        start = self.pos
+        quote = self.text[self.pos]
+        stops = _STRING_STOPS[quote]
+        self.pos += 1
+        chunks = []
+        while True:
+            match = stops.search(self.text, self.pos)
+            if match is None:
+                raise _ParseError("Unterminated string, the JSON object is incomplete", start)
+            chunks.append(self.text[self.pos:match.start()])
+            self.pos = match.end()
+            if match.group() == '\\':
+                chunks.append(self._escape())
+            elif self._closes_string(context):
+                break
+            else:
+                chunks.append(quote)
+        value = ''.join(chunks)
+        if any('\ud800' <= char <= '\udfff' for char in value):
+            value = value.encode('utf-16', 'surrogatepass').decode('utf-16', 'replace')
+        return value
+
+    def _escape(self) -> str:
+        if self.pos >= self.length:
+            raise _ParseError("Unterminated string, the JSON object is incomplete", self.pos)
+        char = self.text[self.pos]
+        self.pos += 1
+        if char == 'u':
+            try:
+                code = int(self.text[self.pos:self.pos + 4], 16)
+                self.pos += 4
+                return chr(code)
+            except ValueError:
+                return char
+        # Unknown escapes (eg: \' or \$) are kept as the plain character
+        return _ESCAPES.get(char, char)
+
+    def _is_key_at(self, pos: int) -> bool:
+        """
+        Checks, without consuming anything, if a property name followed by ':' starts at the position.
+        """
+        if self.text[pos] in _QUOTES:
+            end = self.text.find(self.text[pos], pos + 1, pos + 1 + _MAX_KEY_LENGTH)
+            if end == -1:
+                return False
+            end += 1
+        else:
+            match = _IDENTIFIER.match(self.text, pos)
+            if match is None:
+                return False
+            end = match.end()
+        end = self._skip_whitespace(end)
+        return end < self.length and self.text[end] == ':'
+
+    def _is_value_at(self, pos: int) -> bool:
+        if self.text[pos] in '{["\'':
+            return True
+        if _NUMBER.match(self.text, pos):
+            return True
+        match = _IDENTIFIER.match(self.text, pos)
+        return match is not None and match.group() in _LITERALS
+
+    def _closes_string(self, context: str) -> bool:
+        """
+        Decides if the quote just read closes the string, looking at what comes after it.
+        """
+        pos = self._skip_whitespace(self.pos)
+        if self._at_end(pos):
+            return True
+        char = self.text[pos]
+        if context == 'key':
+            return char == ':'
+        if char in '}]':
+            return True
+        if char == ',':
+            pos = self._skip_whitespace(pos + 1)
+            if self._at_end(pos) or self.text[pos] in '}]':
+                return True
+            if context == 'object':
+                return self._is_key_at(pos)
+            return self._is_value_at(pos)
+        if context == 'object' and (char in _QUOTES or '\n' in self.text[self.pos:pos]):
+            # Missing comma before the next key (an unquoted one only counts when it starts a new line)
+            return self._is_key_at(pos)
+        return context == 'root'
+
+def find_json_start(content: str) -> Optional[int]:
+    """
+    Returns where the JSON value starts: inside the ```json fence if there is one, otherwise the first object (or array) of the text.
+    """
+    fence = content.find(_FENCE + 'json')
+    if fence != -1:
+        candidates = [content.find(char, fence) for char in '{[']
+        candidates = [candidate for candidate in candidates if candidate != -1]
+        if candidates:
+            return min(candidates)
+    for char in '{[':
+        start = content.find(char)
+        if start != -1:
+            return start
+    return None
+
+def parse_llm_json(content: str) -> Any:
+    """
+    Extracts and parses the JSON value of an LLM reply in a single pass, recovering locally the common syntax mistakes
+    instead of asking the model again.
+
+    The well formed replies are decoded by the standard (C) decoder; only the broken ones go through the tolerant parser.
+
+    :param content: The text generated by the model
+    :return: The parsed JSON value (usually a dict)
+    :raises NoJson: If the text has no JSON value
+    :raises BadFormattedJson: If the JSON value can't be recovered, with the error, its location and the context around it
+    """
+    start = find_json_start(content)
+    if start is None:
+        raise NoJson("The output does not contain a JSON code block")
+    try:
+        return _decoder.raw_decode(content, start)[0]
+    except json.JSONDecodeError:
+        pass
+    try:
+        return _TolerantParser(content).parse(start)
+    except _ParseError as e:
+        line = content.count('\n', 0, e.pos) + 1
+        column = e.pos - content.rfind('\n', 0, e.pos)
+        raise BadFormattedJson({"error": f"While trying to format the JSON object you have generated we detect the following error: {e.message}", "detail": f"Error location: Line {line}, Column {column}", "context": f"{content[max(0, e.pos-50):e.pos+50]}"})
+    except RecursionError:
+        raise BadFormattedJson({"error": "While trying to format the JSON object you have generated we detect the following error: the object is too deeply nested", "detail": "", "context": ""})
+
+class IncrementalJsonReader:
+    """
+    Reads a JSON object while the model is still generating it, chunk by chunk.
+
+    Each top-level field is surfaced (in `fields`) as soon as its value is complete, and the raw text of the field being written
+    is available in `current_key` / `current_value`. The reader only follows double quoted JSON: if the reply has a mistake it
+    can't follow (eg: an unescaped quote), it stops surfacing fields (`lost` is True) and the full reply must be parsed at the end.
+    """
+    def __init__(self):
+        self.text = ''
+        self.fields = {}
+        self.current_key = None
+        self.lost = False
+        self._pos = 0
+        self._state = 'search'
+        self._depth = 0
+        self._in_string = False
+        self._key_start = None
+        self._value_start = None
+
+    @property
+    def current_value(self) -> str:
+        if self._state != 'value':
+            return ''
+        return self.text[self._value_start:]
+
+    @property
+    def is_complete(self) -> bool:
+        return self._state == 'done'
+
+    @property
+    def is_cut(self) -> bool:
+        """
+        True if the text ends in the middle of the JSON object (eg: the generation was cut), as far as the reader could follow it.
+        """
+        return self._state not in ('search', 'done', 'lost')
+
+    def feed(self, chunk: str) -> list:
+        """
+        Adds the new text and returns the names of the fields completed by it.
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self._pos < len(text) and self._state not in ('done', 'lost'):
+            if self._in_string:
+                match = _STRING_STOPS['"'].search(text, self._pos)
+                if match is None:
+                    self._pos = len(text)
+                    break
+                if match.group() == '\\':
+                    if match.end() >= len(text):
+                        # Wait for the escaped character
+                        self._pos = match.start()
+                        break
+                    self._pos = match.end() + 1
+                    continue
+                self._in_string = False
+                self._pos = match.end()
+                if self._state == 'key':
+                    self.current_key = text[self._key_start:match.start()]
+                    self._state = 'colon'
+                continue
+
+            char = text[self._pos]
+            if self._state == 'search':
+                start = find_json_start(text)
+                if start is None or text[start] != '{':
+                    self._pos = len(text)
+                    break
+                self._state, self._depth, self._pos = 'key', 1, start + 1
+                continue
+            if self._state == 'key':
+                if char == '"':
+                    self._in_string = True
+                    self._key_start = self._pos + 1
+                elif char == '}':
+                    self._state = 'done'
+                elif char not in _WHITESPACE and char != ',':
+                    self._lose()
+            elif self._state == 'colon':
+                if char == ':':
+                    self._state = 'value'
+                    self._value_start = self._pos + 1
+                elif char not in _WHITESPACE:
+                    self._lose()
+            elif self._state == 'value':
+                if char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                elif char in '}]':
+                    self._depth -= 1
+                if (char == ',' and self._depth == 1) or self._depth == 0:
+                    if not self._complete_field():
+                        break
+                    completed.append(self.current_key)
+                    self._state = 'done' if self._depth == 0 else 'key'
+            self._pos += 1
+        return completed
+
+    def _lose(self):
+        self._state = 'lost'
+        self.lost = True
+
+    def _complete_field(self) -> bool:
+        raw = self.text[self._value_start:self._pos].strip()
+        parser = _TolerantParser(raw)
+        try:
+            value = parser.parse(0, context = 'object')
+        except (_ParseError, RecursionError):
+            self._lose()
+            return False
+        if parser._skip_whitespace(parser.pos) != len(raw):
+            self._lose()
+            return False
+        self.fields[self.current_key] = value
+        return True
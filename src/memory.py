@@ -0,0 +1,102 @@
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import json
+from typing import Dict, List, Optional
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage, SystemMessage
+from src.utils import State, GraphConfig, SCRATCHPAD_FIELDS
+from src.json_parser import NoJson, BadFormattedJson, parse_llm_json
+
+def estimate_tokens(messages: List[AnyMessage]) -> int:
+    """
+    Rough number of tokens of the messages (4 characters per token), enough to keep the prompts under a budget.
+    """
+    return sum(len(message.content) if isinstance(message.content, str) else len(json.dumps(message.content)) for message in messages) // 4
+
+def chapter_message(content: str, n_chapter: int) -> HumanMessage:
+    """
+    Human message of the memory of an agent tagged with the chapter it is about, so the memory can be grouped by chapter later.
+    """
+    return HumanMessage(content = content, additional_kwargs = {'chapter': n_chapter})
+
+def _group_by_chapter(messages: List[AnyMessage]) -> Dict[int, List[AnyMessage]]:
+    """
+    Groups the messages by the chapter of the last tagged human message. The untagged ones (eg: memories of older runs) go with the previous chapter.
+    """
+    groups = {}
+    n_chapter = 1
+    for message in messages:
+        if isinstance(message, HumanMessage) and 'chapter' in message.additional_kwargs:
+            n_chapter = message.additional_kwargs['chapter']
+        groups.setdefault(n_chapter, []).append(message)
+    return groups
+
+def _compact_reply(message: AnyMessage) -> AnyMessage:
+    """
+    Drops the reasoning and reflection fields from a JSON reply of the agent, keeping only its result.
+    """
+    if not isinstance(message, AIMessage) or not isinstance(message.content, str):
+        return message
+    try:
+        parsed = parse_llm_json(message.content)
+    except (NoJson, BadFormattedJson):
+        return message
+    if not isinstance(parsed, dict) or not any(field in parsed for field in SCRATCHPAD_FIELDS):
+        return message
+    compacted = {key: value for key, value in parsed.items() if key not in SCRATCHPAD_FIELDS}
+    return AIMessage(content = f"```json\n{json.dumps(compacted)}````")
+
+def _summary_messages(chapters: List[int], state: State) -> List[AnyMessage]:
+    if chapters == []:
+        return []
+    chapter_names = state.get('chapter_names_of_approved_chapters', [])
+    plan = state.get('plannified_chapters_summaries', [])
+    lines = []
+    for n_chapter in chapters:
+        name = chapter_names[n_chapter - 1] if n_chapter <= len(chapter_names) else f"Chapter {n_chapter}"
+        summary = plan[n_chapter - 1] if n_chapter <= len(plan) else ""
+        lines.append(f"- Chapter {n_chapter} ({name}): {summary}")
+    return [
+        HumanMessage(content = "To keep our conversation short, the chapters we already finished are summarized here instead of repeated in full:\n<SUMMARY_OF_PREVIOUS_CHAPTERS>\n" + "\n".join(lines) + "\n</SUMMARY_OF_PREVIOUS_CHAPTERS>"),
+        AIMessage(content = "Understood, I will keep the previous chapters in mind for the continuity of the story."),
+    ]
+
+def bounded_memory(messages: List[AnyMessage], state: State, config: GraphConfig) -> List[AnyMessage]:
+    """
+    Builds the memory sent to the Writer or the Writing Reviewer, so its size doesn't grow with the length of the book.
+
+    It keeps the system prompt, the messages of the last `memory_recent_chapters` chapters (without the reasoning and reflection steps of the replies)
+    and a rolling summary of the older chapters, based on the chapter summaries of the plan. If `memory_max_tokens` is set, the oldest verbatim
+    chapters are moved to the summary, and then the oldest summaries are dropped, until the memory fits in that budget.
+    The full memory is still kept in the state.
+    """
+    recent_chapters = max(1, config['configurable'].get('memory_recent_chapters', 2))
+    max_tokens: Optional[int] = config['configurable'].get('memory_max_tokens', None)
+
+    system_messages = [message for message in messages[:1] if isinstance(message, SystemMessage)]
+    groups = _group_by_chapter(messages[len(system_messages):])
+    chapters = sorted(groups)
+    verbatim_chapters = chapters[-recent_chapters:]
+    summarized_chapters = chapters[:-recent_chapters] if len(chapters) > recent_chapters else []
+
+    def build():
+        verbatim = [_compact_reply(message) for n_chapter in verbatim_chapters for message in groups[n_chapter]]
+        return system_messages + _summary_messages(summarized_chapters, state) + verbatim
+
+    memory = build()
+    while max_tokens is not None and estimate_tokens(memory) > max_tokens:
+        if len(verbatim_chapters) > 1:
+            summarized_chapters = summarized_chapters + verbatim_chapters[:1]
+            verbatim_chapters = verbatim_chapters[1:]
+        elif summarized_chapters != []:
+            summarized_chapters = summarized_chapters[1:]
+        else:
+            break
+        memory = build()
+    return memory
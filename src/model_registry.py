@@ -0,0 +1,133 @@
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import threading
+from typing import Dict, Optional, Tuple
+import httpx
+from botocore.config import Config
+from langchain_core.language_models import BaseChatModel
+from langchain_openai.chat_models import ChatOpenAI
+from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
+from langchain_groq import ChatGroq
+from langchain_aws.chat_models import ChatBedrock
+from src.rate_limiter import get_rate_limiter, RateLimitUsageCallback
+from src.cache import get_response_cache, get_single_flight_callback
+from src.fake_provider import FakeChatModel, FAKE_MODEL_ID, get_fake_settings
+
+MODEL_IDS = {
+    'openai': 'gpt-4o-mini',
+    'google': 'gemini-exp-1206',
+    'meta': 'llama-3.3-70b-versatile',
+    'deepseek': 'deepseek-r1-distill-llama-70b',
+    'amazon': 'anthropic.claude-3-5-sonnet-20240620-v1:0',
+    'fake': FAKE_MODEL_ID,
+}
+
+# Connection pool of each provider, shared by every model (and every book) of the process.
+# They can be overridden with the LLM_POOL_<PROVIDER>_MAX_CONNECTIONS and LLM_POOL_<PROVIDER>_TIMEOUT environment variables, or with `configure_pool`.
+DEFAULT_POOL_SETTINGS = {'max_connections': 20, 'timeout': 120.0}
+
+_pool_settings: Dict[str, Dict[str, float]] = {}
+_http_clients: Dict[str, httpx.Client] = {}
+_models: Dict[Tuple, BaseChatModel] = {}
+_stats = {'created': 0, 'reused': 0}
+_lock = threading.Lock()
+
+def get_pool_settings(provider: str) -> Dict[str, float]:
+    settings = dict(DEFAULT_POOL_SETTINGS)
+    for key, env_suffix, cast in [('max_connections', 'MAX_CONNECTIONS', int), ('timeout', 'TIMEOUT', float)]:
+        value = os.getenv(f"LLM_POOL_{provider.upper()}_{env_suffix}")
+        if value is not None:
+            settings[key] = cast(value)
+    settings.update(_pool_settings.get(provider, {}))
+    return settings
+
+def configure_pool(provider: str, max_connections: Optional[int] = None, timeout: Optional[float] = None):
+    """
+    Sets the pool size and the timeout of a provider. Its client is closed and its models are evicted, so they are re-created with the new settings;
+    the models already handed out keep the closed client, so call it before running the books.
+    """
+    with _lock:
+        settings = _pool_settings.setdefault(provider, {})
+        if max_connections is not None:
+            settings['max_connections'] = max_connections
+        if timeout is not None:
+            settings['timeout'] = timeout
+        client = _http_clients.pop(provider, None)
+        if client is not None:
+            client.close()
+        for key in [key for key in _models if key[0] == provider]:
+            del _models[key]
+
+def _http_client(provider: str) -> httpx.Client:
+    """
+    Keep-alive HTTP client of the provider (for the OpenAI compatible SDKs), so the TLS connections are reused between calls.
+    """
+    if provider not in _http_clients:
+        settings = get_pool_settings(provider)
+        _http_clients[provider] = httpx.Client(
+            limits = httpx.Limits(max_connections = settings['max_connections'], max_keepalive_connections = settings['max_connections']),
+            timeout = settings['timeout']
+        )
+    return _http_clients[provider]
+
+def _build_chat_model(provider: str, temperature: float, top_k: int, top_p: float, max_tokens: Optional[int] = None) -> BaseChatModel:
+    rate_limiter = get_rate_limiter(provider)
+    common_kwargs = {'rate_limiter': rate_limiter, 'callbacks': [RateLimitUsageCallback(rate_limiter)]}
+    settings = get_pool_settings(provider)
+    # Without a maximum of output tokens, the default of the provider applies
+    if provider == "openai":
+        return ChatOpenAI(temperature=temperature, model=MODEL_IDS[provider], top_k = top_k, top_p = top_p, max_tokens = max_tokens, http_client = _http_client(provider), timeout = settings['timeout'], **common_kwargs)
+    elif provider == "google":
+        return ChatGoogleGenerativeAI(temperature=temperature, model=MODEL_IDS[provider], top_k = top_k, top_p = top_p, max_output_tokens = max_tokens, timeout = settings['timeout'], **common_kwargs)
+    elif provider in ['meta', 'deepseek']:
+        #Groq doesnt support top_k
+        return ChatGroq(temperature=temperature, model=MODEL_IDS[provider], model_kwargs = {'top_p':top_p}, max_tokens = max_tokens, http_client = _http_client(provider), timeout = settings['timeout'], **common_kwargs)
+    elif provider == 'amazon':
+        model_kwargs = {'temperature':temperature, 'top_k': top_k, 'top_p': top_p}
+        if max_tokens is not None:
+            model_kwargs['max_tokens'] = max_tokens
+        return ChatBedrock(model_id = MODEL_IDS[provider], model_kwargs = model_kwargs, config = Config(max_pool_connections = settings['max_connections'], read_timeout = settings['timeout']), **common_kwargs)
+    elif provider == 'fake':
+        # Offline, for load tests and profiling, see src/fake_provider.py
+        return FakeChatModel(temperature = temperature, max_tokens = max_tokens, **get_fake_settings(), **common_kwargs)
+    raise ValueError(f"Unsupported model: '{provider}'. Expected one of: 'openai', 'google', 'meta', 'deepseek', 'amazon', 'fake'")
+
+def get_chat_model(provider: str, temperature: float, top_k: int = 50, top_p: float = 0.9, cached: bool = False, max_tokens: Optional[int] = None) -> BaseChatModel:
+    """
+    Returns the chat model for these parameters, creating it only the first time.
+
+    The models are memoized by (provider, model id, temperature, top_k, top_p, max_tokens) plus whether their responses are cached,
+    so every node, and every book running in the process, reuses the same client and its open connections.
+    The replies of the fake provider are never cached: they cost nothing, and replaying them would hide the latency being measured.
+    """
+    cached = cached and provider != 'fake'
+    key = (provider, MODEL_IDS.get(provider), temperature, top_k, top_p, max_tokens, cached)
+    with _lock:
+        if key in _models:
+            _stats['reused'] += 1
+            return _models[key]
+        chat_model = _build_chat_model(provider, temperature, top_k, top_p, max_tokens)
+        if cached:
+            chat_model.cache = get_response_cache(provider = provider, model_name = MODEL_IDS[provider])
+            chat_model.callbacks = chat_model.callbacks + [get_single_flight_callback()]
+        _models[key] = chat_model
+        _stats['created'] += 1
+        return chat_model
+
+def get_registry_stats() -> Dict[str, int]:
+    with _lock:
+        return {'models': len(_models), **_stats}
+
+def clear_model_registry():
+    with _lock:
+        _models.clear()
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
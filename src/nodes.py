@@ -8,160 +8,76 @@ os.chdir(WORKDIR)
 sys.path.append(WORKDIR)
 
 from src.constants import *
-from src.utils import State, DocumentationReady, ApprovedBrainstormingIdea, TranslatorStructuredOutput, TranslatorSpecialCaseStructuredOutput, retrieve_model_name, get_json_schema, NarrativeBrainstormingStructuredOutput, IdeaBrainstormingStructuredOutput, ApprovedWriterChapter,CritiqueWriterChapter,WriterStructuredOutput, NoJson, BadFormattedJson
+from src.utils import State, DocumentationReady, ApprovedBrainstormingIdea, TranslatorStructuredOutput, TranslatorSpecialCaseStructuredOutput, retrieve_model_name, get_json_schema, is_lean_node, lean_prompt, NarrativeBrainstormingStructuredOutput, IdeaBrainstormingStructuredOutput, ApprovedWriterChapter,CritiqueWriterChapter,WriterStructuredOutput,WriterRevisionStructuredOutput,ContinuityEditorStructuredOutput
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-from src.utils import GraphConfig, _get_model, check_chapter, adding_delay_for_rate_limits, cleaning_llm_output
-from pydantic import ValidationError
+from langchain_core.runnables import RunnableConfig
+from src.utils import GraphConfig, _get_model, chapter_max_tokens, cleaning_llm_output
+from src.structured_output import structured_call, ConcurrentCalls, node_from_steps, is_budget_degraded, get_invocation_records
+from src.accounting import build_run_report, format_run_report
+from src.memory import bounded_memory, chapter_message
+from src.tracing import log_event, node_span
+from src.chapter_validator import validate_chapter
+from src.chapter_revision import apply_edits, number_paragraphs, diff_paragraphs, format_paragraph_changes
+from src.story_bible import build_story_bible, get_story_bible, format_user_requirements, format_idea_draft
 import json
 
 
-def get_clear_instructions(state: State, config: GraphConfig):
+def _get_clear_instructions(state: State, config: GraphConfig):
     model = _get_model(config = config, default = "openai", key = "instructor_model", temperature = 0)
-    system_prompt = INSTRUCTOR_PROMPT.format(
-        schema = get_json_schema(DocumentationReady),
-        
+    lean = is_lean_node(config, 'instructor_model')
+    system_prompt = lean_prompt(INSTRUCTOR_PROMPT) if lean else INSTRUCTOR_PROMPT
+    system_prompt = system_prompt.format(
+        schema = get_json_schema(DocumentationReady, lean),
+
     )
     messages = [SystemMessage(content = system_prompt)] + state['user_instructor_messages']
-    adding_delay_for_rate_limits(model)
-    reply = model.invoke(messages)
-    try:
-        cleaned_reply = cleaning_llm_output(llm_output = reply)
-        print("The instructor agent has gathered the user requirements into a document for the next agent.")
-    except:
-        cleaned_reply = reply.content
+    cleaned_reply, reply = yield structured_call(model, messages, DocumentationReady, config = config, node = 'instructor', allow_plain_text = True)
 
     if isinstance(cleaned_reply, str):
         return {'user_instructor_messages': [reply],
                 'instructor_model': retrieve_model_name(model)}
-    elif isinstance(cleaned_reply, dict):
+    else:
+        log_event("The instructor agent has gathered the user requirements into a document for the next agent.")
         return {
             'user_instructor_messages': [AIMessage(content="Done, executed")],
-            'instructor_documents': DocumentationReady(**cleaned_reply),
+            'instructor_documents': cleaned_reply,
             'instructor_model': retrieve_model_name(model)
             }
+get_clear_instructions = node_from_steps(_get_clear_instructions)
 
 def read_human_feedback(state: State):
     pass
 
-def brainstorming_idea_critique(state: State, config: GraphConfig):
+def _brainstorming_idea_critique(state: State, config: GraphConfig):
     model = _get_model(config, default = "openai", key = "brainstormer_critique_model", temperature = 0.15)
     critiques_in_loop = config['configurable'].get('critiques_in_loop', False)
 
-    if state['critique_brainstorming_messages'] == []:
-        print("The Brainstorming Idea Critique Agent will make the first critique.")
-        user_requirements = "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()])
+    if is_budget_degraded(config):
+        log_event("The Brainstorming Idea Critique Agent will not make a critique, the budget of the book is exceeded.")
+        cleaned_output = ApprovedBrainstormingIdea(grade=10, feedback="")
+
+    elif state['critique_brainstorming_messages'] == []:
+        log_event("The Brainstorming Idea Critique Agent will make the first critique.")
+        user_requirements = format_user_requirements(state['instructor_documents'])
         system_prompt = CRITIQUE_IDEA_PROMPT
         messages = [
          SystemMessage(content = system_prompt.format(user_requirements=user_requirements, schema = get_json_schema(ApprovedBrainstormingIdea),)),
          HumanMessage(content = state['plannified_messages'][-1].content)
         ]
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(messages)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Brainstorming Idea Critique Agent couln't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Brainstorming Idea Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-        try:
-            cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
-        except ValidationError as e:
-            print("The Brainstorming Idea Critique Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Brainstorming Idea Critique Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Brainstorming Idea Critique Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Idea Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Idea Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)      
-                print("Succesfully generated the JSON object")      
-
-
-            cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
+        cleaned_output, _ = yield structured_call(model, messages, ApprovedBrainstormingIdea, config = config, node = 'brainstorming_idea_critique')
 
     else:
         if (critiques_in_loop == False)&((state['is_general_story_plan_approved'] == False)|(state['critique_brainstorming_messages'] != [])):
-            print("The Brainstorming Idea Critique Agent will not make a new critique.")
+            log_event("The Brainstorming Idea Critique Agent will not make a new critique.")
             cleaned_output = ApprovedBrainstormingIdea(grade=10, feedback="")
 
         else:
-            print("The Brainstorming Idea Critique Agent will make a new critique.")
+            log_event("The Brainstorming Idea Critique Agent will make a new critique.")
             messages = state['critique_brainstorming_messages'] + [HumanMessage(content = state['plannified_messages'][-1].content)]
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(messages)
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Idea Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Idea Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-
-            try:
-                cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Idea Critique Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Idea Critique Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Idea Critique Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Idea Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object")
-                except BadFormattedJson as e:
-                    print("The Brainstorming Idea Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object")
-                cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
+            cleaned_output, _ = yield structured_call(model, messages, ApprovedBrainstormingIdea, config = config, node = 'brainstorming_idea_critique')
 
     if int(cleaned_output.grade) <= 6:
-        print("The Brainstorming Idea Critique Agent has not approved the idea.")
+        log_event("The Brainstorming Idea Critique Agent has not approved the idea.")
         feedback = cleaned_output.feedback
         is_general_story_plan_approved = False
 
@@ -170,130 +86,43 @@ def brainstorming_idea_critique(state: State, config: GraphConfig):
                 'brainstorming_critique_model': retrieve_model_name(model)
                 }
     else:
-        print("The Brainstorming Idea Critique Agent has approved the idea.")
+        log_event("The Brainstorming Idea Critique Agent has approved the idea.")
         return {'is_general_story_plan_approved': True,
                 'critique_brainstorming_messages': [AIMessage(content="Perfect!!")],
                 'brainstorming_critique_model': retrieve_model_name(model)
                 }
+brainstorming_idea_critique = node_from_steps(_brainstorming_idea_critique)
 
-def brainstorming_narrative_critique(state: State, config: GraphConfig):
+def _brainstorming_narrative_critique(state: State, config: GraphConfig):
     model = _get_model(config, default = "openai", key = "brainstormer_critique_model", temperature = 0.15)
     critiques_in_loop = config['configurable'].get('critiques_in_loop', False)
 
-    if state['critique_brainstorming_narrative_messages'] == []:
-        print("The Brainstorming Narrative Critique Agent will make the first critique.")
-        user_requirements = "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()])
+    if is_budget_degraded(config):
+        log_event("The Brainstorming Narrative Critique Agent will not make a critique, the budget of the book is exceeded.")
+        cleaned_output = ApprovedBrainstormingIdea(grade=10, feedback="")
+
+    elif state['critique_brainstorming_narrative_messages'] == []:
+        log_event("The Brainstorming Narrative Critique Agent will make the first critique.")
+        user_requirements = format_user_requirements(state['instructor_documents'])
         system_prompt = CRITIQUE_NARRATIVE_PROMPT
         messages = [
          SystemMessage(content = system_prompt.format(user_requirements=user_requirements, schema = get_json_schema(ApprovedBrainstormingIdea))),
          HumanMessage(content = str(state['plannified_chapters_messages'][-1].content))
         ]
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(messages)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Brainstorming Narrative Critique Agent couln't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Brainstorming Narrative Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-        try:
-            cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
-        except ValidationError as e:
-            print("The Brainstorming Narrative Critique Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Brainstorming Narrative Critique Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Brainstorming Narrative Critique Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Narrative Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Narrative Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-
-            cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
+        cleaned_output, _ = yield structured_call(model, messages, ApprovedBrainstormingIdea, config = config, node = 'brainstorming_narrative_critique')
 
     else:
         if (critiques_in_loop == False)&((state['is_detailed_story_plan_approved'] == False)|(state['critique_brainstorming_narrative_messages'] != [])):
-            print("The Brainstorming Narrative Critique Agent will not make a new critique.")
+            log_event("The Brainstorming Narrative Critique Agent will not make a new critique.")
             cleaned_output = ApprovedBrainstormingIdea(grade=10, feedback="")
         else:
-            print("The Brainstorming Narrative Critique Agent will make a new critique.")
-            messages = state['critique_brainstorming_narrative_messages'] + [HumanMessage(content = state['plannified_chapters_messages'][-1])]
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(messages)
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Narrative Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Narrative Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            try:
-                cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Narrative Critique Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Narrative Critique Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Narrative Critique Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Narrative Critique Agent couln't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object")
-                except BadFormattedJson as e:
-                    print("The Brainstorming Narrative Critique Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object")
-
-                cleaned_output = ApprovedBrainstormingIdea(**cleaned_output)
+            log_event("The Brainstorming Narrative Critique Agent will make a new critique.")
+            messages = state['critique_brainstorming_narrative_messages'] + [HumanMessage(content = str(state['plannified_chapters_messages'][-1].content))]
+            cleaned_output, _ = yield structured_call(model, messages, ApprovedBrainstormingIdea, config = config, node = 'brainstorming_narrative_critique')
 
 
     if int(cleaned_output.grade) <= 9:
-        print("The Brainstorming Narrative Critique Agent has not approved the idea.")
+        log_event("The Brainstorming Narrative Critique Agent has not approved the idea.")
         feedback = cleaned_output.feedback
         is_general_story_plan_approved = False
 
@@ -302,471 +131,297 @@ def brainstorming_narrative_critique(state: State, config: GraphConfig):
                 'brainstorming_critique_model': retrieve_model_name(model)
                 }
     else:
-        print("The Brainstorming Narrative Critique Agent has approved the idea.")
+        log_event("The Brainstorming Narrative Critique Agent has approved the idea.")
         return {'is_detailed_story_plan_approved': True,
                 'critique_brainstorming_narrative_messages': [AIMessage(content="Perfect!!")],
                 'brainstorming_critique_model': retrieve_model_name(model)
                 }
+brainstorming_narrative_critique = node_from_steps(_brainstorming_narrative_critique)
 
-def making_narrative_story_brainstorming(state: State, config: GraphConfig):
+def _making_narrative_story_brainstorming(state: State, config: GraphConfig):
     model = _get_model(config, default = "openai", key = "brainstormer_idea_model", temperature = 0.7, top_k = 200, top_p = 0.85)
-    user_requirements = "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()])
 
     if state.get('is_detailed_story_plan_approved', None) is None:
-        print("The Brainstorming Narrative Agent will generate the narrative of the story based on the information from the Brainstorming Idea Agent")
-        system_prompt = BRAINSTORMING_NARRATIVE_PROMPT
+        log_event("The Brainstorming Narrative Agent will generate the narrative of the story based on the information from the Brainstorming Idea Agent")
+        lean = is_lean_node(config, 'brainstormer_idea_model')
+        system_prompt = lean_prompt(BRAINSTORMING_NARRATIVE_PROMPT) if lean else BRAINSTORMING_NARRATIVE_PROMPT
         n_chapters = 10 if config['configurable'].get('n_chapters') is None else config['configurable'].get('n_chapters')
-        system_prompt = SystemMessage(content = system_prompt.format(user_requirements=user_requirements,idea_draft=f"Story overview: {state['story_overview']}\n" f"Context and Setting: {state['plannified_context_setting']}\n" f"Inciting Incident: {state['plannified_inciting_incident']}\n" f"Themes and Conflicts Introduction: {state['plannified_themes_conflicts_intro']}\n" f"Transition to Development: {state['plannified_transition_to_development']}\n" f"Rising Action: {state['plannified_rising_action']}\n" f"Subplots: {state['plannified_subplots']}\n" f"Midpoint: {state['plannified_midpoint']}\n" f"Climax Build-Up: {state['plannified_climax_build_up']}\n" f"Climax: {state['plannified_climax']}\n" f"Falling Action: {state['plannified_falling_action']}\n" f"Resolution: {state['plannified_resolution']}\n" f"Epilogue: {state['plannified_epilogue']}\n" f"Writing Style: {state['writing_style']}", schema = get_json_schema(NarrativeBrainstormingStructuredOutput), n_chapters=n_chapters))
-        adding_delay_for_rate_limits(model)
+        system_prompt = SystemMessage(content = system_prompt.format(user_requirements=format_user_requirements(state['instructor_documents']),idea_draft=format_idea_draft(state), schema = get_json_schema(NarrativeBrainstormingStructuredOutput, lean), n_chapters=n_chapters))
         user_query = HumanMessage(content = f"Develop a story with {n_chapters} chapters.\nEnsure consistency and always keep the attention of the audience.")
         messages = [system_prompt] + [user_query]
-        output = model.invoke(messages)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Succesfully generated the JSON object")
-
-        try:
-            cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-        except ValidationError as e:
-            print("The Brainstorming Narrative Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Brainstorming Narrative Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Brainstorming Narrative Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-
-            cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-
-        print("The Brainstorming Narrative Agent has generated the first narrative of the story.")
+        cleaned_output, _ = yield structured_call(model, messages, NarrativeBrainstormingStructuredOutput, config = config, node = 'brainstorming_narrative_writer')
+
+        log_event("The Brainstorming Narrative Agent has generated the first narrative of the story.")
         messages = messages + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
-    
+
         return {'plannified_chapters_messages': messages,
                 'brainstorming_writer_model': retrieve_model_name(model)
                 }
-    
+
     else:
         if (state['is_detailed_story_plan_approved'] == False)&(config['configurable'].get('critiques_in_loop',False) == True):
-            print("The Brainstorming Narrative Agent will make a new narrative based on the critique.")
-            adding_delay_for_rate_limits(model)
+            log_event("The Brainstorming Narrative Agent will make a new narrative based on the critique.")
             critique_query = HumanMessage(content=f"Based on this critique, adjust your entire idea and return it again with the adjustments: {state['critique_brainstorming_narrative_messages'][-1].content}")
-            
-            output = model.invoke(state['plannified_chapters_messages'] + [critique_query])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['plannified_chapters_messages'] + [critique_query] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['plannified_chapters_messages'] + [critique_query] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Succesfully generated the JSON object")
-            try:
-                cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Narrative Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Narrative Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Narrative Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(state['plannified_chapters_messages'] + [critique_query] + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(state['plannified_chapters_messages'] + [critique_query] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object") 
-                except BadFormattedJson as e:
-                    print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(state['plannified_chapters_messages'] + [critique_query] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Succesfully generated the JSON object")
-                cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-
-
-            print("The Brainstorming Narrative Agent has generated the narrative of the story based on the critique.")
+            cleaned_output, _ = yield structured_call(model, state['plannified_chapters_messages'] + [critique_query], NarrativeBrainstormingStructuredOutput, config = config, node = 'brainstorming_narrative_writer')
+
+            log_event("The Brainstorming Narrative Agent has generated the narrative of the story based on the critique.")
             messages = [critique_query] + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
             return {
                 'plannified_chapters_messages': messages,
-                'brainstorming_writer_model': retrieve_model_name(model)            
+                'brainstorming_writer_model': retrieve_model_name(model)
             }
 
         else:
-            print("The Brainstorming Narrative Agent will generate the final draft after the approval of the reviewer.")
+            log_event("The Brainstorming Narrative Agent will generate the final draft after the approval of the reviewer.")
             model = _get_model(config, default = "openai", key = "brainstormer_idea_model", temperature = 0, top_k = 200, top_p = 0.85)
-            adding_delay_for_rate_limits(model)
-            critique_query = [HumanMessage(content=f"Some improvements to your chapter: {state['critique_brainstorming_narrative_messages'][-1]}")]
-            output = model.invoke(state['plannified_chapters_messages'] + critique_query)
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['plannified_chapters_messages'] + critique_query + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['plannified_chapters_messages'] + critique_query + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            try:
-                cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Narrative Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Narrative Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Narrative Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(state['plannified_chapters_messages'] + critique_query + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Narrative Agent couln't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(state['plannified_chapters_messages'] + critique_query + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                except BadFormattedJson as e:
-                    print("The Brainstorming Narrative Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(state['plannified_chapters_messages'] + critique_query + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                cleaned_output = NarrativeBrainstormingStructuredOutput(**cleaned_output)
-
-            print("The Brainstorming Narrative Agent has generated the final draft of the narrative.")
-            messages = [critique_query] + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
+            critique_query = [HumanMessage(content=f"Some improvements to your chapter: {state['critique_brainstorming_narrative_messages'][-1].content}")]
+            cleaned_output, _ = yield structured_call(model, state['plannified_chapters_messages'] + critique_query, NarrativeBrainstormingStructuredOutput, config = config, node = 'brainstorming_narrative_writer')
+
+            log_event("The Brainstorming Narrative Agent has generated the final draft of the narrative.")
+            messages = critique_query + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
             return {
                 'plannified_chapters_messages': messages,
                 'plannified_chapters_summaries': cleaned_output.chapters_summaries,
-                'brainstorming_writer_model': retrieve_model_name(model)            
+                'story_bible': build_story_bible({**state, 'plannified_chapters_summaries': cleaned_output.chapters_summaries}, config),
+                'brainstorming_writer_model': retrieve_model_name(model)
+            }
+making_narrative_story_brainstorming = node_from_steps(_making_narrative_story_brainstorming)
+
+def _approved_idea_fields(cleaned_output: IdeaBrainstormingStructuredOutput) -> dict:
+    """
+    The update of the state with the approved idea of the book.
+    """
+    return {
+        'plannified_context_setting': cleaned_output.context_setting,
+        'plannified_inciting_incident': cleaned_output.inciting_incident,
+        'plannified_themes_conflicts_intro': cleaned_output.themes_conflicts_intro,
+        'plannified_transition_to_development': cleaned_output.transition_to_development,
+        'plannified_rising_action': cleaned_output.rising_action,
+        'plannified_subplots': cleaned_output.subplots,
+        'plannified_midpoint': cleaned_output.midpoint,
+        'plannified_climax_build_up': cleaned_output.climax_build_up,
+        'plannified_climax': cleaned_output.climax,
+        'plannified_falling_action': cleaned_output.falling_action,
+        'plannified_resolution': cleaned_output.resolution,
+        'plannified_epilogue': cleaned_output.epilogue,
+        'characters': cleaned_output.characters,
+        'writing_style': cleaned_output.writing_style,
+        'story_overview': cleaned_output.story_overview,
+        'book_title': cleaned_output.book_name,
+        'book_prologue': cleaned_output.book_prologue,
+        }
+
+def _best_of_n_brainstorming(state: State, config: GraphConfig, model, messages: list, n_candidates: int):
+    """
+    Best-of-N brainstorming: drafts N candidate ideas concurrently and grades them concurrently with the Brainstorming Idea Critique Agent.
+    The best one advances as the approved idea, without the serial writer -> critique loop. If none is approved, the best one is
+    adjusted with its critique and the refinement loop goes on from there, as after a first critique.
+    """
+    max_workers = config['configurable'].get('brainstorming_max_workers', n_candidates)
+    critique_model = _get_model(config, default = "openai", key = "brainstormer_critique_model", temperature = 0.15)
+    log_event(f"The Brainstorming Idea Agent will generate {n_candidates} candidate drafts in parallel.")
+    candidate_messages = [messages] + [
+        messages[:-1] + [HumanMessage(content = messages[-1].content + f"\nThis is the proposal {n_candidate} of {n_candidates}: explore a different take on the story than the most obvious one.")]
+        for n_candidate in range(2, n_candidates + 1)
+    ]
+    results = yield ConcurrentCalls(calls = [structured_call(model, candidate, IdeaBrainstormingStructuredOutput, config = config, node = 'brainstorming_idea_writer') for candidate in candidate_messages], max_workers = max_workers)
+    drafts = [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````") for cleaned_output, _ in results]
+
+    log_event(f"The Brainstorming Idea Critique Agent will grade the {n_candidates} candidate drafts in parallel.")
+    critique_system_prompt = SystemMessage(content = CRITIQUE_IDEA_PROMPT.format(user_requirements=format_user_requirements(state['instructor_documents']), schema = get_json_schema(ApprovedBrainstormingIdea),))
+    critiques = yield ConcurrentCalls(calls = [structured_call(critique_model, [critique_system_prompt, HumanMessage(content = draft.content)], ApprovedBrainstormingIdea, config = config, node = 'brainstorming_idea_writer', agent = 'brainstorming_idea_critique') for draft in drafts], max_workers = max_workers)
+    grades = [int(critique.grade) for critique, _ in critiques]
+    best = max(range(n_candidates), key = lambda n_candidate: grades[n_candidate])
+    approved = grades[best] > 6
+    report = {
+        'candidates': n_candidates,
+        'grades': grades,
+        'selected_candidate': best + 1,
+        'approved': approved,
+        # Estimate, not a measure: the writer -> critique iterations the serial loop would have run if its drafts were these candidates, in order
+        'estimated_serial_iterations_avoided': next(n_candidate for n_candidate, grade in enumerate(grades) if grade > 6) if approved else n_candidates - 1,
+    }
+
+    if approved:
+        log_event(f"The Brainstorming Idea Critique Agent has approved the candidate {best + 1} (grades: {grades}).")
+        return {**_approved_idea_fields(results[best][0]),
+                'plannified_messages': candidate_messages[best] + [drafts[best]],
+                'is_general_story_plan_approved': True,
+                'critique_brainstorming_messages': [AIMessage(content="Perfect!!")],
+                'brainstorming_report': report,
+                'brainstorming_writer_model': retrieve_model_name(model),
+                'brainstorming_critique_model': retrieve_model_name(critique_model)
+                }
+
+    log_event(f"The Brainstorming Idea Critique Agent has not approved any candidate (grades: {grades}). The Brainstorming Idea Agent will adjust the best one based on its critique.")
+    critique = AIMessage(content=f"```json\n{json.dumps(critiques[best][0].dict())}````")
+    new_msg = [HumanMessage(content=f"Based on this critique, adjust your entire idea and return it again with the adjustments: {critiques[best][0].feedback}")]
+    cleaned_output, _ = yield structured_call(model, candidate_messages[best] + [drafts[best]] + new_msg, IdeaBrainstormingStructuredOutput, config = config, node = 'brainstorming_idea_writer')
+
+    log_event("The Brainstorming Idea Agent generated the adjusted draft.")
+    return {'plannified_messages': candidate_messages[best] + [drafts[best]] + new_msg + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")],
+            'is_general_story_plan_approved': False,
+            'critique_brainstorming_messages': [critique],
+            'brainstorming_report': report,
+            'brainstorming_writer_model': retrieve_model_name(model),
+            'brainstorming_critique_model': retrieve_model_name(critique_model)
             }
 
-def making_general_story_brainstorming(state: State, config: GraphConfig):
+def _making_general_story_brainstorming(state: State, config: GraphConfig):
     model = _get_model(config, default = "openai", key = "brainstormer_idea_model", temperature = 0.7,top_k = 200, top_p = 0.85)
-    user_requirements = "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()])
-    
-    system_prompt = BRAINSTORMING_IDEA_PROMPT
-    
-    system_prompt = SystemMessage(content = system_prompt.format(user_requirements=user_requirements, schema = get_json_schema(IdeaBrainstormingStructuredOutput)))
+
     if state.get('is_general_story_plan_approved', None) is None:
-        print("Executing the Brainstorming Idea Agent with the document the Instructor Agent has developed.")
-        adding_delay_for_rate_limits(model)
+        log_event("Executing the Brainstorming Idea Agent with the document the Instructor Agent has developed.")
+        lean = is_lean_node(config, 'brainstormer_idea_model')
+        system_prompt = lean_prompt(BRAINSTORMING_IDEA_PROMPT) if lean else BRAINSTORMING_IDEA_PROMPT
+        system_prompt = SystemMessage(content = system_prompt.format(user_requirements=format_user_requirements(state['instructor_documents']), schema = get_json_schema(IdeaBrainstormingStructuredOutput, lean)))
         messages = [
             system_prompt,
             HumanMessage(content = "Start it, respect all the rules previously mentioned...")
         ]
-        output = model.invoke(messages)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Brainstorming Idea Agent couln't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        except BadFormattedJson as e:
-            print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        try:
-            cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-        except ValidationError as e:
-            print("The Brainstorming Idea Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Brainstorming Idea Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Brainstorming Idea Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-                print("Solved the issue with the JSON object.")
-            except NoJson:
-                print("The Brainstorming Idea Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-
-            cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-
-        print("The Brainstorming Idea Agent generated the first draft.")
+        n_candidates = config['configurable'].get('brainstorming_candidates', 1)
+        if (n_candidates > 1)&(not is_budget_degraded(config)):
+            return (yield from _best_of_n_brainstorming(state, config, model, messages, n_candidates))
+        cleaned_output, _ = yield structured_call(model, messages, IdeaBrainstormingStructuredOutput, config = config, node = 'brainstorming_idea_writer')
+
+        log_event("The Brainstorming Idea Agent generated the first draft.")
 
         messages = messages + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
 
         return {'plannified_messages': messages,
                 'brainstorming_writer_model': retrieve_model_name(model)
                 }
-    
+
     else:
         if state['is_general_story_plan_approved'] == False:
-            print("The Brainstorming Idea Agent will adjust the draft based on the critique.")
-            adding_delay_for_rate_limits(model)
+            log_event("The Brainstorming Idea Agent will adjust the draft based on the critique.")
             new_msg = [HumanMessage(content=f"Based on this critique, adjust your entire idea and return it again with the adjustments: {cleaning_llm_output(state['critique_brainstorming_messages'][-1]).get('feedback')}")]
-            output = model.invoke(state['plannified_messages'] + new_msg)
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Idea Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['plannified_messages'] + new_msg + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['plannified_messages'] + new_msg + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            try:
-                cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Idea Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Idea Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Idea Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(state['plannified_messages'] + new_msg + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Idea Agent couldn't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(state['plannified_messages'] + new_msg + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                except BadFormattedJson as e:
-                    print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(state['plannified_messages'] + [new_msg] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                
-                cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-
-            print("The Brainstorming Idea Agent generated the adjusted draft.")
+            cleaned_output, _ = yield structured_call(model, state['plannified_messages'] + new_msg, IdeaBrainstormingStructuredOutput, config = config, node = 'brainstorming_idea_writer')
+
+            log_event("The Brainstorming Idea Agent generated the adjusted draft.")
             messages = new_msg + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
             return {
                 'plannified_messages': messages,
-                'brainstorming_writer_model': retrieve_model_name(model)            
+                'brainstorming_writer_model': retrieve_model_name(model)
             }
 
         else:
-            print("The Brainstorming Idea Agent will generate the final draft after the approval of the reviewer.")
+            log_event("The Brainstorming Idea Agent will generate the final draft after the approval of the reviewer.")
             model = _get_model(config, default = "openai", key = "brainstormer_idea_model", temperature = 0, top_k = 200, top_p = 0.85)
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(state['plannified_messages'] +[HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Brainstorming Idea Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['plannified_messages'] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['plannified_messages'] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            try:    
-                cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-            except ValidationError as e:
-                print("The Brainstorming Idea Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Brainstorming Idea Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Brainstorming Idea Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(state['plannified_messages'] +[HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Brainstorming Idea Agent couldn't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(state['plannified_messages'] +[HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                except BadFormattedJson as e:
-                    print("The Brainstorming Idea Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(state['plannified_messages'] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-
-
-
-                cleaned_output = IdeaBrainstormingStructuredOutput(**cleaned_output)
-
-            print("The Brainstorming Idea Agent generated the final draft.")
-
-            return {
-            'plannified_context_setting': cleaned_output.context_setting,
-            'plannified_inciting_incident': cleaned_output.inciting_incident,
-            'plannified_themes_conflicts_intro': cleaned_output.themes_conflicts_intro,
-            'plannified_transition_to_development': cleaned_output.transition_to_development,
-            'plannified_rising_action': cleaned_output.rising_action,
-            'plannified_subplots': cleaned_output.subplots,
-            'plannified_midpoint': cleaned_output.midpoint,
-            'plannified_climax_build_up': cleaned_output.climax_build_up,
-            'plannified_climax': cleaned_output.climax,
-            'plannified_falling_action': cleaned_output.falling_action,
-            'plannified_resolution': cleaned_output.resolution,
-            'plannified_epilogue': cleaned_output.epilogue,
-            'characters': cleaned_output.characters,
-            'writing_style': cleaned_output.writing_style,
-            'story_overview': cleaned_output.story_overview,
-            'book_title': cleaned_output.book_name,
-            'book_prologue': cleaned_output.book_prologue,
-            'brainstorming_writer_model': retrieve_model_name(model)
-            }
-
-def evaluate_chapter(state: State, config: GraphConfig):
+            final_query = HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")
+            cleaned_output, _ = yield structured_call(model, state['plannified_messages'] + [final_query], IdeaBrainstormingStructuredOutput, config = config, node = 'brainstorming_idea_writer')
+
+            log_event("The Brainstorming Idea Agent generated the final draft.")
+
+            return {**_approved_idea_fields(cleaned_output), 'brainstorming_writer_model': retrieve_model_name(model)}
+making_general_story_brainstorming = node_from_steps(_making_general_story_brainstorming)
+
+def _reviewer_early_stop(fields: dict):
+    """
+    While streaming, the approval of the Writing Reviewer Agent is known as soon as `is_approved` is written, there is no need to wait for the rest.
+    """
+    if 'is_approved' in fields:
+        return ApprovedWriterChapter(is_approved = fields['is_approved'])
+    return None
+
+def _writer_early_stop(min_paragraphs: int, min_sentences: int):
+    """
+    While streaming, once the chapter content and name are complete and the content doesn't have enough paragraphs (or sentences in them), the Writer Agent is stopped: it will be asked to adjust it anyway.
+    It waits for the name (written after the content) because a revision with targeted edits keeps the name of the chapter it revises.
+    """
+    def early_stop(fields: dict):
+        if isinstance(fields.get('content'), str) and isinstance(fields.get('chapter_name'), str) and validate_chapter(fields['content'], min_paragraphs, min_sentences).is_valid == False:
+            return WriterStructuredOutput.model_construct(**fields)
+        return None
+    return early_stop
+
+def _revision_call(model, messages: list, content: str, instructions: str, n_chapter: int, config: GraphConfig):
+    """
+    Call that asks the Writer for the edits of the paragraphs of a chapter that need them, instead of a new version of the whole chapter.
+    """
+    human_msg = chapter_message(WRITER_REVISION_PROMPT.format(instructions = instructions, chapter = number_paragraphs(content), schema = get_json_schema(WriterRevisionStructuredOutput)), n_chapter)
+    return structured_call(model, messages + [human_msg], WriterRevisionStructuredOutput, config = config, node = 'writer', chapter = n_chapter)
+
+def _apply_revision(content: str, revision: WriterRevisionStructuredOutput):
+    """
+    Applies the edits of a revision to the chapter. None if none of them could be applied.
+    """
+    revised, rejected = apply_edits(content, revision.edits)
+    if rejected:
+        log_event(f"{len(rejected)} of the {len(revision.edits)} edits of the Writer Agent couldn't be applied: they are malformed or point to a paragraph that doesn't exist.")
+    if len(rejected) == len(revision.edits):
+        return None
+    log_event(f"The Writer Agent revised the chapter with {len(revision.edits) - len(rejected)} edits.")
+    return revised
+
+def _revise_chapter(model, messages: list, chapter_name: str, content: str, instructions: str, rewrite_message: HumanMessage, n_chapter: int, config: GraphConfig):
+    """
+    Steps that revise a chapter with targeted edits, or write it again with `rewrite_message` if none of the edits can be applied.
+    Returns the name and content of the revised chapter, and the messages for the memory of the Writer: `rewrite_message` and the whole
+    revised chapter, as if it had been written again, so the next calls of the Writer keep answering with whole chapters.
+    """
+    revision, _ = yield _revision_call(model, messages, content, instructions, n_chapter, config)
+    revised = _apply_revision(content, revision)
+    if revised is None:
+        log_event("The Writer Agent will write the whole chapter again.")
+        cleaned_output, _ = yield structured_call(model, messages + [rewrite_message], WriterStructuredOutput, config = config, node = 'writer', chapter = n_chapter)
+        return cleaned_output.chapter_name, cleaned_output.content, [rewrite_message, AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
+    return chapter_name, revised, [rewrite_message, AIMessage(content=f"```json\n{json.dumps({'content': revised, 'chapter_name': chapter_name})}````")]
+
+def _evaluate_chapter(state: State, config: GraphConfig):
     model = _get_model(config = config, default = "openai", key = "writing_reviewer_model", temperature = 0)
-    
-    draft = ( f"Story overview: {state['story_overview']}\n" f"Context and Setting: {state['plannified_context_setting']}\n" f"Inciting Incident: {state['plannified_inciting_incident']}\n" f"Themes and Conflicts Introduction: {state['plannified_themes_conflicts_intro']}\n" f"Transition to Development: {state['plannified_transition_to_development']}\n" f"Rising Action: {state['plannified_rising_action']}\n" f"Subplots: {state['plannified_subplots']}\n" f"Midpoint: {state['plannified_midpoint']}\n" f"Climax Build-Up: {state['plannified_climax_build_up']}\n" f"Climax: {state['plannified_climax']}\n" f"Falling Action: {state['plannified_falling_action']}\n" f"Resolution: {state['plannified_resolution']}\n" f"Epilogue: {state['plannified_epilogue']}\n" f"Writing Style: {state['writing_style']}\n" f"Summary of each chapter: {state['plannified_chapters_summaries'][-1]}" )
+
     critiques_in_loop = config['configurable'].get('critiques_in_loop', False)
+    diff_reviews = config['configurable'].get('diff_reviews', False)
+    diff_review_max_change_ratio = config['configurable'].get('diff_review_max_change_ratio', 0.5)
 
-    if state.get('is_chapter_approved', None) == None:
-        print("The Writing Reviewer Agent will evaluate the first chapter.")
-        system_prompt = WRITING_REVIEWER_PROMPT
-
-        new_message = [SystemMessage(content = system_prompt.format(draft=draft, approved_schema = get_json_schema(ApprovedWriterChapter), critique_schema = get_json_schema(CritiqueWriterChapter)))] + [HumanMessage(content=f"Start with the first chapter: {state['content'][-1]}.")]
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(new_message)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output= output)
-        except NoJson:
-            print("The Writing Reviewer Agent couldn't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        except BadFormattedJson as e:
-            print("The Writing Reviewer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(new_messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-
-        is_chapter_approved = True if "is_approved" in list(cleaned_output) else False
+    if is_budget_degraded(config):
+        log_event("The Writing Reviewer Agent won't evaluate the chapter, the budget of the book is exceeded.")
+        new_message = [chapter_message(f"\n{state['content'][-1]}", state['current_chapter'])]
+        is_chapter_approved = True
+
+    elif state.get('is_chapter_approved', None) == None:
+        log_event("The Writing Reviewer Agent will evaluate the first chapter.")
+        new_message = [SystemMessage(content = get_story_bible(state, config).reviewer_system_prompt)] + [chapter_message(f"Start with the first chapter: {state['content'][-1]}.", state['current_chapter'])]
+        cleaned_output, _ = yield structured_call(model, new_message, (ApprovedWriterChapter, CritiqueWriterChapter), config = config, node = 'writing_reviewer', early_stop = _reviewer_early_stop, chapter = state['current_chapter'])
+
+        is_chapter_approved = isinstance(cleaned_output, ApprovedWriterChapter)
         if is_chapter_approved:
-            cleaned_output = ApprovedWriterChapter(**cleaned_output)
-            print("The Writing Reviewer Agent has approved the first chapter.")            
+            log_event("The Writing Reviewer Agent has approved the first chapter.")
 
         else:
-            cleaned_output = CritiqueWriterChapter(**cleaned_output)        
-            print("The Writing Reviewer Agent has critiqued the first chapter.")
+            log_event("The Writing Reviewer Agent has critiqued the first chapter.")
     else:
         if (critiques_in_loop == False)&(state['is_chapter_approved'] == False):
-            print("The Writing Reviewer Agent won't evaluate the chapter again based on the critique.")
+            log_event("The Writing Reviewer Agent won't evaluate the chapter again based on the critique.")
             new_message = [HumanMessage(content = f"\n{state['content'][-1]}")]
             feedback = 'Perfect!'
             is_chapter_approved = True
-            print("The Writing Reviewer Agent has approved the chapter based on the critique.")
+            log_event("The Writing Reviewer Agent has approved the chapter based on the critique.")
 
         else:
-            print("The Writing Reviewer Agent will evaluate the chapter again based on the critique.")
-            new_message = [HumanMessage(content = f"Well done, now focus on the next chapter. But, first, read again the entire chat history so you have the context of the previous chapters.\nAfter reviewing the chat history, focus on the new chapter:\n<NEW_CHAPTER>\n```{state['content'][-1]}```.\n</NEW_CHAPTER>\n\nDon't forget to return your answer using the <FORMAT_OUTPUT> instruction.")]
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(state['writing_reviewer_memory'] + new_message)  
-            try:
-                cleaned_output = cleaning_llm_output(llm_output= output)
-            except NoJson:
-                print("The Writing Reviewer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['writing_reviewer_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writing Reviewer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['writing_reviewer_memory'] + new_message + [output] +  [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-
-            is_chapter_approved = True if "is_approved" in list(cleaned_output.keys()) else False
+            log_event("The Writing Reviewer Agent will evaluate the chapter again based on the critique.")
+            # A revision of the critiqued chapter (the previous version is content[-2]) is reviewed from its changed paragraphs only
+            diff_review = diff_reviews and state['is_chapter_approved'] == False and len(state['content']) > 1
+            if diff_review:
+                changes, change_ratio = diff_paragraphs(state['content'][-2], state['content'][-1])
+                diff_review = change_ratio <= diff_review_max_change_ratio
+                if diff_review == False:
+                    log_event(f"The revision changed {change_ratio:.0%} of the chapter, so the Writing Reviewer Agent will read it whole.")
+            if diff_review:
+                log_event(f"The Writing Reviewer Agent will only read the {len(changes)} paragraphs changed by the revision ({change_ratio:.0%} of the chapter).")
+                feedback = cleaning_llm_output(state['writing_reviewer_memory'][-1])['feedback']
+                new_message = [chapter_message(f"The writer revised the chapter based on your feedback:\n<PREVIOUS_FEEDBACK>\n{feedback}\n</PREVIOUS_FEEDBACK>\nTo keep our conversation short, only the paragraphs that changed since the version you critiqued are shown here, numbered as in the revised chapter. The rest of the chapter is exactly as you read it.\n<CHANGED_PARAGRAPHS>\n{format_paragraph_changes(changes)}\n</CHANGED_PARAGRAPHS>\n\nEvaluate the revised chapter as a whole. Don't forget to return your answer using the <FORMAT_OUTPUT> instruction.", state['current_chapter'])]
+            else:
+                new_message = [chapter_message(f"Well done, now focus on the next chapter. But, first, read again the entire chat history so you have the context of the previous chapters.\nAfter reviewing the chat history, focus on the new chapter:\n<NEW_CHAPTER>\n```{state['content'][-1]}```.\n</NEW_CHAPTER>\n\nDon't forget to return your answer using the <FORMAT_OUTPUT> instruction.", state['current_chapter'])]
+            cleaned_output, _ = yield structured_call(model, bounded_memory(state['writing_reviewer_memory'], state, config) + new_message, (ApprovedWriterChapter, CritiqueWriterChapter), config = config, node = 'writing_reviewer', early_stop = _reviewer_early_stop, chapter = state['current_chapter'])
+
+            is_chapter_approved = isinstance(cleaned_output, ApprovedWriterChapter)
             if is_chapter_approved:
-                cleaned_output = ApprovedWriterChapter(**cleaned_output)
-                print("The Writing Reviewer Agent has approved the chapter based on the critique.")
+                log_event("The Writing Reviewer Agent has approved the chapter based on the critique.")
 
             else:
-                cleaned_output = CritiqueWriterChapter(**cleaned_output)        
-                print("The Writing Reviewer Agent has critiqued the chapter based on the critique.")
+                log_event("The Writing Reviewer Agent has critiqued the chapter based on the critique.")
 
     if is_chapter_approved:
         new_messages = new_message + [AIMessage(content = 'Perfect')]
@@ -777,188 +432,51 @@ def evaluate_chapter(state: State, config: GraphConfig):
                 'reviewer_model': retrieve_model_name(model)
         }
     else:
-        
-        feedback = cleaned_output.feedback
-        is_chapter_approved = False
         new_messages = new_message + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
-        if is_chapter_approved == True:
-            return {
-                'is_chapter_approved': is_chapter_approved,
-                'content_of_approved_chapters': [state['content'][-1]],
-                'chapter_names_of_approved_chapters': [state['chapter_names'][-1]],
+        return {'is_chapter_approved': False,
                 'writing_reviewer_memory': new_messages,
                 'reviewer_model': retrieve_model_name(model)}
-        else:
-            return {'is_chapter_approved': is_chapter_approved,
-                    'writing_reviewer_memory': new_messages,
-                    'reviewer_model': retrieve_model_name(model)}
+evaluate_chapter = node_from_steps(_evaluate_chapter)
 
-def generate_content(state: State, config: GraphConfig):
-    model = _get_model(config = config, default = "openai", key = "writer_model", temperature = 0.70, top_k = 250, top_p = 0.90)
+def _generate_content(state: State, config: GraphConfig):
+    model = _get_model(config = config, default = "openai", key = "writer_model", temperature = 0.70, top_k = 250, top_p = 0.90, max_tokens = chapter_max_tokens(config))
 
     min_paragraph_in_chapter = config['configurable'].get('min_paragraph_per_chapter', 10)
     min_sentences_in_each_paragraph_per_chapter = config['configurable'].get('min_sentences_in_each_paragraph_per_chapter', 5)
-    min_sentences_in_each_paragraph_in_chapter = config['configurable'].get('min_sentences_in_each_paragraph_per_chapter', 10)
+    patch_revisions = config['configurable'].get('patch_revisions', False)
     if state.get('current_chapter', None) == None:
-        print("The Writer Agent will generate the content of the first chapter.")
-        system_prompt = WRITER_PROMPT
+        log_event("The Writer Agent will generate the content of the first chapter.")
         messages = [
-            SystemMessage(content=system_prompt.format(
-                user_requirements="\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()]),
-                story_overview=state['story_overview'],
-                characters=state['characters'],
-                writing_style=state['writing_style'],
-                context_setting=state['plannified_context_setting'],
-                inciting_incident=state['plannified_inciting_incident'],
-                themes_conflicts_intro=state['plannified_themes_conflicts_intro'],
-                transition_to_development=state['plannified_transition_to_development'],
-                rising_action=state['plannified_rising_action'],
-                subplots=state['plannified_subplots'],
-                midpoint=state['plannified_midpoint'],
-                climax_build_up=state['plannified_climax_build_up'],
-                climax=state['plannified_climax'],
-                falling_action=state['plannified_falling_action'],
-                resolution=state['plannified_resolution'],
-                epilogue=state['plannified_epilogue'],
-                schema = get_json_schema(WriterStructuredOutput),
-                min_paragraph_in_chapter = min_paragraph_in_chapter,
-                min_sentences_in_each_paragraph_in_chapter = min_sentences_in_each_paragraph_in_chapter
-            ))
+            SystemMessage(content=get_story_bible(state, config).writer_system_prompt)
         ]
-        adding_delay_for_rate_limits(model)
-        human_msg = HumanMessage(content=f"Start with the first chapter. I will provide to you a summary of what should happen on it:\n<SUMMARY_OF_CHAPTER>`{state['plannified_chapters_summaries'][0]}.`</SUMMARY_OF_CHAPTER>\nDon't forget to respect the minimum number of paragraphs {min_paragraph_in_chapter} (separating each of them with two line breaks ('\n\n')) and also, the minimum number of sentences in each paragraph {min_sentences_in_each_paragraph_per_chapter}.")
-
-        output = model.invoke(messages + [human_msg])
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        except BadFormattedJson as e:
-            print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [human_msg] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-
-        try:
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-        except TypeError as e:
-            print("The Writer Agent generated incorrectly the data type of the output object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content=f"You generated a python {type(cleaned_output)} object. Please, return the JSON output in the correct format.")])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [human_msg] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-
-        except ValidationError as e:
-            print("The Writer Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Writer Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Writer Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format. Follow correctly the JSON output schema that you have received in your instructions inside the <FORMAT_OUTPUT> tag."
-            output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [human_msg] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-
-        print("The Writer Agent generated the first draft of the chapter.")
-
-        print("A rule based system will check if the generated chapter respects the paragraph and sentence requirements.")
-        if check_chapter(msg_content = cleaned_output.content, min_paragraphs = min_paragraph_in_chapter) == False:
-            print("The Writer Agent generated a chapter with an incorrect number of paragraphs. It will try again.")
-            adding_delay_for_rate_limits(model)
-            messages.append(human_msg)
-            messages.append(AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````"))
-            human_msg = HumanMessage(content=f"The chapter should contains at least {min_paragraph_in_chapter} paragraphs and also, each one of the paragraphs must have at least {min_sentences_in_each_paragraph_per_chapter} sentences. Adjust it again: When expanding the text in this chapter by adding more paragraphs / sentences, ensure that every addition meaningfully progresses the story or deepens the characters without resorting to redundant or repetitive content.\nAlso, ensure that each paragraph in the response is separated by two line breaks ('\n\n')")
-            output = model.invoke(messages + [human_msg])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [human_msg] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            try:
-                cleaned_output = WriterStructuredOutput(**cleaned_output)
-            except ValidationError as e:
-                print("The Writer Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Writer Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Writer Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(messages + [human_msg] + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-                except BadFormattedJson as e:
-                    print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(messages + [human_msg] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-
-                cleaned_output = WriterStructuredOutput(**cleaned_output)
-            print("The Writer Agent generated the first draft of the chapter with the adjustments for the number of paragraphs and sentences.")
- 
-        else:
-            print("The Writer Agent generated a chapter with the correct number of paragraphs.")
+        human_msg = chapter_message(f"Start with the first chapter. I will provide to you a summary of what should happen on it:\n<SUMMARY_OF_CHAPTER>`{state['plannified_chapters_summaries'][0]}.`</SUMMARY_OF_CHAPTER>\nDon't forget to respect the minimum number of paragraphs {min_paragraph_in_chapter} (separating each of them with two line breaks ('\n\n')) and also, the minimum number of sentences in each paragraph {min_sentences_in_each_paragraph_per_chapter}.", 1)
+        cleaned_output, _ = yield structured_call(model, messages + [human_msg], WriterStructuredOutput, config = config, node = 'writer', early_stop = _writer_early_stop(min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter), chapter = 1)
 
+        log_event("The Writer Agent generated the first draft of the chapter.")
+        chapter_name, content = cleaned_output.chapter_name, cleaned_output.content
         messages.append(human_msg)
         messages.append(AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````"))
 
+        log_event("A rule based system will check if the generated chapter respects the paragraph and sentence requirements.")
+        report = validate_chapter(content, min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter)
+        if report.is_valid == False:
+            log_event(f"The Writer Agent generated a chapter below the requirements ({report.n_paragraphs} paragraphs, {len(report.short_paragraphs)} of them too short). It will try again.")
+            correction_msg = chapter_message(f"{report.describe_deficits()}\nAdjust it again: When expanding the text in this chapter by adding more paragraphs / sentences, ensure that every addition meaningfully progresses the story or deepens the characters without resorting to redundant or repetitive content.\nAlso, ensure that each paragraph in the response is separated by two line breaks ('\n\n')", 1)
+            if patch_revisions:
+                chapter_name, content, revision_messages = yield from _revise_chapter(model, messages, chapter_name, content, report.describe_deficits(), correction_msg, 1, config)
+            else:
+                cleaned_output, _ = yield structured_call(model, messages + [correction_msg], WriterStructuredOutput, config = config, node = 'writer', chapter = 1)
+                chapter_name, content = cleaned_output.chapter_name, cleaned_output.content
+                revision_messages = [correction_msg, AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
+            messages += revision_messages
+            log_event("The Writer Agent generated the first draft of the chapter with the adjustments for the number of paragraphs and sentences.")
+
+        else:
+            log_event("The Writer Agent generated a chapter that respects the paragraph and sentence requirements.")
+
 
-        return {'content': [cleaned_output.content],
-                'chapter_names': [cleaned_output.chapter_name],
+        return {'content': [content],
+                'chapter_names': [chapter_name],
                 'current_chapter': 1,
                 'writer_memory': messages,
                 'writer_model': retrieve_model_name(model)
@@ -966,286 +484,275 @@ def generate_content(state: State, config: GraphConfig):
 
     else:
         if state['is_chapter_approved'] == False:
-            print("The Writer Agent will adjust the chapter based on the critique.")
-            new_message = [HumanMessage(content = 'I will provide to you some feedback. Focus on each of these points, and improve the chapter.\n' + cleaning_llm_output(state['writing_reviewer_memory'][-1])['feedback'] + '\n\n When returning your response, dont forget any key in your JSON output:')]
+            log_event("The Writer Agent will adjust the chapter based on the critique.")
+            feedback = 'I will provide to you some feedback. Focus on each of these points, and improve the chapter.\n' + cleaning_llm_output(state['writing_reviewer_memory'][-1])['feedback']
+            new_message = [chapter_message(feedback + '\n\n When returning your response, dont forget any key in your JSON output:', state['current_chapter'])]
         else:
-            print(f"The Writer Agent will generate the content of the next chapter [Chapter number: {state['current_chapter'] + 1}].")
-            new_message = [HumanMessage(content = f"Continue with the chapter {state['current_chapter'] + 1}, which is about:\n<SUMMARY_OF_CHAPTER>\n`{state['plannified_chapters_summaries'][state['current_chapter']]}.\n</SUMMARY_OF_CHAPTER>`\nBefore start, remember to read again the previous developed chapters before so you make the perfect continuation possible. Dont forget any key in your JSON output. Also don´t forget the chapter should contains at least {min_paragraph_in_chapter} paragraphs (separating each of them with two line breaks ('\n\n')) and also, each one of the paragraphs must have at least {min_sentences_in_each_paragraph_per_chapter} sentences.")]
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(state['writer_memory'] + new_message)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-
-        except NoJson:
-            print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        except BadFormattedJson as e:
-            print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object.")
-        try:
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-        except TypeError as e:
-            print("The Writer Agent generated incorrectly the data type of the output object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content=f"You generated a python {type(cleaned_output)} object. Please, return the JSON output in the correct format.")])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-
-        except ValidationError as e:
-            print("The Writer Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Writer Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Writer Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['writer_memory'] + new_message + [output] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-
-            cleaned_output = WriterStructuredOutput(**cleaned_output)
-        
-        print("The Writer Agent generated the draft of the chapter.")
-
-        new_messages = new_message + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
-    
-        print("A rule based system will check if the generated chapter respects the paragraph and sentence requirements.")
-        if check_chapter(msg_content = output.content, min_paragraphs = min_paragraph_in_chapter) == False:
-            print("The Writer Agent generated a chapter with an incorrect number of paragraphs. It will try again.")
-            adding_delay_for_rate_limits(model)
-            output = model.invoke(new_messages + [HumanMessage(content=f"The chapter should contains at least {min_paragraph_in_chapter} paragraphs, and also, each one of the paragraphs must have at least {min_sentences_in_each_paragraph_per_chapter} sentences. Adjust it again!  Dont forget any key in your JSON output.\nAlso, ensure that each paragraph in the response is separated by two line breaks ('\n\n')")])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)   
-                print("Successfully generated the JSON object.")         
-            except BadFormattedJson as e:
-                print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(new_message + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object.")
-
-            try:
-                cleaned_output = WriterStructuredOutput(**cleaned_output)
-            except TypeError as e:
-                print("The Writer Agent generated incorrectly the data type of the output object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                output = model.invoke(new_message + [output] + [HumanMessage(content=f"You generated a python {type(cleaned_output)} object. Please, return the JSON output in the correct format.")])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)   
-                    print("Successfully generated the JSON object.")          
-                except BadFormattedJson as e:
-                    print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(new_message + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-
-                cleaned_output = WriterStructuredOutput(**cleaned_output)
-                print("The Writer Agent generated the draft of the chapter with the adjustments for the number of paragraphs and sentences.")
-
-            except ValidationError as e:
-                print("The Writer Agent generated incorrectly the content inside the JSON object. It will try again.")
-                adding_delay_for_rate_limits(model)
-                correction_instruction = ''
-                errors = e.errors()
-
-                for error in errors:
-                    field_name = error['loc'][-1]
-                    error_type = error['type']
-                    error_msg = error['msg']
-                    if error_type == 'missing':
-                        correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                        print(f"The Writer Agent forgot to include the key {field_name}")
-                    elif error_type == 'string_type':
-                        correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                        print(f"The Writer Agent populated the key {field_name} in an incorrect data type")
-                correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-                output = model.invoke(new_messages + [HumanMessage(content=f"The chapter should contains at least {min_paragraph_in_chapter} paragraphs, and also, each one of the paragraphs must have at least {min_sentences_in_each_paragraph_per_chapter} sentences. Adjust it again!  Dont forget any key in your JSON output.\Also, ensure that each paragraph in the response is separated by two line breaks ('\n\n')")] + [output] + [HumanMessage(content=correction_instruction)])
-                try:
-                    cleaned_output = cleaning_llm_output(llm_output = output)
-                except NoJson:
-                    print("The Writer Agent couldn't generate a completed formatted JSON. It will try again.")
-                    output = model.invoke(new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)  
-                    print("Successfully generated the JSON object.")          
-                except BadFormattedJson as e:
-                    print("The Writer Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                    output = model.invoke(new_message + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                    cleaned_output = cleaning_llm_output(llm_output= output)
-                    print("Successfully generated the JSON object.")
-
-
-                cleaned_output = WriterStructuredOutput(**cleaned_output)
-
-                print("The Writer Agent generated the draft of the chapter with the adjustments for the number of paragraphs and sentences.")
+            log_event(f"The Writer Agent will generate the content of the next chapter [Chapter number: {state['current_chapter'] + 1}].")
+            new_message = [chapter_message(f"Continue with the chapter {state['current_chapter'] + 1}, which is about:\n<SUMMARY_OF_CHAPTER>\n`{state['plannified_chapters_summaries'][state['current_chapter']]}.\n</SUMMARY_OF_CHAPTER>`\nBefore start, remember to read again the previous developed chapters before so you make the perfect continuation possible. Dont forget any key in your JSON output. Also don´t forget the chapter should contains at least {min_paragraph_in_chapter} paragraphs (separating each of them with two line breaks ('\n\n')) and also, each one of the paragraphs must have at least {min_sentences_in_each_paragraph_per_chapter} sentences.", state['current_chapter'] + 1)]
+        n_chapter = state['current_chapter'] + 1 if state['is_chapter_approved'] == True else state['current_chapter']
+        if patch_revisions and state['is_chapter_approved'] == False:
+            log_event("The Writer Agent will revise the chapter with targeted edits of its paragraphs.")
+            chapter_name, content, new_messages = yield from _revise_chapter(model, bounded_memory(state['writer_memory'], state, config), state['chapter_names'][-1], state['content'][-1], feedback, new_message[0], n_chapter, config)
+        else:
+            cleaned_output, _ = yield structured_call(model, bounded_memory(state['writer_memory'], state, config) + new_message, WriterStructuredOutput, config = config, node = 'writer', early_stop = _writer_early_stop(min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter), chapter = n_chapter)
+            log_event("The Writer Agent generated the draft of the chapter.")
+            chapter_name, content = cleaned_output.chapter_name, cleaned_output.content
+            new_messages = new_message + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
+
+        log_event("A rule based system will check if the generated chapter respects the paragraph and sentence requirements.")
+        report = validate_chapter(content, min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter)
+        if report.is_valid == False:
+            log_event(f"The Writer Agent generated a chapter below the requirements ({report.n_paragraphs} paragraphs, {len(report.short_paragraphs)} of them too short). It will try again.")
+            correction_query = HumanMessage(content=f"{report.describe_deficits()}\nAdjust it again!  Dont forget any key in your JSON output.\nAlso, ensure that each paragraph in the response is separated by two line breaks ('\n\n')")
+            if patch_revisions:
+                chapter_name, content, _ = yield from _revise_chapter(model, bounded_memory(state['writer_memory'], state, config) + new_messages, chapter_name, content, report.describe_deficits(), correction_query, n_chapter, config)
+            else:
+                cleaned_output, _ = yield structured_call(model, bounded_memory(state['writer_memory'], state, config) + new_messages + [correction_query], WriterStructuredOutput, config = config, node = 'writer', chapter = n_chapter)
+                chapter_name, content = cleaned_output.chapter_name, cleaned_output.content
+            log_event("The Writer Agent generated the draft of the chapter with the adjustments for the number of paragraphs and sentences.")
 
         else:
-            print("The Writer Agent generated a chapter with the correct number of paragraphs.")
+            log_event("The Writer Agent generated a chapter that respects the paragraph and sentence requirements.")
         return {
-                'content': [cleaned_output.content],
-                'chapter_names': [cleaned_output.chapter_name],
+                'content': [content],
+                'chapter_names': [chapter_name],
                 'current_chapter': state['current_chapter'] + 1 if state['is_chapter_approved'] == True else state['current_chapter'],
                 'writer_memory': new_messages,
                 'writer_model': retrieve_model_name(model)
                 }
+generate_content = node_from_steps(_generate_content)
+
+def _draft_single_chapter(model, system_prompt: SystemMessage, summaries: list, n_chapter: int, min_paragraph_in_chapter: int, min_sentences_in_each_paragraph_per_chapter: int, config: GraphConfig):
+    """
+    Call that drafts one chapter from its summary (and the summaries around it), so it can run concurrently with the other chapters of the book.
+    """
+    context = ""
+    if n_chapter > 1:
+        context += f"The previous chapter is about:\n<SUMMARY_OF_PREVIOUS_CHAPTER>`{summaries[n_chapter - 2]}.`</SUMMARY_OF_PREVIOUS_CHAPTER>\n"
+    if n_chapter < len(summaries):
+        context += f"The next chapter is about:\n<SUMMARY_OF_NEXT_CHAPTER>`{summaries[n_chapter]}.`</SUMMARY_OF_NEXT_CHAPTER>\n"
+    human_msg = chapter_message(f"Write the chapter {n_chapter} of {len(summaries)}. I will provide to you a summary of what should happen on it:\n<SUMMARY_OF_CHAPTER>`{summaries[n_chapter - 1]}.`</SUMMARY_OF_CHAPTER>\n{context}Don't forget to respect the minimum number of paragraphs {min_paragraph_in_chapter} (separating each of them with two line breaks ('\n\n')) and also, the minimum number of sentences in each paragraph {min_sentences_in_each_paragraph_per_chapter}.", n_chapter)
+    return structured_call(model, [system_prompt, human_msg], WriterStructuredOutput, config = config, node = 'writer', early_stop = _writer_early_stop(min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter), chapter = n_chapter)
+
+def _generate_parallel_drafts(state: State, config: GraphConfig):
+    """
+    Parallel drafting: drafts every chapter concurrently from the story bible and its summary. The drafts without enough paragraphs (or sentences) are adjusted in a second concurrent round.
+    """
+    model = _get_model(config = config, default = "openai", key = "writer_model", temperature = 0.70, top_k = 250, top_p = 0.90, max_tokens = chapter_max_tokens(config))
+    max_workers = config['configurable'].get('drafting_max_workers', 8)
+    min_paragraph_in_chapter = config['configurable'].get('min_paragraph_per_chapter', 10)
+    min_sentences_in_each_paragraph_per_chapter = config['configurable'].get('min_sentences_in_each_paragraph_per_chapter', 5)
+    system_prompt = SystemMessage(content=get_story_bible(state, config).writer_system_prompt)
+    summaries = state['plannified_chapters_summaries']
+    log_event(f"The Writer Agent will draft {len(summaries)} chapters in parallel, with {max_workers} workers.")
+
+    calls = [_draft_single_chapter(model, system_prompt, summaries, n_chapter, min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter, config) for n_chapter in range(1, len(summaries) + 1)]
+    results = yield ConcurrentCalls(calls = calls, max_workers = max_workers)
+    drafts = [cleaned_output for cleaned_output, _ in results]
+
+    log_event("A rule based system will check if the drafted chapters respect the paragraph and sentence requirements.")
+    reports = {n_chapter: validate_chapter(draft.content, min_paragraph_in_chapter, min_sentences_in_each_paragraph_per_chapter) for n_chapter, draft in enumerate(drafts, start = 1)}
+    short_chapters = [n_chapter for n_chapter, report in reports.items() if report.is_valid == False]
+    if short_chapters:
+        log_event(f"The Writer Agent drafted {len(short_chapters)} chapters below the paragraph and sentence requirements. It will adjust them.")
+    if short_chapters and config['configurable'].get('patch_revisions', False):
+        revision_calls = [
+            _revision_call(model, calls[n_chapter - 1].messages + [AIMessage(content=f"```json\n{json.dumps(drafts[n_chapter - 1].dict())}````")], drafts[n_chapter - 1].content, reports[n_chapter].describe_deficits(), n_chapter, config)
+            for n_chapter in short_chapters
+        ]
+        revisions = yield ConcurrentCalls(calls = revision_calls, max_workers = max_workers)
+        revised_chapters = {n_chapter: _apply_revision(drafts[n_chapter - 1].content, revision) for n_chapter, (revision, _) in zip(short_chapters, revisions)}
+        for n_chapter, revised in revised_chapters.items():
+            if revised is not None:
+                drafts[n_chapter - 1] = drafts[n_chapter - 1].model_copy(update = {'content': revised})
+        # The drafts whose edits can't be applied are written again
+        short_chapters = [n_chapter for n_chapter, revised in revised_chapters.items() if revised is None]
+    if short_chapters:
+        correction_calls = [
+            structured_call(model, calls[n_chapter - 1].messages + [
+                AIMessage(content=f"```json\n{json.dumps(drafts[n_chapter - 1].dict())}````"),
+                chapter_message(f"{reports[n_chapter].describe_deficits()}\nAdjust it again: When expanding the text in this chapter by adding more paragraphs / sentences, ensure that every addition meaningfully progresses the story or deepens the characters without resorting to redundant or repetitive content.\nAlso, ensure that each paragraph in the response is separated by two line breaks ('\n\n')", n_chapter)
+            ], WriterStructuredOutput, config = config, node = 'writer', chapter = n_chapter)
+            for n_chapter in short_chapters
+        ]
+        corrections = yield ConcurrentCalls(calls = correction_calls, max_workers = max_workers)
+        for n_chapter, (cleaned_output, _) in zip(short_chapters, corrections):
+            drafts[n_chapter - 1] = cleaned_output
+
+    log_event("The Writer Agent drafted every chapter.")
+    return {'content': [draft.content for draft in drafts],
+            'chapter_names': [draft.chapter_name for draft in drafts],
+            'writer_model': retrieve_model_name(model)
+            }
+generate_parallel_drafts = node_from_steps(_generate_parallel_drafts)
+
+def _apply_continuity_fixes(content: str, fixes: ContinuityEditorStructuredOutput) -> str:
+    """
+    Applies the fixes of the continuity pass: the corrections ('old => new') found in the chapter, and the new first paragraph.
+    """
+    for correction in fixes.corrections:
+        old, separator, new = correction.partition('=>')
+        old, new = old.strip().strip('\'"'), new.strip().strip('\'"')
+        if separator and old and old in content:
+            content = content.replace(old, new)
+    if fixes.first_paragraph.strip():
+        paragraphs = content.split('\n\n')
+        content = '\n\n'.join([fixes.first_paragraph.strip()] + paragraphs[1:])
+    return content
+
+def _reconcile_single_chapter(model, system_prompt: SystemMessage, chapters: list, chapter_names: list, n_chapter: int, config: GraphConfig):
+    """
+    Call that reconciles one chapter with the end of the previous one (its last two paragraphs).
+    """
+    previous_ending = '\n\n'.join(chapters[n_chapter - 2].split('\n\n')[-2:])
+    human_msg = chapter_message(f"<END_OF_PREVIOUS_CHAPTER>\n{previous_ending}\n</END_OF_PREVIOUS_CHAPTER>\n\n<CHAPTER_TO_RECONCILE>\nChapter {n_chapter}: {chapter_names[n_chapter - 1]}\n{chapters[n_chapter - 1]}\n</CHAPTER_TO_RECONCILE>", n_chapter)
+    return structured_call(model, [system_prompt, human_msg], ContinuityEditorStructuredOutput, config = config, node = 'continuity_editor', chapter = n_chapter)
+
+def _reconcile_chapters(state: State, config: GraphConfig):
+    """
+    Continuity pass of the parallel drafting: reconciles the names, facts and transition of each chapter with the previous one, all the chapters at once.
+    Each call only returns the fixes, not the whole chapter, so it is much cheaper than a draft.
+    """
+    model = _get_model(config = config, default = "openai", key = "writing_reviewer_model", temperature = 0)
+    max_workers = config['configurable'].get('drafting_max_workers', 8)
+    n_chapters = len(state['plannified_chapters_summaries'])
+    chapters, chapter_names = list(state['content'][-n_chapters:]), state['chapter_names'][-n_chapters:]
+
+    if is_budget_degraded(config):
+        log_event("The Continuity Editor Agent won't reconcile the chapters, the budget of the book is exceeded.")
+    else:
+        log_event(f"The Continuity Editor Agent will reconcile {n_chapters - 1} chapters with their previous one, in parallel.")
+        bible = get_story_bible(state, config)
+        system_prompt = SystemMessage(content=CONTINUITY_EDITOR_PROMPT.format(draft=bible.draft, characters=state['characters'], schema=get_json_schema(ContinuityEditorStructuredOutput)))
+        calls = [_reconcile_single_chapter(model, system_prompt, chapters, chapter_names, n_chapter, config) for n_chapter in range(2, n_chapters + 1)]
+        results = yield ConcurrentCalls(calls = calls, max_workers = max_workers)
+        for n_chapter, (fixes, _) in zip(range(2, n_chapters + 1), results):
+            chapters[n_chapter - 1] = _apply_continuity_fixes(chapters[n_chapter - 1], fixes)
+        log_event("The Continuity Editor Agent reconciled the chapters.")
+
+    return {'content_of_approved_chapters': chapters,
+            'chapter_names_of_approved_chapters': chapter_names,
+            'current_chapter': n_chapters,
+            'is_chapter_approved': True,
+            'reviewer_model': retrieve_model_name(model)
+            }
+reconcile_chapters = node_from_steps(_reconcile_chapters)
+
+def _translate_single_chapter(model, system_prompt: SystemMessage, n_chapter: int, chapter_name: str, chapter_content: str, config: GraphConfig):
+    """
+    Call that translates one approved chapter on its own, so it can run concurrently with the other chapters of the book.
+    """
+    messages = [
+        system_prompt,
+        HumanMessage(content=f"Translate the chapter number {n_chapter}: title:\n {chapter_name}\n\n Content of the Chapter:\n{chapter_content}.")
+    ]
+    return structured_call(model, messages, TranslatorStructuredOutput, config = config, node = 'translator', chapter = n_chapter)
+
+def _translate_book_title_and_prologue(model, system_prompt: SystemMessage, book_title: str, book_prologue: str, config: GraphConfig):
+    """
+    Call that translates the book title and the book prologue, independently of the chapters.
+    """
+    messages = [
+        system_prompt,
+        HumanMessage(content=f"Translate the book title and the book prologue:\n title: {book_title}\n prologue: {book_prologue}.\nBut use the following schema definition for your output: {get_json_schema(TranslatorSpecialCaseStructuredOutput)}")
+    ]
+    return structured_call(model, messages, TranslatorSpecialCaseStructuredOutput, config = config, node = 'translator')
+
+def _generate_parallel_translation(state: State, config: GraphConfig):
+    """
+    Translates every approved chapter (plus the book title and prologue) concurrently, with a bounded pool of workers.
+    The translations are reassembled in the same order of the approved chapters.
+    """
+    model = _get_model(config = config, default = "openai", key = "translator_model", temperature = 0, max_tokens = chapter_max_tokens(config))
+    max_workers = config['configurable'].get('translation_max_workers', 4)
+    system_prompt = SystemMessage(content=get_story_bible(state, config).translator_system_prompt)
+    approved_chapters = list(zip(state['chapter_names_of_approved_chapters'], state['content_of_approved_chapters']))
+    log_event(f"The Translator Agent will translate {len(approved_chapters)} chapters in parallel, with {max_workers} workers.")
+
+    calls = [_translate_book_title_and_prologue(model, system_prompt, state['book_title'], state['book_prologue'], config)] + [
+        _translate_single_chapter(model, system_prompt, n_chapter + 1, chapter_name, chapter_content, config)
+        for n_chapter, (chapter_name, chapter_content) in enumerate(approved_chapters)
+    ]
+    results = yield ConcurrentCalls(calls = calls, max_workers = max_workers)
+    special_case_output = results[0][0]
+    translated_chapters = [cleaned_output for cleaned_output, _ in results[1:]]
+
+    log_event("The Translator Agent translated the entire book.")
+    return {'translated_content': [chapter.translated_content for chapter in translated_chapters],
+            'translated_chapter_names': [chapter.translated_chapter_name for chapter in translated_chapters],
+            'translated_book_name': special_case_output.translated_book_name,
+            'translated_book_prologue': special_case_output.translated_book_prologue,
+            'translated_current_chapter': len(translated_chapters),
+            'translator_model': retrieve_model_name(model)
+            }
+generate_parallel_translation = node_from_steps(_generate_parallel_translation)
+
+def _generate_title_translation(state: State, config: GraphConfig):
+    """
+    Pipelined translation: translates the book title and the book prologue right after the brainstorming, while the first chapter is written.
+    """
+    model = _get_model(config = config, default = "openai", key = "translator_model", temperature = 0, max_tokens = chapter_max_tokens(config))
+    system_prompt = SystemMessage(content=get_story_bible(state, config).translator_system_prompt)
+    log_event("The Translator Agent will translate the book title and the book prologue while the first chapter is written.")
+    special_case_output, _ = yield _translate_book_title_and_prologue(model, system_prompt, state['book_title'], state['book_prologue'], config)
+
+    log_event("The Translator Agent translated the book title and the book prologue")
+    return {'translated_book_name': special_case_output.translated_book_name,
+            'translated_book_prologue': special_case_output.translated_book_prologue,
+            'translator_model': retrieve_model_name(model)
+            }
+generate_title_translation = node_from_steps(_generate_title_translation)
+
+def _generate_pipelined_translation(state: State, config: GraphConfig):
+    """
+    Pipelined translation: translates the chapters approved since the last translation (usually just the last one), while the Writer works on the next chapter.
+    """
+    model = _get_model(config = config, default = "openai", key = "translator_model", temperature = 0, max_tokens = chapter_max_tokens(config))
+    max_workers = config['configurable'].get('translation_max_workers', 4)
+    system_prompt = SystemMessage(content=get_story_bible(state, config).translator_system_prompt)
+    n_translated = state.get('translated_current_chapter') or 0
+    pending_chapters = list(zip(state['chapter_names_of_approved_chapters'], state['content_of_approved_chapters']))[n_translated:]
+    log_event(f"The Translator Agent will translate the approved chapter [Chapter number: {n_translated + len(pending_chapters)}] while the Writer Agent continues.")
+
+    calls = [
+        _translate_single_chapter(model, system_prompt, n_translated + n_chapter + 1, chapter_name, chapter_content, config)
+        for n_chapter, (chapter_name, chapter_content) in enumerate(pending_chapters)
+    ]
+    results = yield ConcurrentCalls(calls = calls, max_workers = max_workers)
+    translated_chapters = [cleaned_output for cleaned_output, _ in results]
+
+    log_event("The Translator Agent translated the approved chapter.")
+    return {'translated_content': [chapter.translated_content for chapter in translated_chapters],
+            'translated_chapter_names': [chapter.translated_chapter_name for chapter in translated_chapters],
+            'translated_current_chapter': n_translated + len(translated_chapters),
+            'translator_model': retrieve_model_name(model)
+            }
+generate_pipelined_translation = node_from_steps(_generate_pipelined_translation)
+
+def _generate_translation(state: State, config: GraphConfig):
+    if config['configurable'].get('parallel_translation', False):
+        return (yield from _generate_parallel_translation(state, config))
+
+    model = _get_model(config = config, default = "openai", key = "translator_model", temperature = 0, max_tokens = chapter_max_tokens(config))
 
-def generate_translation(state: State, config: GraphConfig):
-    model = _get_model(config = config, default = "openai", key = "translator_model", temperature = 0)
-    
     if state.get("translated_current_chapter", None) == None:
-        print("The Translator Agent will translate the first chapter.")
-        system_prompt = TRANSLATOR_PROMPT
+        log_event("The Translator Agent will translate the first chapter.")
         messages = [
-            SystemMessage(content=system_prompt.format(
-                target_language=config['configurable'].get("language"),
-                book_name=state['book_title'],
-                story_topic=state['instructor_documents'].topic,
-                schema = get_json_schema(TranslatorStructuredOutput)
-                )
-            ),
+            SystemMessage(content=get_story_bible(state, config).translator_system_prompt),
             HumanMessage(content=f"Start with the first chapter: title:\n {state['chapter_names_of_approved_chapters'][0]}\n\n Content of the Chapter:\n{state['content_of_approved_chapters'][0]}.")
         ]
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(messages)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object")
-
-        try:
-            cleaned_output = TranslatorStructuredOutput(**cleaned_output)
-        except ValidationError as e:
-            print("The Translator Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Translator Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Translator Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(messages + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(messages + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object")
-
-            cleaned_output = TranslatorStructuredOutput(**cleaned_output)
-
-        print("The Translator Agent translated the first chapter.")
+        cleaned_output, _ = yield structured_call(model, messages, TranslatorStructuredOutput, config = config, node = 'translator', chapter = 1)
+
+        log_event("The Translator Agent translated the first chapter.")
 
         messages.append(AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````"))
-        print("The Translator Agent will translate the book title and the book prologue.")
-
-        special_case_output = model.invoke(messages + [HumanMessage(content=f"Also, translate the book title and the book prologue:\n title: {state['book_title']}\n prologue: {state['book_prologue']}.\nBut use the following schema definition for your output: {get_json_schema(TranslatorSpecialCaseStructuredOutput)}")])
-        try:
-            cleaned_special_case_output = cleaning_llm_output(llm_output = special_case_output)
-        except NoJson:
-            print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-            special_case_output = model.invoke(messages + [special_case_output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_special_case_output = cleaning_llm_output(llm_output= special_case_output)
-            print("Successfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            special_case_output = model.invoke(messages + [special_case_output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_special_case_output = cleaning_llm_output(llm_output= special_case_output)
-            print("Successfully generated the JSON object")
-        try:
-            cleaned_special_case_output = TranslatorSpecialCaseStructuredOutput(**cleaned_special_case_output)
-        except ValidationError as e:
-            print("The Translator Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Translator Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Translator Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            special_case_output = model.invoke(messages + [special_case_output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_special_case_output = cleaning_llm_output(llm_output = special_case_output)
-            except NoJson:
-                print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-                special_case_output = model.invoke(messages + [special_case_output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_special_case_output = cleaning_llm_output(llm_output= special_case_output)    
-                print("Successfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                special_case_output = model.invoke(messages + [special_case_output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_special_case_output = cleaning_llm_output(llm_output= special_case_output)        
-                print("Successfully generated the JSON object")
-            
-            cleaned_special_case_output = TranslatorSpecialCaseStructuredOutput(**cleaned_special_case_output)
-        
-        print("The Translator Agent translated the book title and the book prologue")
+        log_event("The Translator Agent will translate the book title and the book prologue.")
+
+        special_case_query = HumanMessage(content=f"Also, translate the book title and the book prologue:\n title: {state['book_title']}\n prologue: {state['book_prologue']}.\nBut use the following schema definition for your output: {get_json_schema(TranslatorSpecialCaseStructuredOutput)}")
+        cleaned_special_case_output, _ = yield structured_call(model, messages + [special_case_query], TranslatorSpecialCaseStructuredOutput, config = config, node = 'translator')
+
+        log_event("The Translator Agent translated the book title and the book prologue")
 
         book_name = cleaned_special_case_output.translated_book_name
         book_prologue = cleaned_special_case_output.translated_book_prologue
@@ -1259,57 +766,11 @@ def generate_translation(state: State, config: GraphConfig):
                 'translator_model': retrieve_model_name(model)
                 }
     else:
-        print(f"The Translator Agent will translate the next chapter [Chapter number: {state['translated_current_chapter']}].")
+        log_event(f"The Translator Agent will translate the next chapter [Chapter number: {state['translated_current_chapter']}].")
         new_message = [HumanMessage(content = f"Continue with chapter number {state['translated_current_chapter']}: title: {state['chapter_names_of_approved_chapters'][state['translated_current_chapter']]}\n {state['content_of_approved_chapters'][state['translated_current_chapter']]}.")]
+        cleaned_output, _ = yield structured_call(model, state['translator_memory'] + new_message, TranslatorStructuredOutput, config = config, node = 'translator', chapter = state['translated_current_chapter'] + 1)
 
-        adding_delay_for_rate_limits(model)
-        output = model.invoke(state['translator_memory'] + new_message)
-        try:
-            cleaned_output = cleaning_llm_output(llm_output = output)
-        except NoJson:
-            print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-            output = model.invoke(state['translator_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object")
-        except BadFormattedJson as e:
-            print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-            output = model.invoke(state['translator_memory'] + new_message  + [output] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-            cleaned_output = cleaning_llm_output(llm_output= output)
-            print("Successfully generated the JSON object")
-        try:
-            cleaned_output = TranslatorStructuredOutput(**cleaned_output)
-        except ValidationError as e:
-            print("The Translator Agent generated incorrectly the content inside the JSON object. It will try again.")
-            adding_delay_for_rate_limits(model)
-            correction_instruction = ''
-            errors = e.errors()
-            for error in errors:
-                field_name = error['loc'][-1]
-                error_type = error['type']
-                error_msg = error['msg']
-                if error_type == 'missing':
-                    correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
-                    print(f"The Translator Agent forgot to include the key {field_name}")
-                elif error_type == 'string_type':
-                    correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {error_msg}\n\n"
-                    print(f"The Translator Agent populated the key {field_name} in an incorrect data type")
-            correction_instruction += "Check what I have mentioned, thinking step by step, in order to return the correct and expected output format."
-            output = model.invoke(state['translator_memory'] + new_message + [output] + [HumanMessage(content=correction_instruction)])
-            try:
-                cleaned_output = cleaning_llm_output(llm_output = output)
-            except NoJson:
-                print("The Translator Agent couldn't generate a completed formatted JSON. It will try again.")
-                output = model.invoke(state['translator_memory'] + new_message + [output] + [HumanMessage(content="The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object")
-            except BadFormattedJson as e:
-                print("The Translator Agent couldn't generate a corrected syntaxis for the JSON output. It will try again.")
-                output = model.invoke(state['translator_memory'] + new_message + [output] + [HumanMessage(content="Based on the improvements, return your final work following the instructions mentioned in <FORMAT_OUTPUT>. Ensure to respect the format and syntaxis explicitly explained.")] + [output] + [HumanMessage(content = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}")])
-                cleaned_output = cleaning_llm_output(llm_output= output)
-                print("Successfully generated the JSON object")
-            cleaned_output = TranslatorStructuredOutput(**cleaned_output)
-
-        print("The Translator Agent translated the chapter.")
+        log_event("The Translator Agent translated the chapter.")
         new_messages = new_message + [AIMessage(content=f"```json\n{json.dumps(cleaned_output.dict())}````")]
 
         return {
@@ -1319,26 +780,36 @@ def generate_translation(state: State, config: GraphConfig):
             'translator_memory': new_messages,
             'translator_model': retrieve_model_name(model)
         }
+generate_translation = node_from_steps(_generate_translation)
+
 
+def assembling_book(state: State, config: RunnableConfig):
+    with node_span('assembling_book', config):
+        return _assemble_book(state, config)
 
-def assembling_book(state: State, config: GraphConfig):
-    print("The Assembler Agent will assemble the book.")
+def _assemble_book(state: State, config: RunnableConfig):
+    log_event("The Assembler Agent will assemble the book.")
 
     translation_language = config['configurable'].get("language", "english")
-    english_content = "Book title:\n" + state['book_title'] + '\n\n' + "Book prologue:\n" + state['book_prologue'] + '\n\n' + 'Used models:'+'\n' + "\n".join(f"- {key}: {state[key]}" for key in ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"] if key in state) + '\n\n'  + "Initial requirement:\n" + "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()]) + '\n\n' + '-----------------------------------------' + '\n\n'
+    models = {key: state[key] for key in ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"] if key in state}
+    run_report = build_run_report(get_invocation_records(config['configurable'].get('thread_id')), config = config, models = models)
+    if state.get('brainstorming_report') is not None:
+        run_report['brainstorming'] = state['brainstorming_report']
+    english_content = "Book title:\n" + state['book_title'] + '\n\n' + "Book prologue:\n" + state['book_prologue'] + '\n\n' + 'Used models:'+'\n' + "\n".join(f"- {key}: {state[key]}" for key in ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"] if key in state) + '\n\n' + 'Usage:' + '\n' + format_run_report(run_report) + '\n\n'  + "Initial requirement:\n" + "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items()]) + '\n\n' + '-----------------------------------------' + '\n\n'
     for n_chapter, chapter in enumerate(state['content_of_approved_chapters']):
         english_content += str(n_chapter + 1) + f') {state["chapter_names_of_approved_chapters"][n_chapter]}' + '\n\n' + chapter + '\n\n'
 
     if translation_language == 'english':
         translated_content = ''
     else:
-        translated_content = "Book title:\n" + state['translated_book_name']  + '\n\n' + "Book prologue:\n" + state['translated_book_prologue'] + '\n\n' + 'Used models:'+'\n' + "\n".join(f"- {key}: {state[key]}" for key in ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"] if key in state) + '\n\n' + "Initial requirement:\n" + "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items() if key not in ['reasoning_step','reflection_step']]) + '\n\n'  + '-----------------------------------------' + '\n\n'
+        translated_content = "Book title:\n" + state['translated_book_name']  + '\n\n' + "Book prologue:\n" + state['translated_book_prologue'] + '\n\n' + 'Used models:'+'\n' + "\n".join(f"- {key}: {state[key]}" for key in ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"] if key in state) + '\n\n' + 'Usage:' + '\n' + format_run_report(run_report) + '\n\n' + "Initial requirement:\n" + "\n".join([f"{key}: {value}" for key, value in state['instructor_documents'].dict().items() if key not in ['reasoning_step','reflection_step']]) + '\n\n'  + '-----------------------------------------' + '\n\n'
         for n_chapter, chapter in enumerate(state['translated_content']):
             translated_content += str(n_chapter + 1) + f') {state["translated_chapter_names"][n_chapter]}' + '\n\n' + chapter + '\n\n'
 
-    print("The Assembler Agent assembled the book")
+    log_event("The Assembler Agent assembled the book")
     return {
         "english_version_book": english_content,
-        "translated_version_book": translated_content
+        "translated_version_book": translated_content,
+        "run_report": run_report
     }
 
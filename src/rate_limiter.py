@@ -0,0 +1,266 @@
+import os
+import time
+import json
+import asyncio
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+from langchain_core.rate_limiters import BaseRateLimiter
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+from src.tracing import add_span_event
+
+# Budgets per provider, keyed as in `_get_model`. The free plans of Google and Groq are the tight ones.
+# They can be overridden with the RATE_LIMIT_<PROVIDER>_RPM and RATE_LIMIT_<PROVIDER>_TPM environment variables.
+DEFAULT_RATE_LIMITS = {
+    'openai': {'requests_per_minute': 500, 'tokens_per_minute': 200000},
+    'google': {'requests_per_minute': 10, 'tokens_per_minute': 4000000},
+    'meta': {'requests_per_minute': 30, 'tokens_per_minute': 12000},
+    'deepseek': {'requests_per_minute': 30, 'tokens_per_minute': 12000},
+    'amazon': {'requests_per_minute': 50, 'tokens_per_minute': 400000},
+}
+
+def get_rate_limits(provider: str) -> Dict[str, Optional[int]]:
+    """
+    Returns the requests-per-minute and tokens-per-minute budgets of a provider, applying the environment overrides.
+    A budget of 0 (or a provider without defaults) means that dimension is not limited.
+    """
+    limits = dict(DEFAULT_RATE_LIMITS.get(provider, {'requests_per_minute': None, 'tokens_per_minute': None}))
+    for key, env_suffix in [('requests_per_minute', 'RPM'), ('tokens_per_minute', 'TPM')]:
+        value = os.getenv(f"RATE_LIMIT_{provider.upper()}_{env_suffix}")
+        if value is not None:
+            limits[key] = int(value)
+        if not limits[key]:
+            limits[key] = None
+    return limits
+
+def _refill(level: float, capacity: Optional[int], elapsed: float) -> float:
+    if capacity is None:
+        return 0.0
+    return min(float(capacity), level + elapsed * capacity / 60)
+
+def _take(bucket: Dict[str, float], limits: Dict[str, Optional[int]], now: float) -> float:
+    """
+    Refills the bucket and tries to take one request from it.
+    Returns 0 when the request is granted, otherwise the seconds to wait before trying again.
+
+    The token budget works in debt mode: the real usage is only known after the response, so it is debited afterwards
+    and new requests are blocked while the token level is below zero.
+    """
+    rpm, tpm = limits['requests_per_minute'], limits['tokens_per_minute']
+    elapsed = max(0.0, now - bucket['updated_at'])
+    bucket['request_level'] = _refill(bucket['request_level'], rpm, elapsed)
+    bucket['token_level'] = _refill(bucket['token_level'], tpm, elapsed)
+    bucket['updated_at'] = now
+
+    wait = 0.0
+    if rpm is not None and bucket['request_level'] < 1:
+        wait = max(wait, (1 - bucket['request_level']) * 60 / rpm)
+    if tpm is not None and bucket['token_level'] < 0:
+        wait = max(wait, -bucket['token_level'] * 60 / tpm)
+    if wait == 0:
+        if rpm is not None:
+            bucket['request_level'] -= 1
+        bucket['requests'] += 1
+    return wait
+
+def _new_bucket(limits: Dict[str, Optional[int]], now: float) -> Dict[str, float]:
+    return {
+        'request_level': float(limits['requests_per_minute'] or 0),
+        'token_level': float(limits['tokens_per_minute'] or 0),
+        'updated_at': now,
+        'requests': 0,
+        'tokens': 0,
+        'waits': 0,
+        'wait_seconds': 0.0,
+    }
+
+class InMemoryBucketBackend:
+    """
+    Keeps the buckets in the memory of the current process. It is shared by every thread of the process.
+    """
+    # Its operations never wait on I/O, so they can run directly in the event loop
+    blocks_on_io = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Dict[str, float]] = {}
+
+    def _bucket(self, provider: str, limits: Dict[str, Optional[int]], now: float) -> Dict[str, float]:
+        if provider not in self._buckets:
+            self._buckets[provider] = _new_bucket(limits, now)
+        return self._buckets[provider]
+
+    def take(self, provider: str, limits: Dict[str, Optional[int]]) -> float:
+        with self._lock:
+            now = time.time()
+            return _take(self._bucket(provider, limits, now), limits, now)
+
+    def debit_tokens(self, provider: str, limits: Dict[str, Optional[int]], tokens: int):
+        with self._lock:
+            bucket = self._bucket(provider, limits, time.time())
+            bucket['tokens'] += tokens
+            if limits['tokens_per_minute'] is not None:
+                bucket['token_level'] -= tokens
+
+    def record_wait(self, provider: str, seconds: float):
+        with self._lock:
+            bucket = self._buckets[provider]
+            bucket['waits'] += 1
+            bucket['wait_seconds'] += seconds
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {provider: {key: bucket[key] for key in ['requests', 'tokens', 'waits', 'wait_seconds']} for provider, bucket in self._buckets.items()}
+
+class SqliteBucketBackend:
+    """
+    Keeps the buckets in a SQLite file, so every worker process running books at the same time shares the same budgets.
+    Each operation runs inside an immediate transaction, which serializes the updates between processes.
+    """
+    # Its operations can wait for the lock of the file, so the async rate limiter runs them in a thread
+    blocks_on_io = True
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS rate_limit_buckets (provider TEXT PRIMARY KEY, bucket TEXT NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout = 30)
+
+    def _update(self, provider: str, limits: Dict[str, Optional[int]], operation) -> Any:
+        connection = self._connect()
+        try:
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = connection.execute("SELECT bucket FROM rate_limit_buckets WHERE provider = ?", (provider,)).fetchone()
+            bucket = json.loads(row[0]) if row is not None else _new_bucket(limits, now)
+            result = operation(bucket, now)
+            connection.execute("INSERT OR REPLACE INTO rate_limit_buckets (provider, bucket) VALUES (?, ?)", (provider, json.dumps(bucket)))
+            connection.execute("COMMIT")
+            return result
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def take(self, provider: str, limits: Dict[str, Optional[int]]) -> float:
+        return self._update(provider, limits, lambda bucket, now: _take(bucket, limits, now))
+
+    def debit_tokens(self, provider: str, limits: Dict[str, Optional[int]], tokens: int):
+        def operation(bucket, now):
+            bucket['tokens'] += tokens
+            if limits['tokens_per_minute'] is not None:
+                bucket['token_level'] -= tokens
+        self._update(provider, limits, operation)
+
+    def record_wait(self, provider: str, seconds: float):
+        def operation(bucket, now):
+            bucket['waits'] += 1
+            bucket['wait_seconds'] += seconds
+        self._update(provider, get_rate_limits(provider), operation)
+
+    def report(self) -> Dict[str, Dict[str, float]]:
+        with self._connect() as connection:
+            rows = connection.execute("SELECT provider, bucket FROM rate_limit_buckets").fetchall()
+        return {provider: {key: json.loads(bucket)[key] for key in ['requests', 'tokens', 'waits', 'wait_seconds']} for provider, bucket in rows}
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """
+    Rate limiter attached to the chat models, so every call (first attempts and retries) is accounted.
+    It only blocks when the requests-per-minute or the tokens-per-minute budget of the provider is exhausted.
+    """
+    def __init__(self, provider: str, backend, check_every_n_seconds: float = 0.5):
+        self.provider = provider
+        self.backend = backend
+        self.limits = get_rate_limits(provider)
+        self.check_every_n_seconds = check_every_n_seconds
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        start = time.time()
+        while True:
+            wait = self.backend.take(self.provider, self.limits)
+            if wait == 0:
+                break
+            if not blocking:
+                return False
+            time.sleep(min(wait, self.check_every_n_seconds))
+        self._record_wait(time.time() - start)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        """
+        Same as `acquire`, but waiting with `asyncio.sleep`, so the other books of the event loop keep running meanwhile.
+        """
+        start = time.time()
+        while True:
+            if self.backend.blocks_on_io:
+                wait = await asyncio.to_thread(self.backend.take, self.provider, self.limits)
+            else:
+                wait = self.backend.take(self.provider, self.limits)
+            if wait == 0:
+                break
+            if not blocking:
+                return False
+            await asyncio.sleep(min(wait, self.check_every_n_seconds))
+        self._record_wait(time.time() - start)
+        return True
+
+    def _record_wait(self, seconds: float):
+        if seconds >= 0.01:
+            # Attached to the span of the LLM call it delayed, so the waits of the concurrent books aren't mixed up in the output
+            add_span_event('rate_limit_wait', provider = self.provider, seconds = round(seconds, 3))
+            self.backend.record_wait(self.provider, seconds)
+
+    def debit_tokens(self, tokens: int):
+        self.backend.debit_tokens(self.provider, self.limits, tokens)
+
+class RateLimitUsageCallback(BaseCallbackHandler):
+    """
+    Debits the tokens used by each response from the token budget of its provider.
+    """
+    def __init__(self, rate_limiter: TokenBucketRateLimiter):
+        self.rate_limiter = rate_limiter
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any):
+        tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                if (generation.generation_info or {}).get('from_cache'):
+                    continue
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                tokens += usage.get('total_tokens') or (usage.get('input_tokens', 0) + usage.get('output_tokens', 0))
+        if tokens == 0 and response.llm_output:
+            tokens = (response.llm_output.get('token_usage') or response.llm_output.get('usage') or {}).get('total_tokens', 0)
+        if tokens:
+            self.rate_limiter.debit_tokens(tokens)
+
+_backend = None
+_rate_limiters: Dict[str, TokenBucketRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(provider: str) -> TokenBucketRateLimiter:
+    """
+    Returns the process-wide rate limiter of a provider.
+    If the RATE_LIMIT_DB_PATH environment variable is set, the budgets are shared with other processes through that SQLite file.
+    """
+    global _backend
+    with _rate_limiters_lock:
+        if _backend is None:
+            db_path = os.getenv("RATE_LIMIT_DB_PATH")
+            _backend = SqliteBucketBackend(db_path) if db_path else InMemoryBucketBackend()
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = TokenBucketRateLimiter(provider = provider, backend = _backend)
+        return _rate_limiters[provider]
+
+def get_rate_limit_report() -> Dict[str, Dict[str, float]]:
+    """
+    Returns, per provider, the number of requests and tokens accounted, how many requests had to wait and for how long in total.
+    """
+    if _backend is None:
+        return {}
+    return _backend.report()
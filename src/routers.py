@@ -8,7 +8,9 @@ os.chdir(WORKDIR)
 sys.path.append(WORKDIR)
 
 from langgraph.graph import END
-from src.utils import State, GraphConfig
+from langchain_core.runnables import RunnableConfig
+from src.utils import State
+from src.tracing import log_event
 from typing import Literal
 
 def should_go_to_brainstorming_idea_writer(state: State) -> Literal['human_feedback','brainstorming_idea_writer']:
@@ -25,29 +27,53 @@ def should_continue_with_idea_critique(state: State) -> Literal['brainstorming_i
     else:
         return "brainstorming_idea_critique"
 
-def should_continue_with_narrative_critique(state: State) -> Literal['brainstorming_narrative_critique','writer']:
+def _is_translation_needed(config: RunnableConfig) -> bool:
+    return (config['configurable'].get('language') != 'english')&(config['configurable'].get('language') is not None)
+
+def _is_translation_pipelined(config: RunnableConfig) -> bool:
+    return _is_translation_needed(config)&(config['configurable'].get('pipelined_translation', False) == True)
+
+def should_continue_with_narrative_critique(state: State, config: RunnableConfig) -> Literal['brainstorming_narrative_critique','writer','parallel_writer','title_translator']:
     if state.get('is_detailed_story_plan_approved', None) is None: 
         return "brainstorming_narrative_critique"
-    elif state['is_general_story_plan_approved'] == True:
-        return "writer"
+    elif (state['is_detailed_story_plan_approved'] == True)|(config['configurable'].get('critiques_in_loop', False) == False):
+        # Only the final draft of the narrative (after the approval, or after the single critique) goes to the Writer
+        writer = "parallel_writer" if config['configurable'].get('parallel_drafting', False) == True else "writer"
+        if _is_translation_pipelined(config):
+            # The title and the prologue are translated while the first chapter is written
+            return [writer, "title_translator"]
+        return writer
     else:
         return "brainstorming_narrative_critique"
 
 
-def has_writer_ended_book(state: State, config: GraphConfig) -> Literal["translator", "assembler", 'writer']:
+def has_writer_ended_book(state: State, config: RunnableConfig) -> Literal["translator", "chapter_translator", "assembler", 'writer']:
 
     if (state['current_chapter'] == len(state['plannified_chapters_summaries']))&(state['is_chapter_approved'] == True):
-        if (config['configurable'].get('language') == 'english')|(config['configurable'].get('language') is None):
-            print("The translator agent is not needed in this case")
+        if not _is_translation_needed(config):
+            log_event("The translator agent is not needed in this case")
             return "assembler"
+        elif _is_translation_pipelined(config):
+            return "chapter_translator"
         else:
             return "translator"
+    elif _is_translation_pipelined(config)&(state['is_chapter_approved'] == True):
+        # The approved chapter is translated while the next one is written and reviewed
+        return ["writer", "chapter_translator"]
     else:
         return "writer"
 
-def has_translator_ended_book(state: State, config: GraphConfig) -> Literal["assembler", 'translator']:
+def has_translator_ended_book(state: State, config: RunnableConfig) -> Literal["assembler", 'translator']:
 
     if (state['translated_current_chapter'] == len(state['plannified_chapters_summaries'])):
         return "assembler"
     else:
         return "translator"
+
+
+def has_pipelined_translator_ended_book(state: State) -> Literal["assembler", "__end__"]:
+    if (state['translated_current_chapter'] == len(state['plannified_chapters_summaries'])):
+        return "assembler"
+    else:
+        # The Writer keeps going in its own branch, this one ends until the next approved chapter
+        return END
\ No newline at end of file
@@ -0,0 +1,121 @@
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import re
+import asyncio
+import copy
+from typing import Any, Callable, Dict, List, Optional
+from unidecode import unidecode
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from src.agent import workflow
+from src.structured_output import describe_progress_event, clear_invocation_records
+from src.accounting import format_run_report, write_run_report
+
+MODEL_KEYS = ["instructor_model", "brainstorming_writer_model", "brainstorming_critique_model", "writer_model", "reviewer_model", "translator_model"]
+
+def compile_app(checkpointer = None):
+    """
+    Compiles the graph with a checkpointer, which is needed to run several books (each one with its own `thread_id`) on the same app.
+    By default in memory, use `src.checkpointer.get_checkpointer()` to keep the books on disk.
+    """
+    return workflow.compile(
+        interrupt_before=['human_feedback'],
+        checkpointer=checkpointer if checkpointer is not None else MemorySaver()
+    )
+
+def _print_progress(thread_id: str, event: dict):
+    print(f"[{thread_id}] {describe_progress_event(event)}")
+
+async def arun_book(app, idea: str, config: dict, on_progress: Optional[Callable[[str, dict], None]] = _print_progress) -> Dict[str, Any]:
+    """
+    Runs a whole book with `astream`, so its LLM calls are awaited and the event loop can run other books meanwhile.
+
+    The book can't stop to ask the human: the idea must be complete enough for the Instructor Agent. If the Instructor Agent
+    asks a question anyway, the book is returned with the status 'needs_feedback' and its question, and it can be resumed with
+    the answer (as the `human_feedback` node) on the same `thread_id`.
+
+    If the app has a durable checkpointer and the thread was already started (eg: the process crashed in the middle of the book),
+    it is resumed from its last checkpoint instead of starting again, and a finished book is returned as it is.
+
+    :param config: The configuration of the book, with its own `thread_id` in `configurable`
+    :param on_progress: Receives the thread_id and each progress event emitted while streaming (if `streaming` is enabled)
+    Once the book is done, the records of its LLM calls are dropped: they are summarized in its `run_report`.
+
+    :return: The thread_id, the status ('done' or 'needs_feedback') and the final values of the state
+    """
+    thread_id = config['configurable']['thread_id']
+    snapshot = await app.aget_state(config)
+    if snapshot.values and 'human_feedback' not in snapshot.next:
+        print(f"The book {thread_id} was already started, it will be resumed from: {list(snapshot.next) or 'the end'}")
+        graph_input = None
+    else:
+        graph_input = {'user_instructor_messages': [HumanMessage(content = idea)]}
+    async for stream_mode, chunk in app.astream(
+            input = graph_input,
+            config = config,
+            stream_mode = ['values', 'custom']):
+        if stream_mode == 'custom' and on_progress is not None:
+            on_progress(thread_id, chunk)
+
+    snapshot = await app.aget_state(config)
+    if 'human_feedback' in snapshot.next:
+        return {'thread_id': thread_id, 'status': 'needs_feedback', 'question': snapshot.values['user_instructor_messages'][-1].content, 'values': snapshot.values}
+    clear_invocation_records(thread_id)
+    return {'thread_id': thread_id, 'status': 'done', 'values': snapshot.values}
+
+async def arun_books(app, ideas: List[str], config: dict, max_concurrent_books: int = 20, on_progress: Optional[Callable[[str, dict], None]] = _print_progress) -> List[Dict[str, Any]]:
+    """
+    Runs many books concurrently in one event loop, each one in its own thread (`<thread_id>-<n>` from the base configuration).
+    At most `max_concurrent_books` are in flight; the rate limiters of the providers are shared by all of them.
+
+    :return: The result of `arun_book` for each idea, in the same order
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_books)
+    base_thread_id = config['configurable'].get('thread_id', 'book')
+
+    async def run(n_book: int, idea: str):
+        book_config = copy.deepcopy(config)
+        book_config['configurable']['thread_id'] = f"{base_thread_id}-{n_book}"
+        async with semaphore:
+            return await arun_book(app, idea, book_config, on_progress = on_progress)
+
+    return list(await asyncio.gather(*[run(n_book, idea) for n_book, idea in enumerate(ideas)]))
+
+def _book_file_name(title: str) -> str:
+    return re.sub(r'[^\w\s]','', unidecode(title.replace(" ","_"))).lower()
+
+def _write_book(path: str, models_info: str, title: str, prologue: str, chapter_names: List[str], chapters: List[str]):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    with open(path, "w") as f:
+        f.write(models_info)
+        f.write("Title:\n")
+        f.write(title+'\n\n')
+        f.write("Prologue:\n")
+        f.write(prologue+'\n\n')
+        for chapter_name, chapter_content in zip(chapter_names, chapters):
+            f.write(chapter_name+'\n')
+            f.write(chapter_content+'\n\n')
+
+def save_book(values: dict, language: Optional[str]) -> List[str]:
+    """
+    Saves a finished book (and its translation, if any) in `developed_books/<language>/`, with its run report, as `execution.py` does.
+
+    :return: The paths of the written files
+    """
+    models_info = 'Used models:'+'\n' + "\n".join(f"- {key}: {values[key]}" for key in MODEL_KEYS if key in values) + '\n\n' + 'Usage:' + '\n' + format_run_report(values['run_report']) + '\n\n' + '-----------------------------------------' + '\n\n'
+    book_file_name = _book_file_name(values['book_title'])
+    paths = [f"developed_books/english/{book_file_name}.txt", f"developed_books/english/{book_file_name}_run_report.json"]
+    write_run_report(values['run_report'], paths[1])
+    _write_book(paths[0], models_info, values['book_title'], values['book_prologue'], values['chapter_names_of_approved_chapters'], values['content_of_approved_chapters'])
+
+    if not ((language == 'english')|(language is None)):
+        paths.append(f"developed_books/{language}/{_book_file_name(values['translated_book_name'])}.txt")
+        _write_book(paths[-1], models_info, values['translated_book_name'], values['translated_book_prologue'], values['translated_chapter_names'], values['translated_content'])
+    return paths
@@ -0,0 +1,72 @@
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+from src.constants import *
+from src.utils import State, GraphConfig, StoryBible, DocumentationReady, WriterStructuredOutput, ApprovedWriterChapter, CritiqueWriterChapter, TranslatorStructuredOutput, get_json_schema, is_lean_node, lean_prompt
+
+def format_user_requirements(instructor_documents: DocumentationReady) -> str:
+    return "\n".join([f"{key}: {value}" for key, value in instructor_documents.dict().items()])
+
+def format_idea_draft(state: State) -> str:
+    """
+    The approved idea of the book, as the Brainstorming Narrative Agent and the Writing Reviewer Agent read it.
+    """
+    return f"Story overview: {state['story_overview']}\n" f"Context and Setting: {state['plannified_context_setting']}\n" f"Inciting Incident: {state['plannified_inciting_incident']}\n" f"Themes and Conflicts Introduction: {state['plannified_themes_conflicts_intro']}\n" f"Transition to Development: {state['plannified_transition_to_development']}\n" f"Rising Action: {state['plannified_rising_action']}\n" f"Subplots: {state['plannified_subplots']}\n" f"Midpoint: {state['plannified_midpoint']}\n" f"Climax Build-Up: {state['plannified_climax_build_up']}\n" f"Climax: {state['plannified_climax']}\n" f"Falling Action: {state['plannified_falling_action']}\n" f"Resolution: {state['plannified_resolution']}\n" f"Epilogue: {state['plannified_epilogue']}\n" f"Writing Style: {state['writing_style']}"
+
+def build_story_bible(state: State, config: GraphConfig) -> StoryBible:
+    """
+    Renders the system prompts of the Writer, the Writing Reviewer and the Translator from the approved brainstorming.
+    Nothing they contain changes after the approval, so they are rendered once and every call of the book sends the same prefix.
+    """
+    user_requirements = format_user_requirements(state['instructor_documents'])
+    draft = format_idea_draft(state) + "\n" f"Summary of each chapter: {state['plannified_chapters_summaries'][-1]}"
+    lean = is_lean_node(config, 'writer_model')
+    writer_system_prompt = (lean_prompt(WRITER_PROMPT) if lean else WRITER_PROMPT).format(
+        user_requirements=user_requirements,
+        story_overview=state['story_overview'],
+        characters=state['characters'],
+        writing_style=state['writing_style'],
+        context_setting=state['plannified_context_setting'],
+        inciting_incident=state['plannified_inciting_incident'],
+        themes_conflicts_intro=state['plannified_themes_conflicts_intro'],
+        transition_to_development=state['plannified_transition_to_development'],
+        rising_action=state['plannified_rising_action'],
+        subplots=state['plannified_subplots'],
+        midpoint=state['plannified_midpoint'],
+        climax_build_up=state['plannified_climax_build_up'],
+        climax=state['plannified_climax'],
+        falling_action=state['plannified_falling_action'],
+        resolution=state['plannified_resolution'],
+        epilogue=state['plannified_epilogue'],
+        schema = get_json_schema(WriterStructuredOutput, lean),
+        min_paragraph_in_chapter = config['configurable'].get('min_paragraph_per_chapter', 10),
+        min_sentences_in_each_paragraph_in_chapter = config['configurable'].get('min_sentences_in_each_paragraph_per_chapter', 10)
+    )
+    reviewer_system_prompt = WRITING_REVIEWER_PROMPT.format(draft=draft, approved_schema = get_json_schema(ApprovedWriterChapter), critique_schema = get_json_schema(CritiqueWriterChapter))
+    translator_system_prompt = TRANSLATOR_PROMPT.format(
+        target_language=config['configurable'].get("language"),
+        book_name=state['book_title'],
+        story_topic=state['instructor_documents'].topic,
+        schema = get_json_schema(TranslatorStructuredOutput)
+    )
+    return StoryBible(
+        user_requirements = user_requirements,
+        draft = draft,
+        writer_system_prompt = writer_system_prompt,
+        reviewer_system_prompt = reviewer_system_prompt,
+        translator_system_prompt = translator_system_prompt
+    )
+
+def get_story_bible(state: State, config: GraphConfig) -> StoryBible:
+    """
+    The story bible of the book. The books checkpointed before it existed get it rendered on the fly.
+    """
+    if state.get('story_bible') is not None:
+        return state['story_bible']
+    return build_story_bible(state, config)
@@ -0,0 +1,543 @@
+import os
+from dotenv import load_dotenv
+import sys
+
+load_dotenv()
+WORKDIR=os.getenv("WORKDIR")
+os.chdir(WORKDIR)
+sys.path.append(WORKDIR)
+
+import re
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Generator, List, NamedTuple, Optional, Tuple, Type, Union
+from langchain_core.messages import AIMessage, AnyMessage, HumanMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.config import get_stream_writer
+from pydantic import BaseModel, ValidationError
+from src.utils import GraphConfig, NoJson, BadFormattedJson, cleaning_llm_output, retrieve_model_name
+from src.json_parser import IncrementalJsonReader, find_json_start
+from src.accounting import BudgetExceeded, DEFAULT_BUDGET_ACTION, add_to_budget_totals, budget_status, budget_totals, usage_from_message
+from src.tracing import span, node_span, add_span_event, log_event
+
+AGENT_NAMES = {
+    'instructor': 'The Instructor Agent',
+    'brainstorming_idea_writer': 'The Brainstorming Idea Agent',
+    'brainstorming_idea_critique': 'The Brainstorming Idea Critique Agent',
+    'brainstorming_narrative_writer': 'The Brainstorming Narrative Agent',
+    'brainstorming_narrative_critique': 'The Brainstorming Narrative Critique Agent',
+    'writer': 'The Writer Agent',
+    'writing_reviewer': 'The Writing Reviewer Agent',
+    'continuity_editor': 'The Continuity Editor Agent',
+    'translator': 'The Translator Agent',
+}
+
+# While streaming, a progress event is emitted every time the reply grows this number of characters
+PROGRESS_EVERY_N_CHARS = 500
+
+# Finish reasons of the providers when the reply reaches its maximum of output tokens ('length' for OpenAI and Groq,
+# 'MAX_TOKENS' for Gemini, 'max_tokens' for Claude on Bedrock)
+TRUNCATION_FINISH_REASONS = ['length', 'max_tokens']
+CONTINUATION_PROMPT = "Your reply was cut off because it reached the maximum length. Continue exactly from where your reply was cut: write only the rest of it, starting with the next character, without repeating what you already wrote nor opening a new code block."
+# The continuation must repeat at least this number of characters of the end of the reply to count as an overlap (and not as a coincidence)
+_MIN_OVERLAP = 20
+_MAX_OVERLAP = 500
+_REOPENED_FENCE = re.compile(r"^\s*```(?:json)?[ \t]*\n?")
+
+class StructuredOutputError(Exception):
+    pass
+
+# Records of the finished calls, per thread_id, and the running totals of each thread that its budget caps are checked against
+_records: Dict[Optional[str], List[Dict[str, Any]]] = {}
+_budget_totals: Dict[Optional[str], Dict[str, Any]] = {}
+_records_lock = threading.Lock()
+
+def _select_schema(parsed: dict, schemas: Tuple[Type[BaseModel], ...]) -> Type[BaseModel]:
+    """
+    When the model can answer with more than one schema (eg: ApprovedWriterChapter or CritiqueWriterChapter), it picks the one whose keys are present.
+    """
+    for schema in schemas:
+        if set(schema.model_fields).issubset(parsed.keys()):
+            return schema
+    return max(schemas, key = lambda schema: len(set(schema.model_fields) & set(parsed.keys())))
+
+def _validation_correction(error: ValidationError) -> str:
+    correction_instruction = ''
+    for detail in error.errors():
+        field_name = detail['loc'][-1] if detail['loc'] else ''
+        if detail['type'] == 'missing':
+            correction_instruction += f"You forgot to place the key `{field_name}`\n\n"
+        else:
+            correction_instruction += f"You place incorrectly the data type of the key `{field_name}`: {detail['msg']}\n\n"
+    return correction_instruction + "Check what I have mentioned and return the corrected JSON object, following the schema defined in <FORMAT_OUTPUT>."
+
+def _get_progress_writer() -> Callable[[dict], None]:
+    """
+    Returns the writer of the `custom` stream mode of the graph, or a no-op one when running outside of a graph (or in a worker thread).
+    """
+    try:
+        return get_stream_writer()
+    except Exception:
+        return lambda event: None
+
+class _StreamedReply:
+    """
+    Reads a streamed reply chunk by chunk: its JSON object on the way, the progress events (first token, completed fields, size) and the early stop.
+
+    :param early_stop: Receives the top-level fields completed so far. If it returns a result, the outcome is already known:
+        the generation can be aborted and that result is used.
+    """
+    def __init__(self, node: str, early_stop: Optional[Callable[[dict], Optional[BaseModel]]]):
+        self.node = node
+        self.early_stop = early_stop
+        self.write_progress = _get_progress_writer()
+        self.reader = IncrementalJsonReader()
+        self.start = time.time()
+        self.aggregated = None
+        self.decided = None
+        self.next_progress = PROGRESS_EVERY_N_CHARS
+
+    def _progress(self, event: str, **fields):
+        seconds = round(time.time() - self.start, 3)
+        self.write_progress({'node': self.node, 'event': event, **fields, 'seconds': seconds})
+        add_span_event(event, **fields, seconds = seconds)
+
+    def add(self, chunk) -> bool:
+        """
+        Reads a new chunk. Returns True when the outcome is already known and the generation should be stopped.
+        """
+        self.aggregated = chunk if self.aggregated is None else self.aggregated + chunk
+        if not isinstance(chunk.content, str) or chunk.content == '':
+            return False
+        if len(self.reader.text) == 0:
+            self._progress('first_token')
+        for field in self.reader.feed(chunk.content):
+            self._progress('field_completed', field = field)
+            if self.early_stop is not None and self.decided is None:
+                self.decided = self.early_stop(self.reader.fields)
+        if len(self.reader.text) >= self.next_progress:
+            self.next_progress += PROGRESS_EVERY_N_CHARS
+            self._progress('progress', field = self.reader.current_key, chars = len(self.reader.text))
+        if self.decided is not None:
+            self._progress('early_stop', chars = len(self.reader.text))
+            return True
+        return False
+
+    def finish(self) -> Tuple[AIMessage, Optional[BaseModel]]:
+        """
+        :return: The reply (partial if it was stopped) and the early result, if any
+        """
+        self._progress('done', chars = len(self.reader.text))
+        if self.aggregated is None:
+            return AIMessage(content = ''), self.decided
+        aggregated = self.aggregated
+        return AIMessage(content = self.reader.text if isinstance(aggregated.content, str) else aggregated.content, response_metadata = aggregated.response_metadata, usage_metadata = aggregated.usage_metadata, id = aggregated.id), self.decided
+
+def _stream_reply(model, messages: List[AnyMessage], node: str, early_stop: Optional[Callable[[dict], Optional[BaseModel]]]) -> Tuple[AIMessage, Optional[BaseModel]]:
+    """
+    Streams the reply of the model, reading its JSON object on the way and emitting progress events, see `_StreamedReply`.
+    """
+    reply = _StreamedReply(node, early_stop)
+    stream = model.stream(messages)
+    try:
+        for chunk in stream:
+            if reply.add(chunk):
+                break
+    finally:
+        stream.close()
+    return reply.finish()
+
+async def _astream_reply(model, messages: List[AnyMessage], node: str, early_stop: Optional[Callable[[dict], Optional[BaseModel]]]) -> Tuple[AIMessage, Optional[BaseModel]]:
+    """
+    Async version of `_stream_reply`.
+    """
+    reply = _StreamedReply(node, early_stop)
+    stream = model.astream(messages)
+    try:
+        async for chunk in stream:
+            if reply.add(chunk):
+                break
+    finally:
+        await stream.aclose()
+    return reply.finish()
+
+def _streams(model, streaming: bool) -> bool:
+    """
+    Whether the reply is streamed. The models with a response cache are always invoked: LangChain only looks up (and stores) the
+    replies in the cache on `invoke` / `ainvoke`, so streaming them would silently disable it.
+    """
+    return streaming and getattr(model, 'cache', None) in (None, False)
+
+def _account_usage(record: Dict[str, Any], messages: List[AnyMessage], output: AIMessage) -> Dict[str, Any]:
+    usage = usage_from_message(messages, output)
+    if usage['from_cache']:
+        record['cached_attempts'] += 1
+        return usage
+    record['prompt_chars'] += sum(len(str(message.content)) for message in messages)
+    record['input_tokens'] += usage['input_tokens']
+    record['output_tokens'] += usage['output_tokens']
+    record['estimated_attempts'] += 1 if usage['estimated'] else 0
+    return usage
+
+def _new_record(model, schemas: Tuple[Type[BaseModel], ...], config: GraphConfig, node: str, agent: Optional[str], chapter: Optional[int]) -> Dict[str, Any]:
+    return {
+        'thread_id': config['configurable'].get('thread_id'),
+        'node': node,
+        'agent': agent or node,
+        'schema': '|'.join(schema.__name__ for schema in schemas),
+        'attempts': 0,
+        'failures': [],
+        'succeeded': False,
+        'early_stopped': False,
+        'chapter': chapter,
+        'model': retrieve_model_name(model),
+        'input_tokens': 0,
+        'output_tokens': 0,
+        'prompt_chars': 0,
+        'cached_attempts': 0,
+        'estimated_attempts': 0,
+        'started_at': time.time(),
+        'latency_seconds': 0.0,
+    }
+
+def is_truncated(output: AIMessage) -> bool:
+    """
+    Whether the reply was cut before its end: the provider says it reached the maximum of output tokens, or the reply ends in
+    the middle of its JSON object.
+    """
+    metadata = output.response_metadata or {}
+    finish_reason = metadata.get('finish_reason') or metadata.get('stop_reason')
+    # Gemini gives an enum (FinishReason.MAX_TOKENS)
+    if finish_reason is not None and str(finish_reason).split('.')[-1].lower() in TRUNCATION_FINISH_REASONS:
+        return True
+    if not isinstance(output.content, str):
+        return False
+    reader = IncrementalJsonReader()
+    reader.feed(output.content)
+    return reader.is_cut
+
+def stitch_continuation(partial: str, continuation: str) -> str:
+    """
+    Joins a reply that was cut with its continuation, so they are parsed as a single reply. The models sometimes open a new
+    code block, repeat the end of what they wrote or start the JSON object again: the repeated text is dropped.
+    """
+    continuation = _REOPENED_FENCE.sub('', continuation, count = 1)
+    start = find_json_start(partial)
+    if start is not None and continuation.lstrip().startswith(partial[start:start + _MIN_OVERLAP]):
+        return partial[:start] + continuation.lstrip()
+    for size in range(min(len(partial), len(continuation), _MAX_OVERLAP), _MIN_OVERLAP - 1, -1):
+        if partial.endswith(continuation[:size]):
+            return partial + continuation[size:]
+    return partial + continuation
+
+def _stitched_reply(partial: str, output: AIMessage) -> AIMessage:
+    content = output.content if isinstance(output.content, str) else ''
+    return AIMessage(content = stitch_continuation(partial, content), response_metadata = output.response_metadata, usage_metadata = output.usage_metadata, id = output.id)
+
+def _start_attempt(record: Dict[str, Any], attempt: int, config: GraphConfig, agent_name: str):
+    totals = _thread_budget_totals(record['thread_id'])
+    add_to_budget_totals(totals, record)
+    exceeded = budget_status(config, totals)
+    if exceeded is not None and config['configurable'].get('on_budget_exceeded', DEFAULT_BUDGET_ACTION) == 'stop':
+        raise BudgetExceeded(f"{agent_name} was stopped before calling the model: {exceeded}.")
+    record['attempts'] = attempt
+
+def _read_attempt(record: Dict[str, Any], output: AIMessage, decided: Optional[BaseModel], schemas: Tuple[Type[BaseModel], ...], allow_plain_text: bool, agent_name: str, continue_truncated: bool) -> Tuple[Optional[Tuple[Union[BaseModel, str], AIMessage]], Optional[str]]:
+    """
+    Parses the reply of an attempt into one of the schemas.
+
+    :param continue_truncated: If the reply was cut before its end, ask the model to continue it instead of correcting it
+    :return: The result and the reply if the attempt succeeded, otherwise the correction to send in the next attempt
+    """
+    if decided is not None:
+        record['succeeded'] = True
+        record['early_stopped'] = True
+        return (decided, output), None
+    try:
+        parsed = cleaning_llm_output(llm_output = output)
+        if not isinstance(parsed, dict):
+            raise TypeError(f"You generated a python {type(parsed).__name__} object. Please, return a JSON object following the schema defined in <FORMAT_OUTPUT>.")
+        result = _select_schema(parsed, schemas)(**parsed)
+        record['succeeded'] = True
+        if record['attempts'] > 1:
+            log_event(f"{agent_name} successfully generated the JSON object.")
+        return (result, output), None
+
+    except NoJson:
+        if allow_plain_text:
+            record['succeeded'] = True
+            return (output.content, output), None
+        reason = 'no_json'
+        log_event(f"{agent_name} couldn't generate a completed formatted JSON. It will try again.")
+        correction = "The output does not contain a complete JSON code block. Please, return the output in the correct format. Don't repeat always the same, avoid hallucinations or endness verbosity"
+    except BadFormattedJson as e:
+        reason = 'bad_formatted_json'
+        log_event(f"{agent_name} couldn't generate a corrected syntaxis for the JSON output. It will try again.")
+        correction = f"Bad Formatted JSON. Please return the same info but correctly formatted. Here the error: {json.dumps(e.args[0])}"
+    except ValidationError as e:
+        reason = 'validation_error'
+        log_event(f"{agent_name} generated incorrectly the content inside the JSON object. It will try again.")
+        correction = _validation_correction(e)
+    except TypeError as e:
+        reason = 'wrong_type'
+        log_event(f"{agent_name} generated incorrectly the data type of the output object. It will try again.")
+        correction = str(e)
+
+    if is_truncated(output):
+        reason = 'truncated'
+        if continue_truncated:
+            log_event(f"{agent_name} reached the maximum length of its reply before finishing the JSON object. It will continue from where it was cut.")
+            correction = CONTINUATION_PROMPT
+    record['failures'].append(reason)
+    return None, correction
+
+def _retry_messages(record: Dict[str, Any], output: AIMessage, correction: str, continue_truncated: bool) -> Tuple[List[AnyMessage], Optional[str]]:
+    """
+    The messages added to the original ones in the next attempt, and the reply cut so far if the next attempt continues it.
+    A continuation always re-sends the whole reply cut so far (the pieces already stitched), as a single message.
+    """
+    if continue_truncated and record['failures'][-1] == 'truncated' and isinstance(output.content, str):
+        return [AIMessage(content = output.content), HumanMessage(content = correction)], output.content
+    return [output, HumanMessage(content = correction)], None
+
+def _attempt_span(record: Dict[str, Any], attempt: int, streaming: bool):
+    return span('llm', kind = 'llm', thread_id = record['thread_id'], node = record['node'], agent = record['agent'], chapter = record['chapter'], attempt = attempt, model = record['model'], schema = record['schema'], streaming = streaming)
+
+def _end_attempt_span(attempt_span, record: Dict[str, Any], usage: Dict[str, Any], succeeded: bool):
+    attempt_span.set(
+        input_tokens = usage['input_tokens'],
+        output_tokens = usage['output_tokens'],
+        cached = usage['from_cache'],
+        early_stopped = record['early_stopped'],
+        retry_reason = None if succeeded else record['failures'][-1]
+    )
+
+def _finish_record(record: Dict[str, Any], start: float):
+    record['latency_seconds'] = time.time() - start
+    with _records_lock:
+        _records.setdefault(record['thread_id'], []).append(record)
+        add_to_budget_totals(_budget_totals.setdefault(record['thread_id'], budget_totals([])), record)
+
+def invoke_structured(model, messages: List[AnyMessage], schema: Union[Type[BaseModel], Tuple[Type[BaseModel], ...]], config: GraphConfig, node: str, allow_plain_text: bool = False, early_stop: Optional[Callable[[dict], Optional[BaseModel]]] = None, chapter: Optional[int] = None, agent: Optional[str] = None) -> Tuple[Union[BaseModel, str], AIMessage]:
+    """
+    Invokes the model and parses its reply into one of the Pydantic schemas, with a bounded retry ladder.
+
+    Every retry re-sends the original messages plus only the last failed reply and a short corrective prompt, so the
+    corrections don't pile up in the context. The number of attempts is set with `structured_output_max_attempts` in the
+    configuration (3 by default). Attempts, latency and failure reasons are recorded per call, see `get_invocation_report`.
+
+    When `streaming` is enabled in the configuration, the reply is streamed and read while it is generated (see `_stream_reply`),
+    except for the cached models, see `_streams`.
+    A reply cut before its end (see `is_truncated`) is continued from the cut in the next attempt instead of being generated again,
+    and the pieces are stitched before parsing, unless `continue_truncated_outputs` is False in the configuration.
+
+    :param allow_plain_text: If the reply has no JSON at all, return its text instead of retrying (eg: the Instructor asking a question)
+    :param early_stop: Only while streaming. Decides the result from the fields completed so far, so the generation can be stopped before its end
+    :param chapter: The chapter the call is about, if any, to account its tokens and time per chapter
+    :param agent: The agent that answers, when it isn't the one of the node (eg: the critiques of the candidate ideas, graded in the
+        `brainstorming_idea_writer` node). The call is recorded under the node, with the agent as its sub-label.
+    :raises BudgetExceeded: If the book is over one of its budget caps and `on_budget_exceeded` is 'stop'
+    :return: The validated schema instance (or the plain text) and the raw reply of the model
+    """
+    schemas = schema if isinstance(schema, tuple) else (schema,)
+    max_attempts = config['configurable'].get('structured_output_max_attempts', 3)
+    streaming = _streams(model, config['configurable'].get('streaming', False))
+    continue_truncated = config['configurable'].get('continue_truncated_outputs', True)
+    agent_name = AGENT_NAMES.get(agent or node, 'The Agent')
+    record = _new_record(model, schemas, config, node, agent, chapter)
+    start = time.time()
+    retry_messages, partial = [], None
+    try:
+        for attempt in range(1, max_attempts + 1):
+            _start_attempt(record, attempt, config, agent_name)
+            with _attempt_span(record, attempt, streaming) as attempt_span:
+                if streaming:
+                    # The fields of a continuation aren't the ones of the object, so it can't be stopped early
+                    output, decided = _stream_reply(model, messages + retry_messages, record['agent'], early_stop if partial is None else None)
+                else:
+                    output, decided = model.invoke(messages + retry_messages), None
+                usage = _account_usage(record, messages + retry_messages, output)
+                if partial is not None:
+                    output = _stitched_reply(partial, output)
+                succeeded, correction = _read_attempt(record, output, decided, schemas, allow_plain_text, agent_name, continue_truncated)
+                _end_attempt_span(attempt_span, record, usage, succeeded is not None)
+            if succeeded is not None:
+                return succeeded
+            retry_messages, partial = _retry_messages(record, output, correction, continue_truncated)
+
+        raise StructuredOutputError(f"{agent_name} couldn't generate a valid {record['schema']} object after {max_attempts} attempts: {record['failures']}")
+    finally:
+        _finish_record(record, start)
+
+async def ainvoke_structured(model, messages: List[AnyMessage], schema: Union[Type[BaseModel], Tuple[Type[BaseModel], ...]], config: GraphConfig, node: str, allow_plain_text: bool = False, early_stop: Optional[Callable[[dict], Optional[BaseModel]]] = None, chapter: Optional[int] = None, agent: Optional[str] = None) -> Tuple[Union[BaseModel, str], AIMessage]:
+    """
+    Async version of `invoke_structured`, with `ainvoke` / `astream`: it doesn't block the event loop while waiting for the provider.
+    """
+    schemas = schema if isinstance(schema, tuple) else (schema,)
+    max_attempts = config['configurable'].get('structured_output_max_attempts', 3)
+    streaming = _streams(model, config['configurable'].get('streaming', False))
+    continue_truncated = config['configurable'].get('continue_truncated_outputs', True)
+    agent_name = AGENT_NAMES.get(agent or node, 'The Agent')
+    record = _new_record(model, schemas, config, node, agent, chapter)
+    start = time.time()
+    retry_messages, partial = [], None
+    try:
+        for attempt in range(1, max_attempts + 1):
+            _start_attempt(record, attempt, config, agent_name)
+            with _attempt_span(record, attempt, streaming) as attempt_span:
+                if streaming:
+                    # The fields of a continuation aren't the ones of the object, so it can't be stopped early
+                    output, decided = await _astream_reply(model, messages + retry_messages, record['agent'], early_stop if partial is None else None)
+                else:
+                    output, decided = await model.ainvoke(messages + retry_messages), None
+                usage = _account_usage(record, messages + retry_messages, output)
+                if partial is not None:
+                    output = _stitched_reply(partial, output)
+                succeeded, correction = _read_attempt(record, output, decided, schemas, allow_plain_text, agent_name, continue_truncated)
+                _end_attempt_span(attempt_span, record, usage, succeeded is not None)
+            if succeeded is not None:
+                return succeeded
+            retry_messages, partial = _retry_messages(record, output, correction, continue_truncated)
+
+        raise StructuredOutputError(f"{agent_name} couldn't generate a valid {record['schema']} object after {max_attempts} attempts: {record['failures']}")
+    finally:
+        _finish_record(record, start)
+
+class StructuredCall(NamedTuple):
+    """
+    A call to `invoke_structured` requested by the steps of a node (see `node_from_steps`).
+    """
+    model: Any
+    messages: List[AnyMessage]
+    schema: Union[Type[BaseModel], Tuple[Type[BaseModel], ...]]
+    kwargs: Dict[str, Any]
+
+class ConcurrentCalls(NamedTuple):
+    """
+    Several independent calls requested at once by the steps of a node, made concurrently with at most `max_workers` in flight.
+    """
+    calls: List[StructuredCall]
+    max_workers: int
+
+def structured_call(model, messages: List[AnyMessage], schema: Union[Type[BaseModel], Tuple[Type[BaseModel], ...]], **kwargs) -> StructuredCall:
+    return StructuredCall(model = model, messages = messages, schema = schema, kwargs = kwargs)
+
+def run_steps(steps: Generator) -> Any:
+    """
+    Runs the steps of a node synchronously: each requested call is made with `invoke_structured`, and the concurrent ones with a pool of threads.
+    """
+    result = None
+    while True:
+        try:
+            request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        if isinstance(request, ConcurrentCalls):
+            with ThreadPoolExecutor(max_workers = request.max_workers) as executor:
+                # Each call runs in a copy of the context of the node, so its spans are children of the span of the node
+                futures = [executor.submit(contextvars.copy_context().run, invoke_structured, call.model, call.messages, call.schema, **call.kwargs) for call in request.calls]
+                result = [future.result() for future in futures]
+        else:
+            result = invoke_structured(request.model, request.messages, request.schema, **request.kwargs)
+
+async def arun_steps(steps: Generator) -> Any:
+    """
+    Runs the steps of a node in the event loop: each requested call is made with `ainvoke_structured`, and the concurrent ones are gathered.
+    """
+    result = None
+    while True:
+        try:
+            request = steps.send(result)
+        except StopIteration as stop:
+            return stop.value
+        if isinstance(request, ConcurrentCalls):
+            semaphore = asyncio.Semaphore(request.max_workers)
+            async def bounded_call(call: StructuredCall):
+                async with semaphore:
+                    return await ainvoke_structured(call.model, call.messages, call.schema, **call.kwargs)
+            result = list(await asyncio.gather(*[bounded_call(call) for call in request.calls]))
+        else:
+            result = await ainvoke_structured(request.model, request.messages, request.schema, **request.kwargs)
+
+def node_from_steps(steps: Callable[[dict, GraphConfig], Generator]) -> RunnableLambda:
+    """
+    Builds a graph node from its steps: a generator that yields the LLM calls it needs (`structured_call`, `ConcurrentCalls`),
+    receives their results and returns the update of the state. The node runs them with `invoke_structured` when the graph
+    is run with `invoke` / `stream`, and with `ainvoke_structured` when it is run with `ainvoke` / `astream`.
+    """
+    name = steps.__name__.lstrip('_')
+
+    def node(state: dict, config: GraphConfig):
+        with node_span(name, config):
+            return run_steps(steps(state, config))
+
+    async def anode(state: dict, config: GraphConfig):
+        with node_span(name, config):
+            return await arun_steps(steps(state, config))
+
+    return RunnableLambda(node, afunc = anode, name = name)
+
+def get_invocation_records(thread_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    The records of the calls of a thread, or of every thread if it is None.
+    """
+    with _records_lock:
+        if thread_id is None:
+            return [record for records in _records.values() for record in records]
+        return list(_records.get(thread_id, []))
+
+def clear_invocation_records(thread_id: Optional[str]):
+    """
+    Drops the records of a thread (and its budget totals), once its run report is built, so a long-lived process doesn't keep every book.
+    """
+    with _records_lock:
+        _records.pop(thread_id, None)
+        _budget_totals.pop(thread_id, None)
+
+def _thread_budget_totals(thread_id: Optional[str]) -> Dict[str, Any]:
+    with _records_lock:
+        return dict(_budget_totals.get(thread_id, budget_totals([])))
+
+def is_budget_degraded(config: GraphConfig) -> bool:
+    """
+    True when the book is over one of its budget caps and `on_budget_exceeded` is 'degrade': the critique nodes then approve without calling their model.
+    """
+    if config['configurable'].get('on_budget_exceeded', DEFAULT_BUDGET_ACTION) != 'degrade':
+        return False
+    return budget_status(config, _thread_budget_totals(config['configurable'].get('thread_id'))) is not None
+
+def get_invocation_report(thread_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    Aggregates, per node, the structured calls, the LLM round trips they needed, the wasted ones (retries) and why they happened.
+    """
+    report = {}
+    for record in get_invocation_records(thread_id):
+        node_report = report.setdefault(record['node'], {'calls': 0, 'attempts': 0, 'wasted_attempts': 0, 'failed_calls': 0, 'early_stopped_calls': 0, 'failure_reasons': {}, 'latency_seconds': 0.0})
+        node_report['calls'] += 1
+        node_report['attempts'] += record['attempts']
+        node_report['wasted_attempts'] += len(record['failures'])
+        node_report['failed_calls'] += 0 if record['succeeded'] else 1
+        node_report['early_stopped_calls'] += 1 if record['early_stopped'] else 0
+        node_report['latency_seconds'] += record['latency_seconds']
+        for reason in record['failures']:
+            node_report['failure_reasons'][reason] = node_report['failure_reasons'].get(reason, 0) + 1
+    return report
+
+def describe_progress_event(event: dict) -> str:
+    """
+    Human readable line for the progress events emitted while streaming, in the `custom` stream mode of the graph.
+    """
+    agent_name = AGENT_NAMES.get(event['node'], 'The Agent')
+    if event['event'] == 'first_token':
+        return f"{agent_name} started to reply after {event['seconds']} seconds."
+    if event['event'] == 'field_completed':
+        return f"{agent_name} completed the field `{event['field']}` ({event['seconds']} seconds)."
+    if event['event'] == 'progress':
+        return f"{agent_name} is writing `{event['field']}`: {event['chars']} characters so far."
+    if event['event'] == 'early_stop':
+        return f"{agent_name} was stopped after {event['chars']} characters, the outcome is already known."
+    return f"{agent_name} finished its reply: {event['chars']} characters in {event['seconds']} seconds."
@@ -0,0 +1,332 @@
+"""
+Structured tracing of the agents: every node of the graph and every LLM call (each attempt of the retry ladder) runs in a span,
+with its thread_id, node, chapter, attempt, retry reason, latency and tokens. The messages of the agents are attached to the
+span they were logged in, so a trace reads like the console output of the book, but with its timings and its nesting.
+
+The messages are also logged with the `bookbuilder` logger, with the thread_id and the node they were logged in (printed as
+'[<thread_id>] <message>' by default), so the lines of the books that run concurrently can be told apart, with or without tracing.
+
+Tracing is disabled by default: the spans are a shared no-op object and nothing is measured. It is enabled with the
+`TRACE_EXPORTER` environment variable or with `configure_tracing`:
+- 'jsonl': each finished span is appended as a JSON line to `TRACE_PATH` (`traces.jsonl` by default)
+- 'otel': the spans are sent to the OpenTelemetry tracer provider of the process (requires `opentelemetry-api`,
+  and `opentelemetry-sdk` plus an exporter to send them anywhere)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import threading
+import logging
+import contextvars
+from typing import Any, Dict, List, Optional
+
+DEFAULT_TRACE_PATH = "traces.jsonl"
+
+# Attributes of the LLM spans summed into the span of their node
+ROLLED_UP_ATTRIBUTES = ['input_tokens', 'output_tokens']
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('current_span', default = None)
+# The thread_id and the node of the messages logged in the current context, set by `node_span` even when tracing is disabled
+_log_context: contextvars.ContextVar[Dict[str, Any]] = contextvars.ContextVar('log_context', default = {})
+
+class _LogContextFilter(logging.Filter):
+    """
+    Adds the thread_id and the node of the current context to the records of the `bookbuilder` logger.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        record.thread_id = context.get('thread_id')
+        record.node = context.get('node')
+        record.thread_prefix = f"[{record.thread_id}] " if record.thread_id is not None else ''
+        return True
+
+logger = logging.getLogger('bookbuilder')
+logger.addFilter(_LogContextFilter())
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(thread_prefix)s%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+class Span:
+    """
+    A timed operation: a node of the graph ('node'), a call to a model ('llm') or anything else ('internal').
+    Entering it makes it the parent of the spans started in the same context (threads and tasks included, when the context is copied).
+    """
+    def __init__(self, exporter, name: str, kind: str, attributes: Dict[str, Any]):
+        self.exporter = exporter
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.parent = _current_span.get()
+        if self.parent is not None:
+            self.trace_id = self.parent.trace_id
+        elif attributes.get('thread_id') is not None:
+            # Every span of a book is in the same trace, even when its nodes run in different processes (eg: a resumed book)
+            self.trace_id = uuid.uuid5(uuid.NAMESPACE_OID, str(attributes['thread_id'])).hex
+        else:
+            self.trace_id = uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.events: List[Dict[str, Any]] = []
+        self.status = 'ok'
+        self.error = None
+        self.start_time = None
+        self.latency_seconds = None
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes):
+        with self._lock:
+            self.events.append({'name': name, 'time': time.time(), **attributes})
+
+    def _roll_up(self, child: 'Span'):
+        """
+        Sums the tokens of a finished LLM span into this one, and keeps the chapters it was about.
+        The calls of a node can finish in several threads at once.
+        """
+        with self._lock:
+            self.attributes['llm_calls'] = self.attributes.get('llm_calls', 0) + 1
+            for key in ROLLED_UP_ATTRIBUTES:
+                self.attributes[key] = self.attributes.get(key, 0) + (child.attributes.get(key) or 0)
+            chapter = child.attributes.get('chapter')
+            if chapter is not None and chapter not in self.attributes.setdefault('chapters', []):
+                self.attributes['chapters'] = sorted(self.attributes['chapters'] + [chapter])
+
+    def __enter__(self) -> 'Span':
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        self.exporter.on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        self.latency_seconds = time.perf_counter() - self._start
+        if exc is not None:
+            self.status = 'error'
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        if self.parent is not None and self.kind == 'llm':
+            self.parent._roll_up(self)
+        self.exporter.on_end(self)
+        return False
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent.span_id if self.parent is not None else None,
+            'name': self.name,
+            'kind': self.kind,
+            'start_time': self.start_time,
+            'latency_seconds': round(self.latency_seconds, 6),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+            'events': self.events,
+        }
+
+class _NoopSpan:
+    """
+    The span returned while tracing is disabled: a single shared object that does nothing.
+    """
+    def set(self, **attributes):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class _NodeContext:
+    """
+    Runs the span of a node (or the no-op one) with the thread_id and the node set for the messages logged inside it.
+    """
+    def __init__(self, span, thread_id: Optional[str], node: str):
+        self.span = span
+        self.context = {'thread_id': thread_id, 'node': node}
+
+    def __enter__(self):
+        self._token = _log_context.set(self.context)
+        return self.span.__enter__()
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        try:
+            return self.span.__exit__(exc_type, exc, traceback)
+        finally:
+            _log_context.reset(self._token)
+
+class JsonlSpanExporter:
+    """
+    Appends every finished span as a JSON line to a file. The lines are buffered and written every `flush_every` spans,
+    and at the exit of the process.
+    """
+    def __init__(self, path: str = DEFAULT_TRACE_PATH, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok = True)
+
+    def on_start(self, span: Span):
+        pass
+
+    def on_end(self, span: Span):
+        line = json.dumps(span.to_dict(), default = str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.flush_every:
+                self._write()
+
+    def _write(self):
+        if self._buffer:
+            with open(self.path, "a") as f:
+                f.write("\n".join(self._buffer) + "\n")
+            self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def close(self):
+        self.flush()
+
+class OpenTelemetrySpanExporter:
+    """
+    Mirrors the spans as OpenTelemetry spans, with the same nesting, attributes and events. Where they are sent is decided by the
+    tracer provider configured in the process (eg: an OTLP exporter of `opentelemetry-sdk`).
+    """
+    def __init__(self, tracer_name: str = 'bookbuilder_ai'):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("The 'otel' trace exporter requires opentelemetry: pip install opentelemetry-api opentelemetry-sdk")
+        self._trace = trace
+        self.tracer = trace.get_tracer(tracer_name)
+        self._spans: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def on_start(self, span: Span):
+        with self._lock:
+            parent = self._spans.get(span.parent.span_id) if span.parent is not None else None
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self.tracer.start_span(span.name, context = context, start_time = int(span.start_time * 1e9))
+        with self._lock:
+            self._spans[span.span_id] = otel_span
+
+    def on_end(self, span: Span):
+        with self._lock:
+            otel_span = self._spans.pop(span.span_id, None)
+        if otel_span is None:
+            return
+        otel_span.set_attribute('kind', span.kind)
+        for key, value in span.attributes.items():
+            if value is not None:
+                otel_span.set_attribute(key, value if isinstance(value, (str, bool, int, float)) else json.dumps(value, default = str))
+        for event in span.events:
+            otel_span.add_event(event['name'], {key: str(value) for key, value in event.items() if key not in ['name', 'time']}, timestamp = int(event['time'] * 1e9))
+        if span.status == 'error':
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time = int((span.start_time + span.latency_seconds) * 1e9))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+_exporter = None
+_configured = False
+_config_lock = threading.Lock()
+
+def _exporter_from_env():
+    name = os.getenv("TRACE_EXPORTER", "").lower()
+    if name in ['', 'none']:
+        return None
+    if name == 'jsonl':
+        return JsonlSpanExporter(os.getenv("TRACE_PATH", DEFAULT_TRACE_PATH))
+    if name == 'otel':
+        return OpenTelemetrySpanExporter()
+    raise ValueError(f"Unsupported TRACE_EXPORTER: '{name}'. Expected one of: 'jsonl', 'otel', 'none'")
+
+def get_exporter():
+    global _exporter, _configured
+    if not _configured:
+        with _config_lock:
+            if not _configured:
+                _exporter = _exporter_from_env()
+                _configured = True
+    return _exporter
+
+def configure_tracing(exporter: Optional[str] = 'jsonl', path: str = DEFAULT_TRACE_PATH):
+    """
+    Enables the tracing with an exporter ('jsonl' or 'otel'), or disables it with None. It overrides the TRACE_EXPORTER environment variable.
+    """
+    global _exporter, _configured
+    with _config_lock:
+        if _exporter is not None:
+            _exporter.close()
+        if exporter is None:
+            _exporter = None
+        elif exporter == 'jsonl':
+            _exporter = JsonlSpanExporter(path)
+        elif exporter == 'otel':
+            _exporter = OpenTelemetrySpanExporter()
+        else:
+            raise ValueError(f"Unsupported trace exporter: '{exporter}'. Expected one of: 'jsonl', 'otel', None")
+        _configured = True
+
+def flush_traces():
+    if _exporter is not None:
+        _exporter.flush()
+
+atexit.register(flush_traces)
+
+def span(name: str, kind: str = 'internal', **attributes):
+    """
+    Starts a span, to use with `with`. While tracing is disabled it returns a shared no-op span.
+    """
+    exporter = get_exporter()
+    if exporter is None:
+        return _NOOP_SPAN
+    return Span(exporter, name, kind, attributes)
+
+def node_span(node: str, config: dict):
+    """
+    The span of a node of the graph, with the thread_id of the book and the step of the graph it runs in.
+    """
+    exporter = get_exporter()
+    thread_id = config.get('configurable', {}).get('thread_id')
+    if exporter is None:
+        return _NodeContext(_NOOP_SPAN, thread_id, node)
+    return _NodeContext(Span(exporter, node, 'node', {'thread_id': thread_id, 'node': node, 'step': config.get('metadata', {}).get('langgraph_step')}), thread_id, node)
+
+def add_span_event(name: str, **attributes):
+    """
+    Attaches an event to the current span, if any.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.add_event(name, **attributes)
+
+def log_event(message: str):
+    """
+    Logs a message of the agents, with the thread_id and the node it was logged in, and attaches it to the current span, if any.
+    """
+    logger.info(message)
+    add_span_event('log', message = message)
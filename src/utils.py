@@ -8,18 +8,18 @@ os.chdir(WORKDIR)
 sys.path.append(WORKDIR)
 
 from pydantic import BaseModel
+import re
 import json
 import operator
-from typing import Annotated, List, Literal, TypedDict
+from functools import lru_cache
+from typing import Annotated, List, Literal, Optional, TypedDict
 from langchain_core.messages import AnyMessage, HumanMessage
-from pydantic import BaseModel, Field
-from langchain_openai.chat_models import ChatOpenAI
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_aws.chat_models import ChatBedrock
+from pydantic import BaseModel, Field, model_serializer
 from src.constants import *
-import time
-import re
+from src.cache import is_cached_node
+from src.model_registry import get_chat_model
+from src.json_parser import NoJson, BadFormattedJson, parse_llm_json
+from src.chapter_validator import validate_chapter
 
 class GraphConfig(TypedDict):
     """
@@ -28,52 +28,115 @@ class GraphConfig(TypedDict):
     Attributes:
     - language: The language in which the system prompts will be generated. eg: 'english', 'spanish', etc...
     - critiques_in_loop: Set to False if you only want a single critique per writing. Set to True if you want multiple critique iterations until the writing is approved.
-    - instructor_model: Select the model for the instructor node. Options include 'openai', 'google', 'meta', 'deepseek', or 'amazon'.
-    - brainstormer_idea_model: Select the model for the brainstormer idea node. Options include 'openai', 'google', 'meta', 'deepseek', or 'amazon'.
-    - brainstormer_critique_model: Select the model for the brainstormer critique node. Options include 'openai', 'google', 'meta', 'deepseek', or 'amazon'.
-
-    - writer_model: Select the model for the writer node. Options include 'openai', 'google', 'meta', 'deepseek', or 'amazon'.
-    - writing_reviewer_model: Select the model for the writing reviewer node. Options include 'openai', 'google', 'meta', 'deepseek', or 'amazon'.
+    - instructor_model: Select the model for the instructor node. Options include 'openai', 'google', 'meta', 'deepseek', 'amazon', or 'fake' (offline, see src/fake_provider.py).
+    - brainstormer_idea_model: Select the model for the brainstormer idea node. Options include 'openai', 'google', 'meta', 'deepseek', 'amazon', or 'fake' (offline, see src/fake_provider.py).
+    - brainstormer_critique_model: Select the model for the brainstormer critique node. Options include 'openai', 'google', 'meta', 'deepseek', 'amazon', or 'fake' (offline, see src/fake_provider.py).
+
+    - writer_model: Select the model for the writer node. Options include 'openai', 'google', 'meta', 'deepseek', 'amazon', or 'fake' (offline, see src/fake_provider.py).
+    - writing_reviewer_model: Select the model for the writing reviewer node. Options include 'openai', 'google', 'meta', 'deepseek', 'amazon', or 'fake' (offline, see src/fake_provider.py).
+    - patch_revisions: Set to True if you want the Writer to revise a chapter (after a critique, or when it is too short) with targeted edits of its paragraphs, applied locally, instead of writing the whole chapter again.
+    - diff_reviews: Set to True if you want the Writing Reviewer to re-review a revised chapter from the paragraphs that changed since the critiqued version (and its previous feedback), instead of reading the whole chapter again.
+    - diff_review_max_change_ratio: Share of the paragraphs changed by a revision above which the Writing Reviewer reads the whole chapter anyway when diff_reviews is True (0.5 by default).
+    - parallel_translation: Set to True if you want to translate all the approved chapters concurrently, instead of one chapter per step.
+    - translation_max_workers: Maximum number of chapters translated at the same time when parallel_translation is True.
+    - pipelined_translation: Set to True if you want each chapter translated as soon as it is approved, while the next one is written, and the book title and prologue right after the brainstorming.
+    - parallel_drafting: Set to True if you want all the chapters drafted concurrently from their summaries, followed by a continuity pass that reconciles each chapter with the previous one, instead of writing and reviewing them one after the other.
+    - drafting_max_workers: Maximum number of chapters drafted (and reconciled) at the same time when parallel_drafting is True.
+    - brainstorming_candidates: Number of candidate ideas drafted and graded concurrently by the Brainstorming Idea agents (1 by default). The best one advances if it is approved, otherwise it is refined in the critique loop.
+    - brainstorming_max_workers: Maximum number of candidate ideas drafted (or graded) at the same time. By default all of them.
+    - lean_schemas: Keys of the models ('instructor_model', 'brainstormer_idea_model', 'writer_model') whose agents answer without the reasoning and reflection steps, so they generate (and keep in their memory) only the result.
+    - cached_nodes: Keys of the models (eg: 'writer_model', 'translator_model') whose responses are cached on disk, so re-running the same book doesn't pay again for them. By default the temperature=0 nodes: instructor, writing reviewer and translator.
+    - structured_output_max_attempts: Maximum number of calls made to get a valid JSON object from an agent before failing (the first one plus the corrective retries).
+    - streaming: If True, the agents stream their replies: the progress is emitted in the `custom` stream mode and the Writer and the Writing Reviewer are stopped as soon as their outcome is known. The agents in cached_nodes are invoked without streaming, so the cache still applies to them.
+    - continue_truncated_outputs: If True (default), a reply cut before the end of its JSON object (by the maximum of output tokens) is continued from where it was cut, and the pieces are stitched before parsing, instead of generating the whole reply again.
+    - chapter_max_tokens: Set to True if you want the maximum of output tokens of the agents that write whole chapters (the Writer and the Translator) set from the expected size of a chapter (min_paragraph_per_chapter × min_sentences_in_each_paragraph_per_chapter), instead of the default of the provider.
+    - memory_recent_chapters: Number of the last chapters kept verbatim in the memory of the Writer and the Writing Reviewer. The older ones are sent as a short summary.
+    - memory_max_tokens: Approximate token budget of the memory of the Writer and the Writing Reviewer. If it is exceeded, fewer chapters are kept verbatim and the oldest summaries are dropped.
+    - max_tokens_per_book: Optional cap of the tokens (prompt and completion) spent by the book.
+    - max_seconds_per_book: Optional cap of the time spent by the book, counted from its first LLM call.
+    - on_budget_exceeded: What happens when a cap is reached: 'stop' (default) stops the run before the next LLM call, 'degrade' keeps writing and translating but skips the critiques and reviews.
     """
     language: Literal['english', 'spanish', 'portuguese', 'poland', 'french', 'german', 'italian', 'dutch','swedish', 'norwegian', 'danish', 'finnish', 'russian', 'chinese', 'japanese', 'korean','arabic', 'turkish', 'greek', 'hebrew']
     critiques_in_loop: bool
-    instructor_model: Literal['openai', 'google','meta','amazon','deepseek']
-    brainstormer_idea_model: Literal['openai','google','meta', 'amazon','deepseek']
-    brainstormer_critique_model: Literal['openai','google','meta', 'amazon','deepseek'] 
-    writer_model: Literal['openai', 'google','meta','amazon','deepseek']
-    writing_reviewer_model: Literal['openai', 'google','meta','amazon','deepseek']
-    translator_model: Literal['openai', 'google','meta','amazon','deepseek']
+    instructor_model: Literal['openai', 'google','meta','amazon','deepseek','fake']
+    brainstormer_idea_model: Literal['openai','google','meta', 'amazon','deepseek','fake']
+    brainstormer_critique_model: Literal['openai','google','meta', 'amazon','deepseek','fake'] 
+    writer_model: Literal['openai', 'google','meta','amazon','deepseek','fake']
+    writing_reviewer_model: Literal['openai', 'google','meta','amazon','deepseek','fake']
+    translator_model: Literal['openai', 'google','meta','amazon','deepseek','fake']
     n_chapters: int
     min_paragraph_per_chapter: int
     min_sentences_in_each_paragraph_per_chapter: int
+    patch_revisions: bool
+    diff_reviews: bool
+    diff_review_max_change_ratio: float
+    parallel_translation: bool
+    translation_max_workers: int
+    pipelined_translation: bool
+    parallel_drafting: bool
+    drafting_max_workers: int
+    brainstorming_candidates: int
+    brainstorming_max_workers: int
+    lean_schemas: List[Literal['instructor_model','brainstormer_idea_model','writer_model']]
+    cached_nodes: List[Literal['instructor_model','brainstormer_idea_model','brainstormer_critique_model','writer_model','writing_reviewer_model','translator_model']]
+    structured_output_max_attempts: int
+    streaming: bool
+    continue_truncated_outputs: bool
+    chapter_max_tokens: bool
+    memory_recent_chapters: int
+    memory_max_tokens: int
+    max_tokens_per_book: int
+    max_seconds_per_book: int
+    on_budget_exceeded: Literal['stop', 'degrade']
+
+# Expected size of the chapters, to set the maximum of output tokens of the agents that write them (see `chapter_max_tokens`)
+TOKENS_PER_SENTENCE = 30
+CHAPTER_SIZE_MARGIN = 2.0
+REPLY_OVERHEAD_TOKENS = 1000
+
+# Fields where the agents reason before answering
+SCRATCHPAD_FIELDS = ['reasoning_step', 'reflection_step']
+# How the prompts and the descriptions of the schemas refer to them
+_SCRATCHPAD_KEYS = re.compile(r'with (\d+) keys UNIQUELY: "reasoning_step", "reflection_step"?, ')
+_SCRATCHPAD_MENTION = re.compile(r"\s*Optimized (?:based on|with) the reasoning and reflection steps\.?|,?\s*(?:and\s+)?optimized (?:based on|with) the reasoning and reflection steps")
+
+class ScratchpadModel(BaseModel):
+    """
+    Base of the outputs where the agent reasons before answering. The reasoning and reflection steps are optional: the agents
+    in `lean_schemas` aren't asked for them, and then they are left out of the dumps of the output (so of the memories too).
+    """
+    @model_serializer(mode = 'wrap')
+    def _drop_empty_scratchpad(self, handler):
+        data = handler(self)
+        return {key: value for key, value in data.items() if not (key in SCRATCHPAD_FIELDS and value == '')}
 
-class DocumentationReady(BaseModel):
+class DocumentationReady(ScratchpadModel):
     """
     This tool is called for confirming that the Instructor has the necessary information to pass to the writer about the user requirements
     """
 
-    reasoning_step: str = Field(description = "In-depth explanation of your step by step reasoning about how to proceed.")
-    reflection_step: str = Field(description = "In-depth review of your reasoning process so, if you detect that you made a mistake in your thoughts, at any point, correct yourself in this field.")
+    reasoning_step: str = Field(default = '', description = "In-depth explanation of your step by step reasoning about how to proceed.")
+    reflection_step: str = Field(default = '', description = "In-depth review of your reasoning process so, if you detect that you made a mistake in your thoughts, at any point, correct yourself in this field.")
     topic: str = Field(description="The desired topic of the user, with high details and optimized with the reasoning and reflection steps")
     target_audience: str = Field(description = "The desired target audience the book should point to,  with high details,  and optimized with the reasoning and reflection steps")
     genre: str = Field(description="Genre of the book to develop,  with high details,  optimized based on the reasoning and reflection steps")
     writing_style: str = Field(description="The desired tone, style or book reference the writing should respect, with high details,  optimized based on the reasoning and reflection steps")
     additional_requirements: str = Field(description = "More requirements beyond topic, target audience, genre and writing style.  Optimized based on the reasoning and reflection steps")
 
-class NarrativeBrainstormingStructuredOutput(BaseModel):
+class NarrativeBrainstormingStructuredOutput(ScratchpadModel):
     """
     This tool defines the foundational narrative of the story based on the original set up. 
     """
-    reasoning_step: str = Field(description = "In-depth explanation of your step by step reasoning about how to develop the general narrative along the evolution of the story.")
-    reflection_step: str = Field(description = "In-depth review of your thoughts: If you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
+    reasoning_step: str = Field(default = '', description = "In-depth explanation of your step by step reasoning about how to develop the general narrative along the evolution of the story.")
+    reflection_step: str = Field(default = '', description = "In-depth review of your thoughts: If you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
     chapters_summaries: List[str] = Field(description = "A list where each element is a STRING summary of each chapter. Each element on the list should contain a detailed description of what happen on it, with well explained intro-development-ending stages. Each summary MUST HAVE a length of 5 sentences minimum. Optimized based on the reasoning and reflection steps.")
 
-class IdeaBrainstormingStructuredOutput(BaseModel):
+class IdeaBrainstormingStructuredOutput(ScratchpadModel):
     """
     This tool is used in order to structure the proposed writting idea into specific detailed sections that covers the main points of the story.
     """
-    reasoning_step: str = Field(description = "In-depth explanation of your step by step reasoning about how how the story will consist based on the user requirements")
-    reflection_step: str = Field(description = "In-depth review of your thoughts: if you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
+    reasoning_step: str = Field(default = '', description = "In-depth explanation of your step by step reasoning about how how the story will consist based on the user requirements")
+    reflection_step: str = Field(default = '', description = "In-depth review of your thoughts: if you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
     story_overview: str = Field(description="Place a highly detailed overview of the narrative that includes a strong introduction, a well-developed middle, and a satisfying conclusion. Optimized based on the reasoning and reflection steps.")
     characters: str = Field(description = "Place the description of the characters of the story, in one paragraph each one.  Describe their background, motivations, and situations along the at the story journey. Be as detailed as possible.  Optimized based on the reasoning and reflection steps.")
     writing_style: str = Field(description="Place the style and tone the writer should consider while developing the book.  Optimized based on the reasoning and reflection steps.")
@@ -106,15 +169,28 @@ class TranslatorSpecialCaseStructuredOutput(BaseModel):
     translated_book_name: str = Field(description = "The translation of the book name")
     translated_book_prologue: str = Field(description= "The translation of the prologue of the book")
 
-class WriterStructuredOutput(BaseModel):
+class WriterStructuredOutput(ScratchpadModel):
     """
     This tool is used for structuring the generation of the writer.
     """
-    reasoning_step: str = Field(description = "In-depth explanation of your step by step reasoning about how you will write the story based on the proposed idea")
-    reflection_step: str = Field(description = "In-depth review of your thoughts: if you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
+    reasoning_step: str = Field(default = '', description = "In-depth explanation of your step by step reasoning about how you will write the story based on the proposed idea")
+    reflection_step: str = Field(default = '', description = "In-depth review of your thoughts: if you detect that you made a mistake in your reasoning step, at any point, correct yourself in this field.")
     content: str = Field(description = "Place the content inside the developed chapter, avoid putting the name of the chapter here. Optimized based on the reasoning and reflection steps.")
     chapter_name: str = Field(description = "Place the name of the developed chapter. It should be original and creative. Optimized based on the reasoning and reflection steps.")
 
+class WriterRevisionStructuredOutput(BaseModel):
+    """
+    This tool is used for revising a chapter with targeted edits of its paragraphs, instead of writing it again.
+    """
+    edits: List[str] = Field(description = "Each element is an edit of a paragraph of the chapter, numbered as in the chapter you were given, with one of these formats: 'expand <n>: <sentences appended to the paragraph n>', 'replace <n>: <new text of the paragraph n>', 'insert_after <n>: <new paragraph after the paragraph n>'.")
+
+class ContinuityEditorStructuredOutput(BaseModel):
+    """
+    This tool is used for reconciling a chapter drafted in parallel with the previous chapter.
+    """
+    corrections: List[str] = Field(description = "Each element is a fix of a name or a fact that contradicts the previous chapter, with the format: 'exact text in the chapter => replacement'. Empty if there is nothing to fix.")
+    first_paragraph: str = Field(description = "The first paragraph of the chapter rewritten so it follows naturally from the end of the previous chapter. Empty if the transition is already right.")
+
 class ApprovedWriterChapter(BaseModel):
     """
     This tool is used when the reviewer approves the chapter and its content based on its analysis.
@@ -134,6 +210,16 @@ class ApprovedBrainstormingIdea(BaseModel):
     grade: int = Field(description = "The overall grade (in scale from 0 to 10) assigned to the draft idea based on the criterias. It should be allign with the feedback.")
     feedback: str = Field(description = "Provide highly detailed feedback and improvements in case it is not approved.")
 
+class StoryBible(BaseModel):
+    """
+    The prompt sections of the book that don't change once the brainstorming is approved, rendered once (see src/story_bible.py).
+    """
+    user_requirements: str
+    draft: str
+    writer_system_prompt: str
+    reviewer_system_prompt: str
+    translator_system_prompt: str
+
 class State(TypedDict):
     content: Annotated[List[str], operator.add]
     translated_content: Annotated[List[str], operator.add]
@@ -174,6 +260,8 @@ class State(TypedDict):
     plannified_resolution: str
     plannified_epilogue: str
     plannified_chapters_summaries: List[str]
+    story_bible: StoryBible
+    brainstorming_report: dict
     plannified_chapters_messages: Annotated[List[AnyMessage], operator.add]
     characters: str
     writing_style: str
@@ -182,6 +270,7 @@ class State(TypedDict):
     is_chapter_approved: bool
     english_version_book: str
     translated_version_book: str
+    run_report: dict
     critique_brainstorming_narrative_messages: Annotated[List[AnyMessage], operator.add]
 
 
@@ -200,31 +289,32 @@ class GraphOutput(TypedDict):
     content: Annotated[List[str], operator.add]
     chapter_names: Annotated[List[str], operator.add]
 
-def _get_model(config: GraphConfig, key:Literal['instructor_model','brainstormer_idea_model','brainstormer_critique_model','writer_model','writing_reviewer_model','translator_model'], temperature:float, default:Literal['openai', 'google','meta','amazon']='openai', top_k=50, top_p=0.9):
+def _get_model(config: GraphConfig, key:Literal['instructor_model','brainstormer_idea_model','brainstormer_critique_model','writer_model','writing_reviewer_model','translator_model'], temperature:float, default:Literal['openai', 'google','meta','amazon','fake']='openai', top_k=50, top_p=0.9, max_tokens: Optional[int] = None):
+    """
+    Returns the chat model of the node from the registry, so the clients (and their connection pools) are reused between calls and books
+    """
     model = config['configurable'].get(key, default)
-    if model == "openai":
-        return ChatOpenAI(temperature=temperature, model="gpt-4o-mini", top_k = top_k, top_p = top_p)
-    elif model == "google":
-        return ChatGoogleGenerativeAI(temperature=temperature, model="gemini-exp-1206", top_k = top_k, top_p = top_p)
-    elif model == 'meta':
-        return ChatGroq(temperature=temperature, model="llama-3.3-70b-versatile", model_kwargs = {'top_p':top_p}) #Groq doesnt support top_k
-    elif model == 'deepseek':
-        return ChatGroq(temperature=temperature, model="deepseek-r1-distill-llama-70b",model_kwargs = {'top_p':top_p}) #Groq doesnt support top_k
-    
-    elif model == 'amazon':
-        return ChatBedrock(model_id = 'anthropic.claude-3-5-sonnet-20240620-v1:0', model_kwargs = {'temperature':temperature, 'top_k': top_k, 'top_p': top_p})
-    else:
-        raise ValueError(f"Unsupported model: '{model}'. Expected one of: 'openai', 'google', 'meta', 'deepseek', 'amazon'")
+    return get_chat_model(provider = model, temperature = temperature, top_k = top_k, top_p = top_p, cached = is_cached_node(config, key), max_tokens = max_tokens)
+
+def chapter_max_tokens(config: GraphConfig) -> Optional[int]:
+    """
+    Maximum of output tokens of the agents that write whole chapters, from the expected size of a chapter: its minimum of
+    sentences, with room for the longer chapters, plus the rest of the reply (chapter name, reasoning and reflection steps, JSON).
+    None (the default of the provider) unless `chapter_max_tokens` is True. The replies cut by it are continued, see `invoke_structured`.
+    """
+    if not config['configurable'].get('chapter_max_tokens', False):
+        return None
+    min_paragraphs = config['configurable'].get('min_paragraph_per_chapter', 10)
+    min_sentences = config['configurable'].get('min_sentences_in_each_paragraph_per_chapter', 5)
+    return int(min_paragraphs * min_sentences * TOKENS_PER_SENTENCE * CHAPTER_SIZE_MARGIN) + REPLY_OVERHEAD_TOKENS
 
     
-def check_chapter(msg_content:str, min_paragraphs: int):
+def check_chapter(msg_content:str, min_paragraphs: int, min_sentences: int = None):
     """
     This function validates that the generated chapter contains a the minimum size that the user asks for in terms of paragraphs
+    (and of sentences in each paragraph, if given). See src/chapter_validator.py for the details of what is short.
     """
-    if len(msg_content.split('\n\n')) >= min_paragraphs:
-        return True
-    else:
-        return False
+    return validate_chapter(msg_content, min_paragraphs, min_sentences).is_valid
     
 def retrieve_model_name(model):
     try:
@@ -237,115 +327,47 @@ def retrieve_model_name(model):
 
     return model_name
 
-def adding_delay_for_rate_limits(model):
-    """
-    Google API and Groq API free plans has limit rates so we avoid reaching them
-    """
-    model_name = retrieve_model_name(model)
-    if re.search('gemini|llama', model_name) is not None:
-        time.sleep(6)
-
-class NoJson(Exception):
-    pass
-
-class BadFormattedJson(Exception):
-    pass
-
 def cleaning_llm_output(llm_output):
+    """
+    Extracts the JSON object from the reply of the model, fixing locally its syntax mistakes when possible.
 
-    content = llm_output.content
-    
-    # Phase 1: JSON Extraction
-    try:
-        match = re.search(r"```json\s*([\s\S]*?)\s*```", content)
-        if not match:
-            match_inline = re.search(r"({.*?}|\[.*?\])", content, re.DOTALL)
-            if match_inline:
-                json_content = match_inline.group(0).strip()
-            else:
-                raise NoJson("The output does not contain a JSON code block")
-        else: 
-            json_content = match.group(1)
-        
-    except re.error as e:
-        print(f"Regex error during extraction: {str(e)}")
-        return content
-
-    # Phase 2: Content Cleaning
-    try:
-        # Remove remaining backticks and normalize whitespace
-        try:
-            json_content = re.sub(r"```", "", json_content)
-            parsed = json.loads(json_content)                                
-            return parsed
-        except:
-            pass
-        try:
-            json_content = re.sub(r"\s+", " ", json_content)
-            parsed = json.loads(json_content)
-            return parsed
-        except:
-            pass
-        
-        json_content = json_content.replace('\\', '')
-        json_content = json_content.strip()
-
-    except re.error as e:
-        print(f"Regex error during cleaning: {str(e)}")
-        return content
-
-    # Phase 3: JSON Validation
-    try:
-        # Fix common JSON issues
-        json_content = re.sub(
-            r',\s*([}\]])', r'\1',  # Remove trailing commas
-            json_content
-        )
-        json_content = re.sub(
-            r"([{:,])\s*'([^']+)'\s*([,}])",  # Convert single quotes to double
-            r'\1"\2"\3', 
-            json_content
-        )
-        
-    except re.error as e:
-        return content
-
-    # Phase 4: Parsing
-    try:
-        parsed = json.loads(json_content)
-        return parsed
-    except:
-        try:
-            def escape_value_quotes(match):
-                value = match.group(1)
-                return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
-
-            # Improved regex to handle whitespace and escaped quotes in values
-            pattern = r'(?<=:)\s*"(.*?[^\\])"(?=\s*[,}\]])'
-
-            json_content = re.sub(pattern, escape_value_quotes, json_content)
-
-            return json.loads(json_content)
-
-        except json.JSONDecodeError as e:
-            raise BadFormattedJson({"error": f"While trying to format the JSON object you have generated we detect the following error: {e.args[0]}", "detail": f"Error location: Line {e.lineno}, Column {e.colno}", "context": f"{e.doc[e.pos-50:e.pos+50]}"})
-
-
-
+    :param llm_output: The AIMessage generated by the model
+    :return: The parsed JSON object
+    :raises NoJson: If the reply doesn't contain a JSON object
+    :raises BadFormattedJson: If the JSON object can't be recovered
+    """
+    return parse_llm_json(llm_output.content)
 
-def get_json_schema(pydantic_class: BaseModel) -> dict:
+@lru_cache(maxsize = None)
+def get_json_schema(pydantic_class: BaseModel, lean: bool = False) -> dict:
     """
     This function receives a Pydantic class and returns its JSON schema representation.
+    It is memoized: the schemas are fixed, and they are sent in the prompts of every book.
 
     :param pydantic_class: A Pydantic class that inherits from BaseModel
+    :param lean: If True, the reasoning and reflection steps (and the mentions to them) are left out of the schema
     :return: A dictionary representing the JSON schema of the input class
     """
     data = pydantic_class.model_json_schema()
     schema_description = data['description']
     data_keys = {key: {"description": value['description'], "type": value['type']} for key, value in data['properties'].items()}
+    if lean:
+        data_keys = {key: {**value, "description": _SCRATCHPAD_MENTION.sub('', value['description'])} for key, value in data_keys.items() if key not in SCRATCHPAD_FIELDS}
     description = f"The schema is about: '{schema_description}'\n\nThis is the schema definition:\n" + json.dumps(data_keys, indent = 4)
     return description
 
+def is_lean_node(config: GraphConfig, key: str) -> bool:
+    """
+    Whether the agent of the model `key` answers without the reasoning and reflection steps (see `lean_schemas`).
+    """
+    return key in config['configurable'].get('lean_schemas', [])
+
+def lean_prompt(prompt: str) -> str:
+    """
+    Removes the reasoning and reflection steps from the keys that a system prompt asks for, for the agents in `lean_schemas`.
+    """
+    return _SCRATCHPAD_KEYS.sub(lambda match: f'with {int(match.group(1)) - len(SCRATCHPAD_FIELDS)} keys UNIQUELY: ', prompt)
+
 
 if __name__ == '__main__':
     from langchain_core.messages import AIMessage, HumanMessage, SystemMessage